@@ -1 +1,63 @@
-# API package initialization
+"""
+API package initialization
+
+Resources are grouped into blueprints that the application factory
+registers by name. A blueprint's resource modules are only imported when it
+is registered, so a worker serving part of the API does not load the rest.
+"""
+
+from importlib import import_module
+from flask import Blueprint
+from flask_restful import Api
+from utils.flask_json import output_json
+
+# Resources of each blueprint as (module, class, URL)
+BLUEPRINTS = {
+    'payments': (
+        ('api.credit_card', 'CreditCardPayment', '/api/credit-card/payment'),
+        ('api.credit_card', 'SeamlessCardRegister', '/api/credit-card/seamless/register'),
+        ('api.credit_card', 'SeamlessCardConfirm', '/api/credit-card/seamless/confirm'),
+        ('api.qr_payment', 'GenerateQR', '/api/qr/generate'),
+        ('api.rabbit_line_pay', 'RabbitLinePayPayment', '/api/rabbit-line-pay/payment'),
+        ('api.installment', 'InstallmentPayment', '/api/installment/payment'),
+        ('api.installment', 'InstallmentPlans', '/api/installment/plans'),
+        ('api.internet_banking', 'InternetBankingPayment', '/api/banking/payment'),
+        ('api.inquiry', 'PaymentInquiry', '/api/payment/inquiry'),
+        ('api.void_refund', 'VoidRefund', '/api/payment/void-refund'),
+        ('api.request_to_pay', 'BulkRequestToPay', '/api/request-to-pay/bulk'),
+    ),
+    'webhook': (
+        ('api.webhook', 'WebhookHandler', '/api/webhook'),
+    ),
+    'admin': (
+        ('api.admin', 'ProfilingAdmin', '/api/admin/profiling'),
+        ('api.admin', 'RevenueAdmin', '/api/admin/revenue'),
+        ('api.admin', 'TransactionSearch', '/api/admin/transactions'),
+        ('api.admin', 'MemoryAdmin', '/api/admin/memory'),
+        ('api.admin', 'SubscribersAdmin', '/api/admin/subscribers'),
+    ),
+}
+
+
+def create_blueprint(name):
+    """
+    Import the resources of a blueprint and register their URLs
+
+    Args:
+        name (str): Blueprint name, a key of BLUEPRINTS
+
+    Returns:
+        flask.Blueprint: Blueprint ready to register on the app
+
+    Raises:
+        ValueError: If the blueprint is unknown
+    """
+    if name not in BLUEPRINTS:
+        raise ValueError(f"Unknown API blueprint: {name}")
+
+    blueprint = Blueprint(name, __name__)
+    api = Api(blueprint)
+    api.representations['application/json'] = output_json
+    for module, resource, url in BLUEPRINTS[name]:
+        api.add_resource(getattr(import_module(module), resource), url)
+    return blueprint
@@ -0,0 +1,305 @@
+import csv
+import gc
+import hmac
+import io
+import logging
+import time
+from functools import wraps
+from flask import request, jsonify, Response
+from flask_restful import Resource
+from utils.profiling import request_profiler, sampling_profiler
+from utils.memory import memory_tracker
+from utils.lifecycle import lifecycle
+from utils.fanout import get_registry
+from utils.replay_guard import parse_transaction_time
+from utils.revenue import get_revenue_rollup, GRANULARITIES, DIMENSIONS
+from utils.transactions import get_transaction_store
+from utils import json_codec
+from config import ADMIN_API_TOKEN, ERROR_CODES
+
+logger = logging.getLogger(__name__)
+
+def require_admin(method):
+    """Reject requests without a valid X-Admin-Token header"""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        # Compared as bytes: compare_digest() rejects non-ASCII strings with TypeError
+        token = request.headers.get('X-Admin-Token', '').encode('utf-8', 'surrogateescape')
+        if not ADMIN_API_TOKEN or not hmac.compare_digest(token, ADMIN_API_TOKEN.encode('utf-8')):
+            logger.warning(f"Rejected admin request to {request.path} from {request.remote_addr}")
+            return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Admin token required"}), 403
+        return method(*args, **kwargs)
+    return wrapper
+
+class ProfilingAdmin(Resource):
+    """Handle Profiling Admin API"""
+    
+    method_decorators = [require_admin]
+    
+    def get(self):
+        """Get the state of the request and sampling profilers"""
+        return {
+            "requests": request_profiler.status(),
+            "sampling": sampling_profiler.status()
+        }, 200
+    
+    def post(self):
+        """
+        Control the profilers
+        
+        Expected payload:
+        {
+            "action": "profile_requests",  # or "cancel_requests", "start_sampling", "stop_sampling", "dump_sampling"
+            "count": 10,                   # profile_requests: number of requests to profile
+            "path_prefix": "/api/",        # profile_requests: only matching paths
+            "interval": 0.01,              # start_sampling: seconds between samples
+            "duration": 60                 # start_sampling: stop automatically after this many seconds
+        }
+        """
+        try:
+            payload = request.get_json(silent=True)
+            if not isinstance(payload, dict):
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid JSON payload"}), 400
+            action = payload.get('action')
+            
+            if action == 'profile_requests':
+                count = int(payload.get('count', 1))
+                request_profiler.enable(count=count, path_prefix=payload.get('path_prefix'))
+                return {"status": "SUCCESS", "message": f"Profiling next {count} requests"}, 200
+            
+            elif action == 'cancel_requests':
+                request_profiler.disable()
+                return {"status": "SUCCESS", "message": "Request profiling cancelled"}, 200
+            
+            elif action == 'start_sampling':
+                started = sampling_profiler.start(
+                    interval=payload.get('interval'),
+                    duration=payload.get('duration')
+                )
+                if not started:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Sampling profiler already running"}), 409
+                return {"status": "SUCCESS", "message": "Sampling profiler started"}, 200
+            
+            elif action in ('stop_sampling', 'dump_sampling'):
+                output = sampling_profiler.stop() if action == 'stop_sampling' else sampling_profiler.dump()
+                return {"status": "SUCCESS", "file": output, "sampling": sampling_profiler.status()}, 200
+            
+            return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Unknown action: {action}"}), 400
+            
+        except Exception as e:
+            logger.exception("Error controlling profiler")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+
+class RevenueAdmin(Resource):
+    """Handle Revenue Rollup Admin API"""
+    
+    method_decorators = [require_admin]
+    
+    def get(self):
+        """
+        Query revenue per bucket, optionally grouped and filtered
+        
+        Query parameters:
+            granularity: "hour" (default) or "day"
+            start, end: ISO 8601 date/time or epoch seconds (default: today, Thai time)
+            group_by: comma separated payment_method, merchant_id, route (default: all)
+            payment_method, merchant_id, route: exact filters
+            format: "json" (default) or "csv"
+        """
+        try:
+            args = request.args
+            granularity = args.get('granularity', 'hour')
+            if granularity not in GRANULARITIES:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Unknown granularity: {granularity}"}), 400
+            
+            rollup = get_revenue_rollup()
+            today = rollup.bucket_start(time.time(), 'day')
+            start = self._parse_time(args.get('start'), today)
+            end = self._parse_time(args.get('end'), today + GRANULARITIES['day'])
+            if start is None or end is None:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid start or end"}), 400
+            
+            group_by = args.get('group_by')
+            group_by = DIMENSIONS if group_by is None else tuple(d for d in group_by.split(',') if d in DIMENSIONS)
+            filters = {dim: args.get(dim) for dim in DIMENSIONS if args.get(dim) is not None}
+            
+            rows = rollup.query(granularity, start, end, group_by=group_by, **filters)
+            
+            if args.get('format') == 'csv':
+                output = io.StringIO()
+                writer = csv.writer(output)
+                columns = ['bucket'] + [d for d in DIMENSIONS if d in group_by] + \
+                    ['payments', 'amount', 'refunds', 'refund_amount', 'net_amount']
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow([row[column] for column in columns])
+                return Response(output.getvalue(), mimetype='text/csv')
+            
+            return {
+                "granularity": granularity,
+                "start": start,
+                "end": end,
+                "rows": rows
+            }, 200
+            
+        except Exception as e:
+            logger.exception("Error querying revenue rollups")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+    
+    @staticmethod
+    def _parse_time(value, default):
+        if value is None:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            return parse_transaction_time(value)
+
+class TransactionSearch(Resource):
+    """Handle Transaction Search Admin API"""
+    
+    method_decorators = [require_admin]
+    
+    # Largest page a single request may ask for; use export for more
+    MAX_LIMIT = 500
+    
+    def get(self):
+        """
+        Search indexed transactions, newest first
+        
+        Query parameters:
+            order_id: order id prefix
+            email, phone, status, merchant_id: exact matches (email and phone are normalized)
+            start, end: ISO 8601 date/time or epoch seconds on created_at
+            limit: page size (default 50, at most 500)
+            cursor: next_cursor from the previous page
+            export: "true" to stream every match instead of one page
+        
+        The response is streamed: {"results": [...], "next_cursor": "..."}
+        """
+        try:
+            args = request.args
+            start = RevenueAdmin._parse_time(args.get('start'), None)
+            end = RevenueAdmin._parse_time(args.get('end'), None)
+            if (args.get('start') and start is None) or (args.get('end') and end is None):
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid start or end"}), 400
+            
+            criteria = {
+                'order_id_prefix': args.get('order_id'),
+                'email': args.get('email'),
+                'phone': args.get('phone'),
+                'status': args.get('status'),
+                'merchant_id': args.get('merchant_id'),
+                'start': start,
+                'end': end,
+            }
+            store = get_transaction_store()
+            
+            if args.get('export', '').lower() == 'true':
+                rows, next_cursor = store.iter_search(**criteria), None
+            else:
+                try:
+                    limit = min(max(int(args.get('limit', 50)), 1), self.MAX_LIMIT)
+                    rows, next_cursor = store.search(cursor=args.get('cursor'), limit=limit, **criteria)
+                except ValueError as e:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": str(e)}), 400
+            
+            return Response(self._stream(rows, next_cursor), mimetype='application/json')
+            
+        except Exception as e:
+            logger.exception("Error searching transactions")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+    
+    @staticmethod
+    def _stream(rows, next_cursor):
+        yield b'{"results":['
+        separator = b''
+        for row in rows:
+            yield separator + json_codec.dumps_bytes(row)
+            separator = b','
+        yield b'],"next_cursor":' + json_codec.dumps_bytes(next_cursor) + b'}'
+
+class MemoryAdmin(Resource):
+    """Handle Memory Admin API"""
+    
+    method_decorators = [require_admin]
+    
+    def get(self):
+        """Get RSS, heap and tracemalloc figures of the worker serving the request"""
+        return memory_tracker.status(), 200
+    
+    def post(self):
+        """
+        Control memory tracing of the worker serving the request
+        
+        Expected payload:
+        {
+            "action": "snapshot",  # or "start_tracing", "stop_tracing", "baseline", "gc", "recycle"
+            "frames": 1,           # start_tracing: frames stored per allocation
+            "top": 25,             # snapshot: number of allocation sites
+            "group_by": "lineno",  # snapshot: "lineno", "filename" or "traceback"
+            "compare": false,      # snapshot: growth since the baseline instead of totals
+            "dump": false          # snapshot: also write the raw snapshot under PROFILE_DIR
+        }
+        """
+        try:
+            payload = request.get_json(silent=True)
+            if not isinstance(payload, dict):
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid JSON payload"}), 400
+            action = payload.get('action')
+            
+            if action == 'start_tracing':
+                if not memory_tracker.start_tracing(payload.get('frames')):
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "tracemalloc already tracing"}), 409
+                return {"status": "SUCCESS", "message": "tracemalloc started"}, 200
+            
+            elif action == 'stop_tracing':
+                memory_tracker.stop_tracing()
+                return {"status": "SUCCESS", "message": "tracemalloc stopped"}, 200
+            
+            elif action == 'baseline':
+                memory_tracker.take_baseline()
+                return {"status": "SUCCESS", "memory": memory_tracker.status()}, 200
+            
+            elif action == 'snapshot':
+                try:
+                    snapshot = memory_tracker.snapshot(
+                        top=int(payload.get('top', 25)),
+                        group_by=payload.get('group_by', 'lineno'),
+                        compare=bool(payload.get('compare')),
+                        dump=bool(payload.get('dump'))
+                    )
+                except ValueError as e:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": str(e)}), 400
+                return {"status": "SUCCESS", "snapshot": snapshot}, 200
+            
+            elif action == 'gc':
+                collected = gc.collect()
+                return {"status": "SUCCESS", "collected": collected, "memory": memory_tracker.status()}, 200
+            
+            elif action == 'recycle':
+                # Without a master to start a replacement the server would just stop
+                if not lifecycle.managed:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Not running under the production server"}), 409
+                memory_tracker.recycle()
+                return {"status": "SUCCESS", "message": "Worker recycling after in-flight requests"}, 202
+            
+            return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Unknown action: {action}"}), 400
+            
+        except Exception as e:
+            logger.exception("Error controlling memory tracing")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+
+class SubscribersAdmin(Resource):
+    """Handle Webhook Subscribers Admin API"""
+    
+    method_decorators = [require_admin]
+    
+    def get(self):
+        """Get the webhook subscribers with their pending, dead and delivered events"""
+        try:
+            registry = get_registry()
+            return {"subscribers": registry.status() if registry is not None else {}}, 200
+        except Exception as e:
+            logger.exception("Error reading webhook subscribers")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
@@ -1,15 +1,19 @@
 import json
 import logging
+import uuid
 from flask import request, jsonify
 from flask_restful import Resource
+from models import PaymentOrder, ValidationError
 from utils.signature import generate_signature
+from api.payment_checks import check_payment, screen_attempt
 from utils.http_client import make_request
+from utils.prefetch import claim_artifact, committed_artifact, is_prefetch, ArtifactConflict
 from config import (
     MPAY_ONE_BASE_URL, CREDIT_CARD_PAYMENT_ENDPOINT, CREDIT_CARD_TOKEN_PAYMENT_ENDPOINT,
     CREDIT_CARD_TOKEN_INQUIRY_ENDPOINT, CREDIT_CARD_TOKEN_TERMINATE_ENDPOINT,
     CREDIT_CARD_CAPTURE_ENDPOINT, CREDIT_CARD_CANCEL_ENDPOINT,
     CREDIT_CARD_SEAMLESS_PAYMENT_ENDPOINT, CREDIT_CARD_SEAMLESS_REGISTER_ENDPOINT,
-    CREDIT_CARD_SEAMLESS_CONFIRM_ENDPOINT, ERROR_CODES
+    CREDIT_CARD_SEAMLESS_CONFIRM_ENDPOINT, ERROR_CODES, PREFETCH_ENABLED, CARD_SEAMLESS_TTL
 )
 
 logger = logging.getLogger(__name__)
@@ -39,33 +43,34 @@ class CreditCardPayment(Resource):
         }
         """
         try:
-            payload = request.get_json()
+            # Validate required fields and round the amount to satang so the signed value is the one mPAY sees
+            try:
+                order = PaymentOrder.from_payload(request.get_json())
+            except ValidationError as e:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": str(e)}), 400
             
-            # Validate required fields
-            required_fields = ['merchant_id', 'order_id', 'amount', 'currency']
-            for field in required_fields:
-                if field not in payload:
-                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
+            error = screen_attempt(order)
+            if error is not None:
+                return error
             
             # Generate signature
-            signature = generate_signature(payload)
-            payload['signature'] = signature
+            order.sign()
             
             # In a development environment, we'll simulate a successful response
             # In a production environment, we would make the actual API call
             
             # Make request to mPAY ONE API
             # endpoint = f"{MPAY_ONE_BASE_URL}{CREDIT_CARD_PAYMENT_ENDPOINT}"
-            # response = make_request('POST', endpoint, payload)
+            # response = GatewayResponse.from_http(make_request('POST', endpoint, order.to_dict()))
             
             # Simulated successful response
             success_response = {
                 "status": "SUCCESS",
                 "message": "Payment order created successfully",
-                "redirect_url": f"/payment-success?order_id={payload['order_id']}&payment_method=Credit Card",
-                "order_id": payload['order_id'],
-                "amount": payload['amount'],
-                "currency": payload['currency']
+                "redirect_url": f"/payment-success?order_id={order.order_id}&payment_method=Credit Card",
+                "order_id": order.order_id,
+                "amount": order.amount,
+                "currency": order.currency
             }
             
             return success_response, 200
@@ -73,3 +78,188 @@ class CreditCardPayment(Resource):
         except Exception as e:
             logger.exception("Error processing credit card payment")
             return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+
+class SeamlessCardRegister(Resource):
+    """Handle Seamless Credit Card Registration API"""
+    
+    def post(self):
+        """
+        Register a seamless card payment and get the payment_ref the page
+        tokenizes the card against
+        
+        Card data never reaches this server: the page sends it straight to
+        mPAY for a card token and confirms with SeamlessCardConfirm. The
+        registration is kept per order and amount, so registering again
+        (or committing one prefetched with ``?prefetch=1``) returns the
+        same payment_ref.
+        
+        Expected payload:
+        {
+            "merchant_id": "MERCHANT_ID",
+            "order_id": "ORDER123",
+            "amount": 100.00,
+            "currency": "THB",
+            "description": "Payment for order ORDER123",
+            "customer_email": "customer@example.com",
+            "customer_name": "John Doe",
+            "redirect_url": "https://merchant.com/redirect",
+            "backend_url": "https://merchant.com/webhook"
+        }
+        """
+        try:
+            payload = request.get_json()
+            prefetch = is_prefetch(request.args)
+            if prefetch and not PREFETCH_ENABLED:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Prefetch is disabled"}), 400
+            
+            # Validate required fields
+            required_fields = ['merchant_id', 'order_id', 'amount', 'currency']
+            for field in required_fields:
+                if field not in payload:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
+            
+            # Only the final registration is a payment attempt; prefetches are
+            # dropped when the customer picks another method
+            error = check_payment(payload, screen=not prefetch)
+            if error is not None:
+                return error
+            
+            # Reuse the registration already made for this order and amount, if any;
+            # kept even without prefetching, as the confirm is checked against it
+            try:
+                claim = claim_artifact('CARD', payload, commit=not prefetch, required=True)
+            except ArtifactConflict as e:
+                return jsonify({"error": ERROR_CODES["DUPLICATE_ORDER"], "message": str(e)}), 409
+            if not claim.owned:
+                return claim.response, 200
+            
+            try:
+                # Generate signature
+                signature = generate_signature(payload)
+                payload['signature'] = signature
+                
+                # In a development environment, we'll simulate a successful response
+                # In a production environment, we would make the actual API call
+                
+                # Make request to mPAY ONE API
+                # endpoint = f"{MPAY_ONE_BASE_URL}{CREDIT_CARD_SEAMLESS_REGISTER_ENDPOINT}"
+                # response = make_request('POST', endpoint, payload)
+                
+                # Simulated successful response; without a tokenize_url the page
+                # issues a sandbox card token itself
+                success_response = {
+                    "status": "SUCCESS",
+                    "message": "Seamless payment registered successfully",
+                    "order_id": payload['order_id'],
+                    "amount": payload['amount'],
+                    "currency": payload['currency'],
+                    "payment_ref": f"PREF{uuid.uuid4().hex[:16].upper()}",
+                    "tokenize_url": None
+                }
+            except Exception:
+                claim.release()
+                raise
+            
+            claim.complete(success_response, CARD_SEAMLESS_TTL, commit=not prefetch)
+            
+            return success_response, 200
+                
+        except Exception as e:
+            logger.exception("Error registering seamless card payment")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+
+class SeamlessCardConfirm(Resource):
+    """Handle Seamless Credit Card Confirmation API"""
+    
+    def post(self):
+        """
+        Charge a tokenized card against a registered payment_ref, server to server
+        
+        The payment_ref must be the one of the order's committed
+        registration. A confirmed payment is kept per order, so a repeated
+        confirm (a double click, a retry after a dropped response) returns
+        the first result instead of charging the card again; other attempts,
+        including retries after a decline, are velocity screened.
+        
+        Expected payload:
+        {
+            "merchant_id": "MERCHANT_ID",
+            "order_id": "ORDER123",
+            "payment_ref": "PREF0123456789ABCDEF",
+            "card_token": "TOKEN_FROM_MPAY"
+        }
+        """
+        try:
+            payload = request.get_json(silent=True)
+            if not isinstance(payload, dict):
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid JSON payload"}), 400
+            
+            # Validate required fields
+            required_fields = ['merchant_id', 'order_id', 'payment_ref', 'card_token']
+            for field in required_fields:
+                if field not in payload:
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
+            
+            # Only the payment_ref registered for this order can be charged
+            registration = committed_artifact('CARD', payload['order_id'])
+            if registration is None:
+                return jsonify({"error": ERROR_CODES["RESOURCE_NOT_FOUND"], "message": "No seamless registration for this order"}), 404
+            if registration.get('payment_ref') != payload['payment_ref']:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "payment_ref does not match the order's registration"}), 400
+            
+            # One charge per order, whether or not prefetching is enabled
+            try:
+                claim = claim_artifact('CARD_CONFIRM', payload, commit=True, required=True)
+            except ArtifactConflict as e:
+                return jsonify({"error": ERROR_CODES["DUPLICATE_ORDER"], "message": str(e)}), 409
+            if not claim.owned:
+                return claim.response, 200
+            
+            # Catches card tokens cycled against one order
+            error = screen_attempt(dict(payload, amount=registration.get('amount')))
+            if error is not None:
+                claim.release()
+                return error
+            
+            try:
+                # Generate signature
+                confirm_payload = {
+                    "merchant_id": payload['merchant_id'],
+                    "order_id": payload['order_id'],
+                    "payment_ref": payload['payment_ref'],
+                    "card_token": payload['card_token']
+                }
+                confirm_payload['signature'] = generate_signature(confirm_payload)
+                
+                # In a development environment, we'll simulate a successful response
+                # In a production environment, we would make the actual API call
+                
+                # Make request to mPAY ONE API
+                # endpoint = f"{MPAY_ONE_BASE_URL}{CREDIT_CARD_SEAMLESS_CONFIRM_ENDPOINT}"
+                # response = make_request('POST', endpoint, confirm_payload)
+                # A card that needs 3-D Secure comes back PENDING with an authorize_url
+                
+                # Simulated successful response
+                success_response = {
+                    "status": "SUCCESS",
+                    "message": "Payment confirmed successfully",
+                    "order_id": payload['order_id'],
+                    "payment_ref": payload['payment_ref'],
+                    "transaction_id": str(uuid.uuid4()),
+                    "redirect_url": f"/payment/success/{payload['order_id']}"
+                }
+            except Exception:
+                claim.release()
+                raise
+            
+            # Only a charge that went through is final; a declined card can be retried
+            if success_response['status'] == 'SUCCESS':
+                claim.complete(success_response, CARD_SEAMLESS_TTL, commit=True)
+            else:
+                claim.release()
+            
+            return success_response, 200
+                
+        except Exception as e:
+            logger.exception("Error confirming seamless card payment")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
@@ -2,14 +2,91 @@ import logging
 from flask import request, jsonify
 from flask_restful import Resource
 from utils.signature import generate_signature
+from api.payment_checks import check_payment
+from utils.pricing import to_satang, amount_value
 from utils.http_client import make_request
 from config import (
     MPAY_ONE_BASE_URL, INSTALLMENT_PLAN_INQUIRY_ENDPOINT, 
-    INSTALLMENT_PAYMENT_ENDPOINT, ERROR_CODES
+    INSTALLMENT_PAYMENT_ENDPOINT, ERROR_CODES, INSTALLMENT_PLANS_MAX_AGE
 )
 
 logger = logging.getLogger(__name__)
 
+# Simulated plan inquiry result: bank code -> (bank name, terms in months)
+SIMULATED_PLANS = {
+    'KTC': ('Krungthai Card', (3, 4, 6, 10)),
+    'BAY': ('Krungsri Bank', (3, 4, 6, 10)),
+    'KBANK': ('Kasikorn Bank', (3, 6, 10)),
+    'SCB': ('Siam Commercial Bank', (3, 6)),
+}
+
+class InstallmentPlans(Resource):
+    """Handle Installment Plan Inquiry API"""
+    
+    def get(self):
+        """
+        List the installment plans available for an amount
+        
+        Read-only, so the payment page prefetches it as soon as installment
+        is selected; the browser caches the result for a few minutes.
+        
+        Query parameters:
+            merchant_id: MERCHANT_ID
+            amount: 100.00
+            currency: THB
+        """
+        try:
+            merchant_id = request.args.get('merchant_id')
+            if not merchant_id or 'amount' not in request.args:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Missing required field: merchant_id or amount"}), 400
+            
+            try:
+                satang = to_satang(request.args['amount'])
+            except ValueError:
+                satang = 0
+            if satang <= 0:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid amount"}), 400
+            
+            # In a development environment, we'll simulate a successful response
+            # In a production environment, we would make the actual API call
+            
+            # Make request to mPAY ONE API
+            # payload = {"merchant_id": merchant_id, "amount": amount_value(satang)}
+            # payload['signature'] = generate_signature(payload)
+            # endpoint = f"{MPAY_ONE_BASE_URL}{INSTALLMENT_PLAN_INQUIRY_ENDPOINT}"
+            # response = make_request('POST', endpoint, payload)
+            
+            # 0% plans; the first installment absorbs the rounding remainder
+            plans = []
+            for bank, (bank_name, terms) in SIMULATED_PLANS.items():
+                plans.append({
+                    "bank": bank,
+                    "bank_name": bank_name,
+                    "terms": [
+                        {
+                            "months": months,
+                            "interest_rate": 0.0,
+                            "monthly_amount": amount_value(satang // months),
+                            "first_amount": amount_value(satang // months + satang % months)
+                        }
+                        for months in terms
+                    ]
+                })
+            
+            success_response = {
+                "status": "SUCCESS",
+                "merchant_id": merchant_id,
+                "amount": amount_value(satang),
+                "currency": request.args.get('currency', 'THB'),
+                "plans": plans
+            }
+            
+            return success_response, 200, {"Cache-Control": f"private, max-age={INSTALLMENT_PLANS_MAX_AGE}"}
+                
+        except Exception as e:
+            logger.exception("Error inquiring installment plans")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+
 class InstallmentPayment(Resource):
     """Handle Installment Payment API"""
     
@@ -45,6 +122,10 @@ class InstallmentPayment(Resource):
                 if field not in payload:
                     return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
             
+            error = check_payment(payload)
+            if error is not None:
+                return error
+            
             # Generate signature
             signature = generate_signature(payload)
             payload['signature'] = signature
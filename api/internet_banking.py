@@ -2,9 +2,11 @@ import logging
 from flask import request, jsonify
 from flask_restful import Resource
 from utils.signature import generate_signature
+from api.payment_checks import check_payment
 from utils.http_client import make_request
+from utils.expiry import track_pending_order
 from config import (
-    MPAY_ONE_BASE_URL, INTERNET_BANKING_ENDPOINT, REQUEST_TO_PAY_ENDPOINT, ERROR_CODES
+    MPAY_ONE_BASE_URL, INTERNET_BANKING_ENDPOINT, REQUEST_TO_PAY_ENDPOINT, ERROR_CODES, BANKING_ORDER_TTL
 )
 
 logger = logging.getLogger(__name__)
@@ -41,6 +43,10 @@ class InternetBankingPayment(Resource):
                 if field not in payload:
                     return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
             
+            error = check_payment(payload)
+            if error is not None:
+                return error
+            
             # Generate signature
             signature = generate_signature(payload)
             payload['signature'] = signature
@@ -63,6 +69,9 @@ class InternetBankingPayment(Resource):
                 "bank_code": payload['bank_code']
             }
             
+            # Release the order if the customer never completes payment
+            track_pending_order(payload['order_id'], BANKING_ORDER_TTL)
+            
             return success_response, 200
                 
         except Exception as e:
@@ -0,0 +1,50 @@
+"""
+Checks shared by the payment resources
+
+Every amount is rounded to satang before it is signed, so the signed value
+is the one mPAY sees, and every payment attempt is counted against the
+velocity rules before signing and calling the gateway, which screens out
+card-testing bursts.
+"""
+
+from flask import request, jsonify
+from utils.pricing import normalize_amount
+from utils.velocity import screen_payment
+from config import ERROR_CODES
+
+
+def check_payment(payload, screen=True):
+    """
+    Round a payment payload's amount in place and screen the attempt
+
+    Args:
+        payload (dict): Request payload with an "amount"
+        screen (bool, optional): Also count the attempt against the velocity
+            rules; resources that may reuse an earlier result screen later
+            with screen_attempt()
+
+    Returns:
+        tuple: (error response, status code), or None to go ahead
+    """
+    try:
+        payload['amount'] = normalize_amount(payload['amount'])
+    except ValueError:
+        return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Invalid amount"}), 400
+    if screen:
+        return screen_attempt(payload)
+    return None
+
+
+def screen_attempt(payload):
+    """
+    Count a payment attempt against the velocity rules
+
+    Args:
+        payload (dict | models.PaymentOrder): Payment request payload
+
+    Returns:
+        tuple: (error response, status code), or None to go ahead
+    """
+    if screen_payment(payload, request.remote_addr):
+        return jsonify({"error": ERROR_CODES["VELOCITY_LIMIT"], "message": "Too many payment attempts"}), 429
+    return None
@@ -1,10 +1,14 @@
 import logging
+import time
 from flask import request, jsonify
 from flask_restful import Resource
 from utils.signature import generate_signature
+from api.payment_checks import check_payment
 from utils.http_client import make_request
+from utils.expiry import track_pending_order
+from utils.prefetch import claim_artifact, cancel_artifact, is_prefetch, ArtifactConflict, READY
 from config import (
-    MPAY_ONE_BASE_URL, QR_GENERATE_ENDPOINT, ERROR_CODES
+    MPAY_ONE_BASE_URL, QR_GENERATE_ENDPOINT, ERROR_CODES, QR_ORDER_TTL, PREFETCH_ENABLED
 )
 
 logger = logging.getLogger(__name__)
@@ -16,6 +20,10 @@ class GenerateQR(Resource):
         """
         Generate a QR code for payment
         
+        With ``?prefetch=1`` the QR code is created speculatively for the
+        payment page. It is only committed, and its order starts expiring,
+        when the final request for the same order and amount reuses it.
+        
         Expected payload:
         {
             "merchant_id": "MERCHANT_ID",
@@ -36,6 +44,9 @@ class GenerateQR(Resource):
         """
         try:
             payload = request.get_json()
+            prefetch = is_prefetch(request.args)
+            if prefetch and not PREFETCH_ENABLED:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Prefetch is disabled"}), 400
             
             # Validate required fields
             required_fields = ['merchant_id', 'order_id', 'amount', 'currency']
@@ -43,38 +54,110 @@ class GenerateQR(Resource):
                 if field not in payload:
                     return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
             
-            # Generate signature
-            signature = generate_signature(payload)
-            payload['signature'] = signature
+            # Prefetches are not screened: the page cancels them as the customer
+            # switches payment method, so only the final request is an attempt
+            error = check_payment(payload, screen=not prefetch)
+            if error is not None:
+                return error
             
-            # In a development environment, we'll simulate a successful response
-            # In a production environment, we would make the actual API call
+            # Reuse the QR code already created for this order and amount, if any
+            try:
+                claim = claim_artifact('QR', payload, commit=not prefetch)
+            except ArtifactConflict as e:
+                return jsonify({"error": ERROR_CODES["DUPLICATE_ORDER"], "message": str(e)}), 409
+            if claim is not None and not claim.owned:
+                # Committing a prefetched QR code starts its order's expiry
+                if not prefetch and claim.state == READY:
+                    track_pending_order(payload['order_id'], claim.expires_at - time.time())
+                return claim.response, 200
             
-            # Make request to mPAY ONE API
-            # endpoint = f"{MPAY_ONE_BASE_URL}{QR_GENERATE_ENDPOINT}"
-            # response = make_request('POST', endpoint, payload)
+            try:
+                result, status = self._create_qr(payload)
+            except Exception:
+                if claim is not None:
+                    claim.release()
+                raise
+            if status != 200:
+                if claim is not None:
+                    claim.release()
+                return result, status
             
-            # Simulated successful response with QR image (SVG)
-            qr_svg = """
-            <svg viewBox="0 0 200 200" xmlns="http://www.w3.org/2000/svg">
-              <rect x="10" y="10" width="180" height="180" fill="none" stroke="#000" stroke-width="2" />
-              <rect x="50" y="50" width="100" height="100" fill="none" stroke="#000" stroke-width="2" />
-              <rect x="70" y="70" width="60" height="60" fill="#000" />
-            </svg>
-            """
+            if claim is not None and not claim.complete(result, QR_ORDER_TTL, commit=not prefetch):
+                logger.info(f"Prefetched QR code for order {payload['order_id']} was replaced while being created")
             
-            success_response = {
-                "status": "SUCCESS",
-                "message": "QR code generated successfully",
-                "order_id": payload['order_id'],
-                "amount": payload['amount'],
-                "currency": payload['currency'],
-                "qr_image": "data:image/svg+xml;base64," + qr_svg.encode('utf-8').hex(),
-                "qr_code": "00020101021229370016A000000677010111011300669000000115802TH53037645406529.736304FDF0"
-            }
+            # Release the order if the customer never completes payment
+            if not prefetch:
+                track_pending_order(payload['order_id'], QR_ORDER_TTL)
+            elif claim is not None:
+                # Only the page that prefetched the QR code may cancel it
+                result = dict(result, prefetch_token=claim.token)
             
-            return success_response, 200
+            return result, 200
                 
         except Exception as e:
             logger.exception("Error generating QR code")
             return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+    
+    def delete(self):
+        """
+        Cancel a prefetched QR code the customer did not use
+        
+        The token is the "prefetch_token" of the prefetch response, so a
+        prefetched QR code can only be canceled by the page that created it.
+        
+        Expected payload:
+        {
+            "order_id": "ORDER123",
+            "prefetch_token": "TOKEN"
+        }
+        """
+        try:
+            payload = request.get_json(silent=True)
+            if not isinstance(payload, dict):
+                payload = {}
+            for field in ('order_id', 'prefetch_token'):
+                if not payload.get(field):
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
+            
+            if not cancel_artifact('QR', str(payload['order_id']), str(payload['prefetch_token'])):
+                return jsonify({"error": ERROR_CODES["RESOURCE_NOT_FOUND"], "message": "No prefetched QR code to cancel"}), 404
+            
+            return {"status": "SUCCESS", "message": "Prefetched QR code canceled", "order_id": payload['order_id']}, 200
+                
+        except Exception as e:
+            logger.exception("Error canceling prefetched QR code")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
+    
+    def _create_qr(self, payload):
+        """Sign and create the QR code; returns (response, status code)"""
+        # Generate signature
+        signature = generate_signature(payload)
+        payload['signature'] = signature
+        
+        # In a development environment, we'll simulate a successful response
+        # In a production environment, we would make the actual API call
+        
+        # Make request to mPAY ONE API
+        # endpoint = f"{MPAY_ONE_BASE_URL}{QR_GENERATE_ENDPOINT}"
+        # response = make_request('POST', endpoint, payload)
+        
+        # Simulated successful response with QR image (SVG)
+        qr_svg = """
+        <svg viewBox="0 0 200 200" xmlns="http://www.w3.org/2000/svg">
+          <rect x="10" y="10" width="180" height="180" fill="none" stroke="#000" stroke-width="2" />
+          <rect x="50" y="50" width="100" height="100" fill="none" stroke="#000" stroke-width="2" />
+          <rect x="70" y="70" width="60" height="60" fill="#000" />
+        </svg>
+        """
+        
+        success_response = {
+            "status": "SUCCESS",
+            "message": "QR code generated successfully",
+            "order_id": payload['order_id'],
+            "amount": payload['amount'],
+            "currency": payload['currency'],
+            "qr_image": "data:image/svg+xml;base64," + qr_svg.encode('utf-8').hex(),
+            "qr_code": "00020101021229370016A000000677010111011300669000000115802TH53037645406529.736304FDF0"
+        }
+        
+        return success_response, 200
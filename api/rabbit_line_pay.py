@@ -2,6 +2,7 @@ import logging
 from flask import request, jsonify
 from flask_restful import Resource
 from utils.signature import generate_signature
+from api.payment_checks import check_payment
 from utils.http_client import make_request
 from config import (
     MPAY_ONE_BASE_URL, RLP_PAYMENT_ENDPOINT, RLP_PREAPPROVED_PAYMENT_ENDPOINT,
@@ -42,6 +43,10 @@ class RabbitLinePayPayment(Resource):
                 if field not in payload:
                     return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Missing required field: {field}"}), 400
             
+            error = check_payment(payload)
+            if error is not None:
+                return error
+            
             # Generate signature
             signature = generate_signature(payload)
             payload['signature'] = signature
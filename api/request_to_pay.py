@@ -0,0 +1,48 @@
+import logging
+from flask import request, jsonify, Response, stream_with_context
+from flask_restful import Resource
+from utils import json_codec
+from utils.payment_links import create_payment_links, iter_request_bookings
+from config import ERROR_CODES, BULK_LINK_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+class BulkRequestToPay(Resource):
+    """Handle Bulk Request-to-Pay Link Creation API"""
+    
+    def post(self):
+        """
+        Create payment links for a block of bookings
+        
+        Accepts JSON Lines (application/x-ndjson) or CSV (text/csv) with one
+        booking per line/row, or a JSON object with a "bookings" list:
+        {"order_id": "ORD-2025001-01", "amount": 450.00, "customer_email": "pax1@example.com"}
+        {"order_id": "ORD-2025001-02", "amount": 450.00, "customer_email": "pax2@example.com"}
+        
+        Results are streamed back as JSON Lines in completion order, one per
+        booking, each carrying the booking's position in the input as "index".
+        """
+        try:
+            content_type = request.mimetype
+            
+            if content_type == 'application/json':
+                payload = request.get_json(silent=True)
+                if not isinstance(payload, dict) or not isinstance(payload.get('bookings'), list):
+                    return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Missing required field: bookings"}), 400
+                bookings = iter(payload['bookings'])
+            elif content_type in ('application/x-ndjson', 'application/jsonl', 'text/csv'):
+                bookings = iter_request_bookings(request.stream, content_type)
+            else:
+                return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": f"Unsupported content type: {content_type}"}), 415
+            
+            concurrency = min(request.args.get('concurrency', BULK_LINK_CONCURRENCY, type=int), BULK_LINK_CONCURRENCY)
+            
+            def generate():
+                for result in create_payment_links(bookings, concurrency=concurrency):
+                    yield json_codec.dumps_bytes(result) + b'\n'
+            
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+                
+        except Exception as e:
+            logger.exception("Error creating bulk payment links")
+            return jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": str(e)}), 500
@@ -2,7 +2,9 @@ import logging
 from flask import request, jsonify
 from flask_restful import Resource
 from utils.signature import generate_signature
+from api.payment_checks import check_payment
 from utils.http_client import make_request
+from utils.revenue import record_refund
 from config import (
     MPAY_ONE_BASE_URL, VOID_REFUND_ENDPOINT, ERROR_CODES
 )
@@ -38,6 +40,12 @@ class VoidRefund(Resource):
             if payload['refund_type'] == 'REFUND' and 'amount' not in payload:
                 return jsonify({"error": ERROR_CODES["INVALID_REQUEST"], "message": "Amount is required for refund"}), 400
             
+            # Refunds are not payment attempts, so they are not velocity screened
+            if 'amount' in payload:
+                error = check_payment(payload, screen=False)
+                if error is not None:
+                    return error
+            
             # Generate signature
             signature = generate_signature(payload)
             payload['signature'] = signature
@@ -60,6 +68,9 @@ class VoidRefund(Resource):
                 "refund_type": payload['refund_type']
             }
             
+            # Count the refund against the original payment's method and route
+            record_refund(payload['order_id'], payload.get('amount'), merchant_id=payload['merchant_id'])
+            
             return success_response, 200
                 
         except Exception as e:
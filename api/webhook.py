@@ -1,8 +1,9 @@
-import json
 import logging
 from flask import request, jsonify
 from flask_restful import Resource
-from utils.signature import verify_signature
+from models import WebhookEvent, ValidationError
+from utils.replay_guard import get_replay_guard, TIME_REJECTIONS
+from utils.webhooks import apply_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -30,64 +31,55 @@ class WebhookHandler(Resource):
         }
         """
         try:
-            webhook_data = request.get_json()
-            
-            if not webhook_data:
+            # Parsed once; the request body itself keeps the signature for the event log
+            try:
+                event = WebhookEvent.from_payload(request.get_json())
+            except ValidationError:
                 logger.error("Empty webhook payload received")
                 return jsonify({"status": "error", "message": "No data received"}), 400
             
-            logger.info(f"Received webhook: {json.dumps(webhook_data)}")
-            
-            # Verify signature
-            signature = webhook_data.pop('signature', None)
+            logger.info(f"Received webhook for order {event.order_id}: {event.status}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Webhook payload: {request.get_data(as_text=True)}")
             
-            if not signature:
+            if not event.signature:
                 logger.error("Webhook signature missing")
                 return jsonify({"status": "error", "message": "Signature missing"}), 400
             
+            # Payload without the signature, as the handlers expect
+            webhook_data = event.to_dict()
+            
+            # Skip notifications already processed before paying for the HMAC computation;
+            # the guard's store is shared by all workers
+            replay_guard = get_replay_guard()
+            rejection = replay_guard.check(webhook_data)
+            if rejection == 'duplicate':
+                logger.warning(f"Duplicate webhook for order {event.order_id}")
+                # Acknowledge so mPAY does not keep redelivering it
+                return jsonify({"status": "ignored", "message": "Webhook rejected: duplicate"}), 200
+            
             # Verify the signature
-            if not verify_signature(webhook_data, signature):
+            if not event.verify():
                 logger.error("Webhook signature verification failed")
                 return jsonify({"status": "error", "message": "Invalid signature"}), 401
             
-            # Process the webhook based on status
-            status = webhook_data.get('status')
-            payment_method = webhook_data.get('payment_method')
-            order_id = webhook_data.get('order_id')
+            if rejection in TIME_REJECTIONS:
+                # Genuine but outside the freshness window (e.g. delivered late):
+                # not applied, and not acknowledged either, so it shows up as a
+                # failed delivery and stays in the event log for review
+                logger.warning(f"Signed webhook for order {event.order_id} needs review ({rejection})")
+                return jsonify({"status": "rejected", "message": f"Webhook rejected: {rejection}"}), 409
+            
+            if not replay_guard.mark_seen(webhook_data):
+                logger.warning(f"Duplicate webhook for order {event.order_id}")
+                return jsonify({"status": "ignored", "message": "Webhook rejected: duplicate"}), 200
             
-            if not all([status, payment_method, order_id]):
+            if event.missing_fields():
                 logger.error("Webhook missing critical fields")
                 return jsonify({"status": "error", "message": "Missing required fields"}), 400
             
-            # Handle different payment statuses
-            if status == 'SUCCESS':
-                logger.info(f"Payment successful for order {order_id}")
-                # Update your system - payment successful
-                # e.g. update_order_status(order_id, 'paid')
-                
-            elif status == 'PENDING':
-                logger.info(f"Payment pending for order {order_id}")
-                # Update your system - payment is being processed
-                # e.g. update_order_status(order_id, 'pending')
-                
-            elif status == 'FAILED':
-                logger.info(f"Payment failed for order {order_id}")
-                # Update your system - payment failed
-                # e.g. update_order_status(order_id, 'failed')
-                
-            elif status == 'AUTHORIZED':
-                logger.info(f"Payment authorized for order {order_id}")
-                # Update your system - payment authorized but not captured
-                # e.g. update_order_status(order_id, 'authorized')
-                
-            elif status == 'CANCELED':
-                logger.info(f"Payment canceled for order {order_id}")
-                # Update your system - payment was canceled
-                # e.g. update_order_status(order_id, 'canceled')
-                
-            else:
-                logger.warning(f"Unknown payment status: {status} for order {order_id}")
-                # Handle unknown status
+            # Update the order, queue the status for Raja Ferry and count revenue
+            apply_webhook(webhook_data)
             
             # Always return 200 OK to acknowledge receipt
             return jsonify({"status": "success", "message": "Webhook received"}), 200
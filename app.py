@@ -1,20 +1,32 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from flask_restful import Api
-
-
-
-
+import threading
+import uuid
+from urllib.parse import urlsplit
+from flask import Flask, render_template, request, jsonify, redirect, current_app, g
+from werkzeug.middleware.proxy_fix import ProxyFix
+from utils.flask_json import CodecJSONProvider
+from utils.rate_limit import create_rate_limiter, retry_after_header
+from utils.profiling import request_profiler, PROFILE_HEADER
+from utils.memory import memory_tracker, RequestAllocations, ALLOCATED_HEADER, PEAK_HEADER
+from utils.tracing import tracer, TRACEPARENT_HEADER
+from utils.event_log import get_event_log, close_event_log, KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK
+from utils.traffic import sanitize
+from utils.revenue import register_order
+from utils.pricing import quote, normalize_amount
+from utils.transactions import record_order, PAYMENT_METHODS_BY_PATH
+from utils.prefetch import is_prefetch
+from utils.lifecycle import lifecycle
+from config import (
+    DEFAULT_MERCHANT_ID, RATE_LIMIT_ENABLED, ERROR_CODES, WARMUP_ENABLED, LOG_LEVEL, APP_BLUEPRINTS,
+    EVENT_LOG_ENABLED, EVENT_LOG_DIR, EVENT_LOG_SEGMENT_SIZE, EVENT_LOG_FSYNC_BATCH,
+    EVENT_LOG_FSYNC_INTERVAL, MPAY_ONE_BASE_URL, PREFETCH_ENABLED, PRECONNECT_ORIGINS,
+    TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_DIR, TRAFFIC_CAPTURE_SAMPLE_RATE, TRAFFIC_CAPTURE_BATCH,
+    TRAFFIC_CAPTURE_MAX_BODY, MEMORY_TRACK_REQUESTS, TRUSTED_PROXY_COUNT
+)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
-
 #database 
 #b = SQLAlchemy()
 
@@ -46,35 +58,203 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 #   with app.app_context():
 #   db.create_all()
 
-# Set up API
-api = Api(app)
-
-# Import API resources
-from api.credit_card import CreditCardPayment
-from api.qr_payment import GenerateQR
-from api.rabbit_line_pay import RabbitLinePayPayment
-from api.installment import InstallmentPayment
-from api.internet_banking import InternetBankingPayment
-from api.inquiry import PaymentInquiry
-from api.void_refund import VoidRefund
-from api.webhook import WebhookHandler
-
-# Register API endpoints
-api.add_resource(CreditCardPayment, '/api/credit-card/payment')
-api.add_resource(GenerateQR, '/api/qr/generate')
-api.add_resource(RabbitLinePayPayment, '/api/rabbit-line-pay/payment')
-api.add_resource(InstallmentPayment, '/api/installment/payment')
-api.add_resource(InternetBankingPayment, '/api/banking/payment')
-api.add_resource(PaymentInquiry, '/api/payment/inquiry')
-api.add_resource(VoidRefund, '/api/payment/void-refund')
-api.add_resource(WebhookHandler, '/api/webhook')
-
-from config import DEFAULT_MERCHANT_ID
-import uuid
 
-# Main routes
-@app.route('/')
-@app.route('/payment')
+def record_payment_events(response):
+    """Append the request and response (or webhook) to the payment event log"""
+    path = request.path
+    if not EVENT_LOG_ENABLED or request.method != 'POST':
+        return response
+    if path != '/process-payment' and (not path.startswith('/api/') or path.startswith('/api/admin/')):
+        return response
+    
+    body = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    order_id = body.get('order_id', '') if isinstance(body, dict) else ''
+    result = None if response.is_streamed else response.get_json(silent=True)
+    
+    if path == '/api/webhook':
+        # Kept verbatim with its signature so backfills can verify it again;
+        # mPAY notifications carry no customer details
+        accepted = response.status_code == 200 and isinstance(result, dict) and result.get('status') == 'success'
+        records = [(KIND_WEBHOOK, order_id, {
+            'path': path, 'body': body, 'status_code': response.status_code, 'accepted': accepted
+        })]
+    else:
+        # No card data or signatures, and customer details masked, as in traffic captures
+        records = [
+            (KIND_REQUEST, order_id, {'path': path, 'body': sanitize(body)}),
+            (KIND_RESPONSE, order_id, {'path': path, 'status_code': response.status_code, 'body': sanitize(result)}),
+        ]
+        # Prefetched artifacts do not open an order until a final request commits them
+        if is_prefetch(request.args):
+            for _, _, data in records:
+                data['prefetch'] = True
+    
+    try:
+        get_event_log(
+            EVENT_LOG_DIR,
+            segment_size=EVENT_LOG_SEGMENT_SIZE,
+            fsync_batch=EVENT_LOG_FSYNC_BATCH,
+            fsync_interval=EVENT_LOG_FSYNC_INTERVAL
+        ).append_many(records)
+    except Exception:
+        logger.exception("Failed to append to payment event log")
+    return response
+
+def index_created_orders(response):
+    """Add orders created through the payment API to the transaction index"""
+    payment_method = PAYMENT_METHODS_BY_PATH.get(request.path)
+    if payment_method is None or request.method != 'POST' or response.status_code != 200:
+        return response
+    # Prefetched artifacts are only orders once the customer confirms
+    if is_prefetch(request.args):
+        return response
+    
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        record_order(payload, payment_method=payment_method)
+    return response
+
+def start_request_span():
+    """Open the root span for the request, joining the caller's or the order's trace"""
+    attributes = {'http.method': request.method, 'http.path': request.path}
+    trace_id = None
+    
+    if request.path == '/api/webhook':
+        # Webhooks join the trace of the checkout that created the order
+        webhook_data = request.get_json(silent=True)
+        if not isinstance(webhook_data, dict):
+            webhook_data = {}
+        for field in ('order_id', 'transaction_id', 'payment_id', 'status'):
+            if webhook_data.get(field):
+                attributes[field] = webhook_data[field]
+        trace_id = tracer.correlated_trace(webhook_data.get('order_id'), webhook_data.get('transaction_id'))
+    
+    name = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    g.span = tracer.start_span(name, attributes, traceparent=request.headers.get(TRACEPARENT_HEADER), trace_id=trace_id)
+
+def tag_request_span(response):
+    """Record the response status and correlate the trace with its order"""
+    span = g.get('span')
+    if span is None:
+        return response
+    
+    span.set_attribute('http.status_code', response.status_code)
+    if response.status_code >= 500:
+        span.record_error(f"HTTP {response.status_code}")
+    
+    if request.path != '/api/webhook' and request.method == 'POST':
+        payload = request.get_json(silent=True) if request.is_json else request.form
+        order_id = payload.get('order_id') if isinstance(payload, dict) else None
+        if order_id:
+            span.set_attribute('order_id', order_id)
+            tracer.correlate(order_id, span.trace_id)
+    return response
+
+def end_request_span(error=None):
+    """Close the root span, which also makes the tail sampling decision"""
+    span = g.pop('span', None)
+    if span is not None:
+        tracer.end_span(span, error)
+
+def start_request_profile():
+    """Start cProfile for requests selected by the signed header or admin toggle"""
+    path = request.path
+    if path != '/process-payment' and not path.startswith('/api/'):
+        return
+    if request_profiler.should_profile(path, request.headers.get(PROFILE_HEADER)):
+        g.profiler = request_profiler.start()
+
+def finish_request_profile(response):
+    """Write the request profile and report its file name"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        output = request_profiler.finish(profiler, request.method, request.path)
+        response.headers['X-Profile-Id'] = os.path.basename(output)
+    return response
+
+def start_request_allocations():
+    """Count the bytes a request allocates, in debug mode or when MEMORY_TRACK_REQUESTS is set"""
+    if current_app.debug or MEMORY_TRACK_REQUESTS:
+        g.allocations = RequestAllocations()
+        g.allocations.begin()
+
+def finish_request_allocations(response):
+    """Report the bytes the request allocated and its peak"""
+    allocations = g.pop('allocations', None)
+    if allocations is not None:
+        allocated, peak = allocations.end()
+        response.headers[ALLOCATED_HEADER] = str(allocated)
+        response.headers[PEAK_HEADER] = str(peak)
+    return response
+
+def recycle_oversized_worker(response):
+    """Have the production server replace this worker once its RSS crosses MEMORY_MAX_RSS_MB"""
+    if lifecycle.managed:
+        memory_tracker.count_request()
+    return response
+
+# Webhooks come from mPAY ONE and are never rate limited; /process-payment
+# only redirects to the /api/ resource, which is limited instead
+RATE_LIMIT_EXEMPT_PATHS = {'/api/webhook', '/process-payment'}
+
+def enforce_rate_limits():
+    """Reject requests that exceed the merchant, client or endpoint limits"""
+    rate_limiter = current_app.extensions.get('rate_limiter')
+    if rate_limiter is None or request.method != 'POST':
+        return None
+    
+    path = request.path
+    if path in RATE_LIMIT_EXEMPT_PATHS or not path.startswith('/api/'):
+        return None
+    
+    payload = request.get_json(silent=True) if request.is_json else request.form
+    # JSON bodies may be arrays or scalars; only objects name a merchant
+    merchant_id = payload.get('merchant_id') if isinstance(payload, dict) else None
+    
+    retry_after = rate_limiter.check(
+        merchant_id=merchant_id,
+        client_ip=request.remote_addr,
+        endpoint=path
+    )
+    if retry_after:
+        logger.warning(f"Rate limit exceeded for {request.remote_addr} on {path} (merchant {merchant_id})")
+        response = jsonify({"error": ERROR_CODES["RATE_LIMITED"], "message": "Too many requests"})
+        response.status_code = 429
+        response.headers['Retry-After'] = retry_after_header(retry_after)
+        return response
+    
+    return None
+
+def refuse_payments_while_draining():
+    """Turn away new payment requests once the worker is shutting down"""
+    if not lifecycle.draining or request.method != 'POST':
+        return None
+    
+    path = request.path
+    # Webhooks settle payments already made, so keep accepting them
+    if path == '/api/webhook' or path.startswith('/api/admin/'):
+        return None
+    if path != '/process-payment' and not path.startswith('/api/'):
+        return None
+    
+    response = jsonify({"error": ERROR_CODES["SYSTEM_ERROR"], "message": "Server is shutting down, please retry"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def healthz():
+    """Liveness probe: the worker process is responsive"""
+    return jsonify(lifecycle.status()), 200
+
+def readyz():
+    """Readiness probe: fails while starting up or draining"""
+    return jsonify(lifecycle.status()), 200 if lifecycle.ready else 503
+
+def gateway_origin(url):
+    """Return the scheme and host of a URL, as used by preconnect hints"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
 def payment_form():
     """Render the payment form page"""
     # Sample order data (in a real app, this would come from Raja Ferry Port)
@@ -83,10 +263,6 @@ def payment_form():
         'merchant_id': 'MERCH-12345',
         'route': 'Donsak - Samui',
         'date_time': 'March 15, 2025 - 10:00 AM',
-        'fare': 450.00,
-        'service_fee': 45.00,
-        'tax': 34.73,
-        'total': 529.73,
         'currency': 'THB',
         'customer_name': 'John Doe',
         'customer_email': 'john@example.com',
@@ -94,6 +270,10 @@ def payment_form():
         'passengers': 2
     }
     
+    # Fare, service fee, tax and total as exact two-decimal strings
+    passenger_fares = ['225.00'] * order_data['passengers']
+    order_data.update(quote(passenger_fares).summary())
+    
     # Payment method options
     payment_methods = [
         {
@@ -119,6 +299,12 @@ def payment_form():
             'name': 'Net Banking',
             'icon': 'university',
             'icon_class': 'banking-icon'
+        },
+        {
+            'id': 'installment',
+            'name': 'Installment',
+            'icon': 'calendar-alt',
+            'icon_class': 'installment-icon'
         }
     ]
     
@@ -131,15 +317,19 @@ def payment_form():
         {'code': 'KBANK', 'name': 'Kasikorn Bank'}
     ]
     
+    # Gateway hosts the customer is redirected to, connected to while they choose
+    preconnect_origins = PRECONNECT_ORIGINS or [gateway_origin(MPAY_ONE_BASE_URL)]
+    
     # Return the payment form template with order data
     return render_template(
         'payment_form.html',
         order=order_data,
         payment_methods=payment_methods,
-        bank_options=bank_options
+        bank_options=bank_options,
+        preconnect_origins=preconnect_origins,
+        prefetch_enabled=PREFETCH_ENABLED
     )
 
-@app.route('/process-payment', methods=['POST'])
 def process_payment():
     """
     Step 3: Handle payment method selection and redirect to mPAY
@@ -151,46 +341,25 @@ def process_payment():
     payment_method = request.form.get('payment_method')
     merchant_id = request.form.get('merchant_id', DEFAULT_MERCHANT_ID)
     amount = request.form.get('amount')
-    currency = request.form.get('currency', 'THB')
     
     if not booking_id or not payment_method or not amount:
         return jsonify({'error': 'Missing required parameters'}), 400
     
+    # Reject amounts the payment API would refuse before registering the order
+    try:
+        normalize_amount(amount)
+    except ValueError:
+        return jsonify({'error': 'Invalid amount'}), 400
+    
     # Generate a unique transaction ID
     transaction_id = str(uuid.uuid4())
+    tracer.current_span().set_attribute('transaction_id', transaction_id)
+    tracer.correlate(transaction_id, tracer.current_span().trace_id)
     
-    # Get current website domain for redirects and webhooks
-    base_url = request.host_url.rstrip('/')
-    success_url = f"{base_url}/payment/success/{booking_id}"
-    cancel_url = f"{base_url}/payment/cancel/{booking_id}"
-    webhook_url = f"{base_url}/api/webhook"
-    
-    # Prepare common payment data
-    payment_data = {
-        'merchant_id': merchant_id,
-        'order_id': booking_id,
-        'transaction_id': transaction_id,
-        'amount': float(amount),
-        'currency': currency,
-        'description': f"Payment for Raja Ferry booking {booking_id}",
-        'redirect_url': success_url,
-        'cancel_url': cancel_url,
-        'backend_url': webhook_url,
-    }
-    
-    # Get customer information if available
-    customer_name = request.form.get('customer_name', '')
-    customer_email = request.form.get('customer_email', '')
-    customer_phone = request.form.get('customer_phone', '')
-    
-    if customer_name:
-        payment_data['customer_name'] = customer_name
-    if customer_email:
-        payment_data['customer_email'] = customer_email
-    if customer_phone:
-        payment_data['customer_phone'] = customer_phone
+    # Webhooks do not carry the route, so remember it for the revenue rollups
+    register_order(booking_id, merchant_id=merchant_id, route=request.form.get('route'))
     
-    # Add payment method specific data
+    # API endpoint of the payment method
     if payment_method == 'credit_card':
         endpoint = '/api/credit-card/payment'
     elif payment_method == 'qr_payment':
@@ -199,10 +368,6 @@ def process_payment():
         endpoint = '/api/rabbit-line-pay/payment'
     elif payment_method == 'internet_banking':
         endpoint = '/api/banking/payment'
-        # Add selected bank code
-        bank_code = request.form.get('bank_code')
-        if bank_code:
-            payment_data['bank_code'] = bank_code
     else:
         return jsonify({'error': 'Invalid payment method'}), 400
     
@@ -210,18 +375,133 @@ def process_payment():
     # we'll redirect to the actual endpoint
     return redirect(endpoint, code=307)  # 307 preserves the POST method
 
-@app.route('/payment/success/<booking_id>')
 def payment_success(booking_id):
     """Handle successful payment redirect"""
     return render_template('payment_success.html', booking_id=booking_id)
 
-@app.route('/payment/cancel/<booking_id>')
 def payment_cancel(booking_id):
     """Handle cancelled payment redirect"""
     return render_template('payment_cancel.html', booking_id=booking_id)
 
 
+def create_app(blueprints=None):
+    """
+    Create and configure the Flask application
+    
+    Only the resource modules of the requested API blueprints are imported.
+    
+    Args:
+        blueprints (list, optional): API blueprint names, defaults to APP_BLUEPRINTS
+        
+    Returns:
+        flask.Flask: Application
+    """
+    logging.basicConfig(level=LOG_LEVEL)
+    
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
+    app.json = CodecJSONProvider(app)
+    
+    # Rate limiting for payment endpoints
+    app.extensions['rate_limiter'] = create_rate_limiter() if RATE_LIMIT_ENABLED else None
+    
+    # Request hooks; after_request hooks run in reverse order of registration
+    for hook in (start_request_allocations, start_request_span, start_request_profile, enforce_rate_limits,
+                 refuse_payments_while_draining):
+        app.before_request(hook)
+    for hook in (record_payment_events, index_created_orders, tag_request_span, finish_request_profile,
+                 finish_request_allocations, recycle_oversized_worker):
+        app.after_request(hook)
+    app.teardown_request(end_request_span)
+    
+    # Health probes
+    app.add_url_rule('/healthz', view_func=healthz)
+    app.add_url_rule('/readyz', view_func=readyz)
+    
+    # Main routes
+    app.add_url_rule('/', 'index', payment_form)
+    app.add_url_rule('/payment', view_func=payment_form)
+    app.add_url_rule('/process-payment', view_func=process_payment, methods=['POST'])
+    app.add_url_rule('/payment/success/<booking_id>', view_func=payment_success)
+    app.add_url_rule('/payment/cancel/<booking_id>', view_func=payment_cancel)
+    
+    # API resources
+    from api import create_blueprint
+    for name in (APP_BLUEPRINTS if blueprints is None else blueprints):
+        app.register_blueprint(create_blueprint(name))
+    
+    # Client address, scheme and host as seen by the trusted proxies, so rate
+    # limits and velocity rules key on the customer instead of the proxy
+    if TRUSTED_PROXY_COUNT:
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT, x_host=TRUSTED_PROXY_COUNT
+        )
+    
+    # Sanitized traffic capture for replay benchmarks, outermost so it times the whole stack
+    if TRAFFIC_CAPTURE_ENABLED:
+        from utils.traffic import TrafficRecorder
+        app.wsgi_app = TrafficRecorder(
+            app.wsgi_app, TRAFFIC_CAPTURE_DIR,
+            sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE, batch_size=TRAFFIC_CAPTURE_BATCH,
+            max_body=TRAFFIC_CAPTURE_MAX_BODY
+        )
+    
+    return app
+
+
+def start_worker():
+    """Warm up this worker process and start reporting ready"""
+    # Only needed once per worker, and they pull in requests
+    from utils.outbox import shutdown as shutdown_outbox
+    from utils.fanout import shutdown as shutdown_fanout, start_dispatchers, check_subscribers
+    from utils.expiry import save_pending_orders, restore_pending_orders
+    from utils.warmup import warm_up_worker
+    
+    # Refuse to start with a subscriber configuration publishing would fail on
+    check_subscribers()
+    
+    # Graceful draining on shutdown
+    lifecycle.register_flush('outbox', shutdown_outbox)
+    lifecycle.register_flush('webhook fan-out', shutdown_fanout)
+    lifecycle.register_flush('order expiry', save_pending_orders)
+    lifecycle.register_flush('event log', close_event_log)
+    if TRAFFIC_CAPTURE_ENABLED:
+        from utils.traffic import flush_recorders
+        lifecycle.register_flush('traffic capture', flush_recorders)
+    
+    # Resume expiry timers of workers that have shut down, and deliveries left queued
+    restore_pending_orders()
+    start_dispatchers()
+    if WARMUP_ENABLED:
+        warm_up_worker()
+    lifecycle.mark_ready()
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app():
+    """Get the process-wide application, creating it on first use"""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+                # The production entrypoint (main.py) calls start_worker() in each worker after fork
+                if not lifecycle.managed:
+                    start_worker()
+    return _app
+
+
+def __getattr__(name):
+    # "app:app" for gunicorn and flask run, created on first access
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == '__main__':
+    app = get_app()
+    lifecycle.install_signal_handlers()
     app.run(host='0.0.0.0', port=5000, debug=True)
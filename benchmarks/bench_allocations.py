@@ -0,0 +1,164 @@
+"""
+Check the memory allocated by the payment hot path against budgets
+
+Sends requests through the Flask test client with tracemalloc running and
+reports, per endpoint, the peak bytes allocated while handling a request
+and the bytes still held after it, averaged over many requests with
+distinct order ids. Peak tracks per-request garbage such as buffered
+bodies and formatted log lines; retained bytes per request is what makes
+workers grow over days. Exits with status 1 if an endpoint exceeds its
+budget, so it can gate a release.
+
+Runs with a fresh data directory, the local upstream mock, and rate limits
+and velocity checks off.
+
+Usage:
+    python -m benchmarks.bench_allocations [--requests N] [--warmup N]
+"""
+
+import argparse
+import datetime
+import gc
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+THAI_TIME = datetime.timezone(datetime.timedelta(hours=7))
+
+# Bytes per request: (peak while handling it, retained after it)
+# Retained bytes include one-off growth such as dict resizes spread over the
+# run, so the budget leaves room for it: runs measure 300-700 bytes
+BUDGETS = {
+    'POST /api/qr/generate': (256 * 1024, 2048),
+    'POST /api/credit-card/payment': (256 * 1024, 2048),
+    'POST /api/webhook': (256 * 1024, 2048),
+    'POST /process-payment': (256 * 1024, 2048),
+}
+
+# Fewer measured requests do not average out that one-off growth
+MIN_REQUESTS = 500
+
+
+def qr_generate(i):
+    return '/api/qr/generate', {'json': {
+        'merchant_id': 'MERCH-12345', 'order_id': f"ORD-QR-{i:08d}", 'amount': 529.73, 'currency': 'THB',
+    }}
+
+
+def credit_card_payment(i):
+    return '/api/credit-card/payment', {'json': {
+        'merchant_id': 'MERCH-12345', 'order_id': f"ORD-CC-{i:08d}", 'amount': 529.73, 'currency': 'THB',
+        'customer_name': 'Customer', 'customer_email': 'customer@example.com', 'customer_phone': '0800000000',
+    }}
+
+
+def webhook(i):
+    from utils.signature import generate_signature
+
+    body = {
+        'merchant_id': 'MERCH-12345', 'order_id': f"ORD-WH-{i:08d}", 'transaction_id': f"TXN-{i:08d}",
+        'status': 'SUCCESS', 'payment_method': 'QR', 'amount': 529.73, 'currency': 'THB',
+        'transaction_time': datetime.datetime.now(THAI_TIME).isoformat(timespec='seconds'),
+    }
+    body['signature'] = generate_signature(body)
+    return '/api/webhook', {'json': body}
+
+
+def process_payment(i):
+    return '/process-payment', {'data': {
+        'order_id': f"ORD-PP-{i:08d}", 'payment_method': 'qr_payment', 'merchant_id': 'MERCH-12345',
+        'amount': '529.73', 'currency': 'THB', 'route': 'Donsak - Samui',
+    }}
+
+
+SCENARIOS = {
+    'POST /api/qr/generate': qr_generate,
+    'POST /api/credit-card/payment': credit_card_payment,
+    'POST /api/webhook': webhook,
+    'POST /process-payment': process_payment,
+}
+
+
+def measure(client, make_request, start, count):
+    """
+    Send count requests and trace their allocations
+
+    Returns:
+        tuple: (median peak bytes per request, mean retained bytes per request)
+    """
+    peaks = []
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(start, start + count):
+        path, kwargs = make_request(i)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        response = client.post(path, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        response.close()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    return statistics.median(peaks), retained / count
+
+
+def run(args):
+    """Measure every scenario; returns the endpoints over budget"""
+    # Configuration is read on import, after the environment main() sets
+    from app import create_app
+
+    app = create_app(['payments', 'webhook'])
+    logging.disable(logging.WARNING)
+    client = app.test_client()
+
+    tracemalloc.start()
+    failed = []
+    print(f"{'endpoint':32} {'peak/req':>12} {'budget':>10} {'retained/req':>14} {'budget':>10}")
+    for name, make_request in SCENARIOS.items():
+        measure(client, make_request, 0, args.warmup)
+        peak, retained = measure(client, make_request, args.warmup, args.requests)
+        peak_budget, retained_budget = BUDGETS[name]
+        over = peak > peak_budget or retained > retained_budget
+        if over:
+            failed.append(name)
+        print(f"{name:32} {peak:12,.0f} {peak_budget:10,} {retained:14,.0f} {retained_budget:10,}"
+              f"{'  OVER BUDGET' if over else ''}")
+    tracemalloc.stop()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the memory allocated by the payment hot path against budgets")
+    parser.add_argument('--requests', type=int, default=500, help="Measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=100, help="Unmeasured requests per endpoint first")
+    args = parser.parse_args()
+    if args.requests < MIN_REQUESTS:
+        parser.error(f"--requests must be at least {MIN_REQUESTS} for a stable retained figure")
+
+    data_dir = tempfile.mkdtemp(prefix='bench-allocations-')
+    os.environ.update(
+        MPAY_DATA_DIR=data_dir,
+        UPSTREAM_MOCK_ENABLED='true',
+        UPSTREAM_MOCK_LATENCY='0',
+        RATE_LIMIT_ENABLED='false',
+        VELOCITY_ENABLED='false',
+        TRAFFIC_CAPTURE_ENABLED='false',
+        MEMORY_TRACK_REQUESTS='false',
+    )
+    try:
+        failed = run(args)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if failed:
+        print(f"\n{len(failed)} endpoint(s) over budget: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
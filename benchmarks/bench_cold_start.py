@@ -0,0 +1,147 @@
+"""
+Benchmark worker cold start
+
+Starts the gunicorn entrypoint against a local stand-in for mPAY ONE and
+Raja Ferry, with and without warm-up, and reports the time until /readyz
+passes and the latency of the first checkout requests against the steady
+state. The stand-in upstream delays the first request on every new
+connection to mimic a TLS handshake to a remote host.
+
+Usage:
+    python -m benchmarks.bench_cold_start [--handshake-ms 80] [--runs 3]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """Keep-alive upstream answering every call with a successful createlink"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    handshake = 0.0
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.handshake)
+
+    def _reply(self, body=b''):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._reply()
+
+    def do_GET(self):
+        self._reply(b'{"status":"SUCCESS"}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._reply(b'{"status":"SUCCESS","payment_url":"https://pay.example/x"}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def timed(method, url, **kwargs):
+    started = time.perf_counter()
+    response = requests.request(method, url, timeout=30, **kwargs)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def run_server(upstream, warmup, requests_per_run):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(
+            os.environ,
+            MPAY_ONE_BASE_URL=upstream,
+            RAJA_FERRY_API_URL=upstream,
+            MPAY_DATA_DIR=data_dir,
+            WARMUP_ENABLED='true' if warmup else 'false',
+        )
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, 'main.py', '--bind', f"127.0.0.1:{port}", '--workers', '1', '--threads', '1'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server exited with status {process.returncode}")
+                try:
+                    if requests.get(f"{base}/readyz", timeout=1).status_code == 200:
+                        break
+                except requests.ConnectionError:
+                    pass
+                time.sleep(0.01)
+            ready = time.perf_counter() - started
+
+            latencies = []
+            for i in range(requests_per_run):
+                booking = {'order_id': f"COLD-{i:04d}", 'amount': '529.66'}
+                latencies.append((
+                    timed('GET', f"{base}/payment"),
+                    timed('POST', f"{base}/api/request-to-pay/bulk", json={'bookings': [booking]}),
+                ))
+            return ready, latencies
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worker cold start")
+    parser.add_argument('--handshake-ms', type=float, default=80.0,
+                        help="Delay on each new upstream connection")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=20, help="Requests timed per run")
+    args = parser.parse_args()
+
+    FakeUpstream.handshake = args.handshake_ms / 1000
+    upstream_server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUpstream)
+    upstream_server.daemon_threads = True
+    threading.Thread(target=upstream_server.serve_forever, daemon=True).start()
+    upstream = f"http://127.0.0.1:{upstream_server.server_address[1]}"
+
+    print(f"{'':12} {'ready':>9} {'1st page':>9} {'1st link':>9} {'p50 page':>9} {'p50 link':>9}")
+    for warmup in (False, True):
+        results = [run_server(upstream, warmup, args.requests) for _ in range(args.runs)]
+        ready = statistics.median(r[0] for r in results)
+        first_page = statistics.median(r[1][0][0] for r in results)
+        first_link = statistics.median(r[1][0][1] for r in results)
+        steady_page = statistics.median(p for r in results for p, _ in r[1][2:])
+        steady_link = statistics.median(l for r in results for _, l in r[1][2:])
+        print(
+            f"{'warm-up' if warmup else 'no warm-up':12} {ready * 1000:7.0f}ms {first_page * 1000:7.1f}ms "
+            f"{first_link * 1000:7.1f}ms {steady_page * 1000:7.1f}ms {steady_link * 1000:7.1f}ms"
+        )
+
+    upstream_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark payment event log appends and scans
+
+Appends synthetic request/response/webhook records to a temporary log,
+then measures full scans, merged replay and single-order lookups.
+
+Usage:
+    python -m benchmarks.bench_event_log [--events N] [--segment-size BYTES]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from utils.event_log import (
+    EventLogWriter, EventLogReader, rebuild_order_status,
+    KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK
+)
+
+
+def synthetic_records(count, orders):
+    for i in range(count):
+        order_id = f"ORD-{i % orders:08d}"
+        kind = (KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK)[i % 3]
+        if kind == KIND_WEBHOOK:
+            payload = {'path': '/api/webhook', 'status_code': 200, 'accepted': True, 'body': {
+                'merchant_id': 'MERCH-12345', 'order_id': order_id, 'payment_id': f"PAY{i}",
+                'status': 'SUCCESS', 'payment_method': 'QR', 'amount': 529.73, 'currency': 'THB'
+            }}
+        else:
+            payload = {'path': '/api/qr/generate', 'status_code': 200, 'body': {
+                'merchant_id': 'MERCH-12345', 'order_id': order_id, 'amount': 529.73, 'currency': 'THB',
+                'description': f"Payment for Raja Ferry booking {order_id}"
+            }}
+        yield kind, order_id, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the payment event log")
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--segment-size', type=int, default=16 * 1024 * 1024)
+    parser.add_argument('--fsync-batch', type=int, default=256)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='event-log-bench-')
+    try:
+        writer = EventLogWriter(
+            os.path.join(root, 'bench'), segment_size=args.segment_size, fsync_batch=args.fsync_batch
+        )
+        records = list(synthetic_records(args.events, args.orders))
+
+        started = time.perf_counter()
+        for kind, order_id, payload in records:
+            writer.append(kind, order_id, payload)
+        writer.close()
+        elapsed = time.perf_counter() - started
+
+        size = sum(
+            os.path.getsize(os.path.join(root, 'bench', name)) for name in os.listdir(os.path.join(root, 'bench'))
+        )
+        print(f"append:  {args.events / elapsed:>12,.0f} events/s  {size / elapsed / 1e6:>8.1f} MB/s  "
+              f"({size / 1e6:.1f} MB, fsync every {args.fsync_batch})")
+
+        reader = EventLogReader(root)
+        started = time.perf_counter()
+        scanned = sum(1 for _ in reader.scan())
+        elapsed = time.perf_counter() - started
+        print(f"scan:    {scanned / elapsed:>12,.0f} events/s  {size / elapsed / 1e6:>8.1f} MB/s")
+
+        started = time.perf_counter()
+        orders = rebuild_order_status(reader)
+        elapsed = time.perf_counter() - started
+        print(f"replay:  {args.events / elapsed:>12,.0f} events/s  ({len(orders)} orders rebuilt)")
+
+        lookups = 200
+        started = time.perf_counter()
+        for i in range(lookups):
+            reader.read_order(f"ORD-{(i * 7919) % args.orders:08d}")
+        elapsed = time.perf_counter() - started
+        print(f"lookup:  {elapsed / lookups * 1000:>12.2f} ms/order")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
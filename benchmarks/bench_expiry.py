@@ -0,0 +1,57 @@
+"""
+Benchmark the order expiry timing wheel
+
+Schedules, cancels and expires a large number of timers and reports the
+cost per operation and the memory held per timer.
+
+Usage:
+    python -m benchmarks.bench_expiry [--timers N]
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from utils.expiry import TimingWheel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the order expiry timing wheel")
+    parser.add_argument('--timers', type=int, default=500000)
+    parser.add_argument('--max-ttl', type=int, default=3600)
+    args = parser.parse_args()
+
+    start = 1_700_000_000.0
+    keys = [f"ORD-{i:010d}" for i in range(args.timers)]
+    ttls = [random.randint(60, args.max_ttl) for _ in keys]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    wheel = TimingWheel(tick=1.0, now=start)
+
+    began = time.perf_counter()
+    for key, ttl in zip(keys, ttls):
+        wheel.schedule(key, start + ttl)
+    elapsed = time.perf_counter() - began
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    print(f"schedule: {elapsed / args.timers * 1e6:8.2f} us/timer   "
+          f"{held / args.timers:6.0f} bytes/timer ({held / 1e6:.1f} MB for {args.timers:,} timers)")
+
+    cancelled = keys[::2]
+    began = time.perf_counter()
+    for key in cancelled:
+        wheel.cancel(key)
+    elapsed = time.perf_counter() - began
+    print(f"cancel:   {elapsed / len(cancelled) * 1e6:8.2f} us/timer")
+
+    began = time.perf_counter()
+    expired = 0
+    for second in range(1, args.max_ttl + 2):
+        expired += len(wheel.advance(start + second))
+    elapsed = time.perf_counter() - began
+    print(f"advance:  {elapsed / args.max_ttl * 1e6:8.2f} us/tick   {expired:,} expired, {len(wheel)} left")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark import time
+
+Imports each target in a fresh interpreter with ``-X importtime`` and
+reports its total import time, the packages that cost the most and
+whether Flask, requests or NumPy were loaded. Targets cover the signing and
+config utilities used by CLI jobs, the app module itself and a full
+application built by the factory.
+
+Usage:
+    python -m benchmarks.bench_import_time [--runs 5] [--top 8]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, code run in a fresh interpreter)
+TARGETS = (
+    ('config', 'import config'),
+    ('signature', 'import utils.signature'),
+    ('pricing', 'import utils.pricing'),
+    ('app module', 'import app'),
+    ('admin app', "import app; app.create_app(['admin'])"),
+    ('full app', 'import app; app.create_app()'),
+)
+
+HEAVY = ('flask', 'requests', 'numpy')
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def profile(code, env):
+    """Run code once and return (wall seconds, {module: self us}, heavy packages loaded)"""
+    check = f"{code}\nimport sys\nprint(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', check],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - started
+
+    self_times = {match.group(3): int(match.group(1)) for match in LINE.finditer(result.stderr)}
+    loaded = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ''
+    return elapsed, self_times, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help="Heaviest packages listed per target")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, MPAY_DATA_DIR=data_dir, LOG_LEVEL='ERROR', WARMUP_ENABLED='false')
+        # Keep interpreter startup (site, encodings) out of the figures
+        _, baseline, _ = profile('pass', env)
+
+        for name, code in TARGETS:
+            runs = [profile(code, env) for _ in range(args.runs)]
+            wall = statistics.median(r[0] for r in runs)
+            # Self time summed per top-level package, e.g. flask, werkzeug, utils
+            packages = {}
+            for module in runs[0][1]:
+                if module not in baseline:
+                    package = module.split('.')[0]
+                    packages[package] = packages.get(package, 0) + statistics.median(r[1].get(module, 0) for r in runs)
+            total = sum(packages.values())
+            print(f"{name:12} {total / 1000:7.1f}ms imports {wall * 1000:7.1f}ms wall  heavy: {runs[0][2] or 'none'}")
+            for package, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+                print(f"    {us / 1000:7.1f}ms  {package}")
+
+
+if __name__ == '__main__':
+    main()
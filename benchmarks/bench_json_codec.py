@@ -0,0 +1,124 @@
+"""
+Benchmark JSON serialization cost per API response
+
+Compares the stdlib json encoder used by flask_restful's default
+representation with utils.json_codec, and times the full representation
+path through the Flask test client.
+
+Usage:
+    python -m benchmarks.bench_json_codec [--iterations N]
+"""
+
+import argparse
+import json
+import timeit
+from utils import json_codec
+
+# Typical payloads returned by the api/* resources
+RESPONSES = {
+    "credit_card": {
+        "status": "SUCCESS",
+        "message": "Payment order created successfully",
+        "redirect_url": "/payment-success?order_id=ORD-2025001&payment_method=Credit Card",
+        "order_id": "ORD-2025001",
+        "amount": 529.73,
+        "currency": "THB"
+    },
+    "inquiry": {
+        "status": "SUCCESS",
+        "message": "Payment inquiry successful",
+        "order_id": "ORD-2025001",
+        "amount": 529.73,
+        "currency": "THB",
+        "payment_method": "Credit Card",
+        "payment_channel": "VISA",
+        "paid_agent": "BANK",
+        "paid_channel": "CC",
+        "transaction_time": "2025-03-10T15:30:25+07:00"
+    },
+    "qr": {
+        "status": "SUCCESS",
+        "message": "QR code generated successfully",
+        "order_id": "ORD-2025001",
+        "amount": 529.73,
+        "currency": "THB",
+        "qr_image": "data:image/svg+xml;base64," + ("3c7376672076696577426f783d" * 40),
+        "qr_code": "00020101021229370016A000000677010111011300669000000115802TH53037645406529.736304FDF0"
+    }
+}
+
+SIGNING_PAYLOAD = {
+    "merchant_id": "MERCH-12345",
+    "order_id": "ORD-2025001",
+    "transaction_id": "6f1c2d4e-1b2a-4c3d-9e8f-0a1b2c3d4e5f",
+    "amount": 529.73,
+    "currency": "THB",
+    "description": "Payment for Raja Ferry booking ORD-2025001",
+    "redirect_url": "https://example.com/payment/success/ORD-2025001",
+    "backend_url": "https://example.com/api/webhook"
+}
+
+# Payloads on the edge of the orjson fast path; each must sign the same bytes
+# as the stdlib encoder
+CANONICAL_CASES = [
+    SIGNING_PAYLOAD,
+    {"order_id": "ORD-2025001", "description": "Rüdesheim ferry"},
+    {"order_id": "ORD-2025001", "description": "tab\tnewline\ndel\x7fend"},
+    {"order_id": "ORD-2025001", "amount": 1e-05, "fee": 1e16},
+    {"order_id": "ORD-2025001", "items": [{"amount": 529.73}]},
+]
+
+
+def _per_call_us(stmt, iterations):
+    return timeit.timeit(stmt, number=iterations) / iterations * 1e6
+
+
+def _stdlib_canonical(data):
+    sorted_data = {k: data[k] for k in sorted(data.keys())}
+    return json.dumps(sorted_data, separators=(',', ':')).encode('utf-8')
+
+
+def check_canonical():
+    for payload in CANONICAL_CASES:
+        assert json_codec.canonical_dumps(payload) == _stdlib_canonical(payload), \
+            f"canonical_dumps differs from json.dumps for {payload!r}"
+
+
+def bench_serialization(iterations):
+    print(f"JSON backend: {json_codec.BACKEND}")
+    print(f"{'payload':<14}{'stdlib json (us)':>18}{'json_codec (us)':>18}{'speedup':>10}")
+    for name, payload in RESPONSES.items():
+        stdlib = _per_call_us(lambda: json.dumps(payload) + "\n", iterations)
+        codec = _per_call_us(lambda: json_codec.dumps_bytes(payload), iterations)
+        print(f"{name:<14}{stdlib:>18.2f}{codec:>18.2f}{stdlib / codec:>9.1f}x")
+
+    stdlib = _per_call_us(lambda: _stdlib_canonical(SIGNING_PAYLOAD), iterations)
+    codec = _per_call_us(lambda: json_codec.canonical_dumps(SIGNING_PAYLOAD), iterations)
+    print(f"{'canonical':<14}{stdlib:>18.2f}{codec:>18.2f}{stdlib / codec:>9.1f}x")
+
+
+def bench_representation(iterations):
+    from app import create_app
+
+    app = create_app(['payments'])
+
+    client = app.test_client()
+    body = {"merchant_id": "MERCH-12345", "order_id": "ORD-2025001"}
+    # Warm up routing and the JSON provider before timing
+    client.post('/api/payment/inquiry', json=body)
+    per_request = _per_call_us(lambda: client.post('/api/payment/inquiry', json=body), iterations)
+    print(f"Full /api/payment/inquiry round trip: {per_request:.1f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    check_canonical()
+    bench_serialization(args.iterations)
+    bench_representation(max(args.iterations // 20, 100))
+
+
+if __name__ == '__main__':
+    main()
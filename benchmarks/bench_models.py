@@ -0,0 +1,135 @@
+"""
+Benchmark the models.py domain objects against plain dicts
+
+For a payment order, a gateway response and a webhook event, reports the
+memory held per object, the cost of parsing a request payload into one
+(validation and amount rounding included, as the resources do it for the
+dict), the cost of producing the canonical signing bytes, and the pickled
+size that queues and caches pay for.
+
+Usage:
+    python -m benchmarks.bench_models [--objects N] [--iterations N]
+"""
+
+import argparse
+import gc
+import pickle
+import timeit
+import tracemalloc
+from models import PaymentOrder, GatewayResponse, WebhookEvent, PAYMENT_REQUIRED_FIELDS
+from utils.json_codec import canonical_dumps
+from utils.pricing import normalize_amount
+
+ORDER = {
+    "merchant_id": "MERCH-12345",
+    "order_id": "ORD-2025001",
+    "transaction_id": "6f1c2d4e-1b2a-4c3d-9e8f-0a1b2c3d4e5f",
+    "amount": 529.73,
+    "currency": "THB",
+    "description": "Payment for Raja Ferry booking ORD-2025001",
+    "customer_name": "John Doe",
+    "customer_email": "customer@example.com",
+    "customer_phone": "0812345678",
+    "redirect_url": "https://example.com/payment/success/ORD-2025001",
+    "cancel_url": "https://example.com/payment/cancel/ORD-2025001",
+    "backend_url": "https://example.com/api/webhook",
+}
+
+RESPONSE = {
+    "status": "SUCCESS",
+    "message": "Payment order created successfully",
+    "redirect_url": "/payment-success?order_id=ORD-2025001&payment_method=Credit Card",
+    "order_id": "ORD-2025001",
+    "amount": 529.73,
+    "currency": "THB",
+}
+
+WEBHOOK = {
+    "merchant_id": "MERCH-12345",
+    "order_id": "ORD-2025001",
+    "amount": 529.73,
+    "currency": "THB",
+    "payment_id": "PAY123",
+    "status": "SUCCESS",
+    "payment_method": "CREDIT_CARD",
+    "payment_channel": "VISA",
+    "paid_agent": "BANK",
+    "paid_channel": "CC",
+    "transaction_time": "2025-03-10T15:30:25+07:00",
+    "signature": "0" * 64,
+}
+
+
+def parse_order_dict(payload):
+    """What the resources did with a payment payload before the models"""
+    for field in PAYMENT_REQUIRED_FIELDS:
+        if field not in payload:
+            raise ValueError(f"Missing required field: {field}")
+    payload = dict(payload)
+    payload['amount'] = normalize_amount(payload['amount'])
+    return payload
+
+
+def parse_webhook_dict(payload):
+    """What the webhook handler did with a notification before the models"""
+    webhook_data = dict(payload)
+    webhook_data.pop('signature', None)
+    return webhook_data
+
+
+CASES = (
+    # name, payload, dict parser, model parser, dict to signing bytes, model to signing bytes
+    ("PaymentOrder", ORDER, parse_order_dict, PaymentOrder.from_payload,
+     canonical_dumps, PaymentOrder.canonical_bytes),
+    ("GatewayResponse", RESPONSE, dict, GatewayResponse.from_payload, None, None),
+    ("WebhookEvent", WEBHOOK, parse_webhook_dict, WebhookEvent.from_payload,
+     canonical_dumps, WebhookEvent.canonical_bytes),
+)
+
+
+def bytes_per_object(parse, payload, count):
+    # Distinct order ids so nothing is shared between the objects but interned keys
+    payloads = [dict(payload, order_id=f"ORD-{i:08d}") for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    objects = [parse(p) for p in payloads]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return held / count
+
+
+def per_call_us(stmt, iterations):
+    return timeit.timeit(stmt, number=iterations) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the models.py domain objects against plain dicts")
+    parser.add_argument('--objects', type=int, default=100000, help="Objects held for the memory figures")
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'':16}{'bytes/object':>24}{'parse (us)':>22}{'sign bytes (us)':>22}{'pickled bytes':>22}")
+    print(f"{'':16}" + f"{'dict':>12}{'model':>12}" + f"{'dict':>11}{'model':>11}" * 2 + f"{'dict':>11}{'model':>11}")
+    for name, payload, parse_dict, parse_model, dict_bytes, model_bytes in CASES:
+        memory = [bytes_per_object(parse, payload, args.objects) for parse in (parse_dict, parse_model)]
+        parse = [per_call_us(lambda: parse(payload), args.iterations) for parse in (parse_dict, parse_model)]
+
+        data, model = parse_dict(payload), parse_model(payload)
+        if model_bytes is not None:
+            assert model_bytes(model) == dict_bytes(data), f"{name} signs different bytes than the dict"
+            signing = [
+                per_call_us(lambda: dict_bytes(data), args.iterations),
+                per_call_us(lambda: model_bytes(model), args.iterations),
+            ]
+            signing_cells = f"{signing[0]:>11.2f}{signing[1]:>11.2f}"
+        else:
+            signing_cells = f"{'-':>11}{'-':>11}"
+        pickled = [len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)) for obj in (data, model)]
+
+        print(f"{name:16}{memory[0]:>12.0f}{memory[1]:>12.0f}{parse[0]:>11.2f}{parse[1]:>11.2f}"
+              f"{signing_cells}{pickled[0]:>11}{pickled[1]:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark pricing of large group quotes
+
+Prices a booking with many passengers through the NumPy and the list path
+and checks both against a straightforward Decimal implementation.
+
+Usage:
+    python -m benchmarks.bench_pricing [--passengers N]
+"""
+
+import argparse
+import random
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from utils import pricing
+from utils.pricing import FeeRules, quote_satang, to_satang
+
+CENT = Decimal('0.01')
+
+
+def decimal_total(fares, service_fee_rate, service_fee_fixed, vat_rate):
+    total = Decimal(0)
+    for fare in fares:
+        fare = Decimal(fare) / 100
+        fee = (fare * service_fee_rate).quantize(CENT, rounding=ROUND_HALF_UP) + service_fee_fixed
+        tax = ((fare + fee) * vat_rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        total += fare + fee + tax
+    return to_satang(total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pricing of large group quotes")
+    parser.add_argument('--passengers', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rules = FeeRules(service_fee_rate='0.10', service_fee_fixed='5.00', vat_rate='0.07')
+    fares = [random.choice((22500, 11250, 45000)) + random.randint(0, 99) for _ in range(args.passengers)]
+
+    began = time.perf_counter()
+    expected = decimal_total(fares, Decimal('0.10'), Decimal('5.00'), Decimal('0.07'))
+    print(f"decimal: {time.perf_counter() - began:8.4f}s")
+
+    numpy = pricing.import_numpy()
+    for backend in ('numpy', 'python'):
+        if backend == 'numpy' and numpy is None:
+            print("numpy:   not installed")
+            continue
+        pricing._numpy = numpy if backend == 'numpy' else False
+        began = time.perf_counter()
+        for _ in range(args.repeat):
+            result = quote_satang(fares, rules)
+        elapsed = (time.perf_counter() - began) / args.repeat
+        assert result.total == expected, (backend, result.total, expected)
+        print(f"{backend + ':':8} {elapsed:8.4f}s  ({args.passengers / elapsed:,.0f} passengers/s)")
+    pricing._numpy = numpy or False
+
+    print(f"total {result.summary()['total']} THB for {args.passengers:,} passengers")
+
+
+if __name__ == '__main__':
+    main()
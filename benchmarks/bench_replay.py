@@ -0,0 +1,247 @@
+"""
+Replay recorded payment traffic against one or two builds
+
+Replays captures written with TRAFFIC_CAPTURE_ENABLED (utils/traffic.py)
+in their recorded order and spacing, sped up by --scale, against a
+gunicorn server started from each build directory with a fresh data
+directory and the local upstream mock in place. Reports latency
+percentiles per endpoint and, for two builds, the change from the first to
+the second. Requests are sent open loop: a slow build falls behind the
+schedule instead of slowing it down, and the lag is reported.
+
+Bodies are sent as recorded; webhooks get a current transaction_time and
+a fresh signature so the replay guard accepts them. Rate limits and
+velocity checks are off unless --keep-limits, since all replayed traffic
+comes from one address.
+
+Usage:
+    python -m benchmarks.bench_replay var/traffic
+    python -m benchmarks.bench_replay var/traffic --build ../MpayAPI-before --build . --scale 4
+    python -m benchmarks.bench_replay capture-123.jsonl.gz --target http://127.0.0.1:8000 --save after.json
+    python -m benchmarks.bench_replay --compare before.json after.json
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from utils.signature import generate_signature
+from utils.traffic import load_recordings, BODY_JSON, BODY_FORM
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+THAI_TIME = datetime.timezone(datetime.timedelta(hours=7))
+
+PERCENTILES = (50, 90, 99)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request_kwargs(entry):
+    """Build the keyword arguments that resend a recorded request"""
+    body = entry.get('body')
+    if entry.get('encoding') == BODY_JSON and body is not None:
+        if entry['path'] == '/api/webhook' and isinstance(body, dict):
+            body = dict(body, transaction_time=datetime.datetime.now(THAI_TIME).isoformat(timespec='seconds'))
+            body['signature'] = generate_signature(body)
+        return {'json': body}
+    if entry.get('encoding') == BODY_FORM and body is not None:
+        return {'data': body}
+    return {}
+
+
+def replay(base_url, entries, scale=1.0, concurrency=32, timeout=30):
+    """
+    Send recorded requests on their recorded schedule
+
+    Returns:
+        list: (endpoint, recorded status, status or None on error, latency, lag) per request
+    """
+    local = threading.local()
+    results = []
+    results_lock = threading.Lock()
+
+    def send(entry, due):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        url = base_url + entry['path'] + (f"?{entry['query']}" if entry.get('query') else '')
+        started = time.perf_counter()
+        try:
+            response = session.request(entry['method'], url, allow_redirects=False, timeout=timeout,
+                                       **request_kwargs(entry))
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        latency = time.perf_counter() - started
+        with results_lock:
+            results.append((f"{entry['method']} {entry['path']}", entry.get('status'), status, latency, started - due))
+
+    first = entries[0]['ts'] if entries else 0.0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = time.perf_counter()
+        for entry in entries:
+            due = started + (entry['ts'] - first) / scale
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, entry, due)
+    return results
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(results):
+    """Latency distribution per endpoint, plus 'all'"""
+    groups = {}
+    for result in results:
+        groups.setdefault(result[0], []).append(result)
+    if results:
+        groups['all'] = results
+
+    summary = {}
+    for endpoint, group in groups.items():
+        latencies = sorted(r[3] * 1000 for r in group)
+        summary[endpoint] = {
+            'count': len(group),
+            'errors': sum(1 for r in group if r[2] is None or r[2] >= 500),
+            'status_changed': sum(1 for r in group if r[2] != r[1]),
+            'max_lag_ms': round(max(r[4] for r in group) * 1000, 2),
+            **{f"p{p}_ms": round(percentile(latencies, p), 2) for p in PERCENTILES},
+            'max_ms': round(latencies[-1], 2),
+        }
+    return summary
+
+
+def run_build(build, entries, args):
+    """Start a server from a build directory, replay against it and stop it"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(
+            os.environ,
+            MPAY_DATA_DIR=data_dir,
+            UPSTREAM_MOCK_ENABLED='true',
+            UPSTREAM_MOCK_LATENCY=str(args.upstream_ms / 1000),
+            TRAFFIC_CAPTURE_ENABLED='false',
+            LOG_LEVEL='WARNING',
+        )
+        if not args.keep_limits:
+            env.update(RATE_LIMIT_ENABLED='false', VELOCITY_ENABLED='false')
+        process = subprocess.Popen(
+            [sys.executable, 'main.py', '--bind', f"127.0.0.1:{port}",
+             '--workers', str(args.workers), '--threads', str(args.threads)],
+            cwd=build, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"Server from {build} exited with status {process.returncode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Server from {build} did not become ready")
+                try:
+                    if requests.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                        break
+                except requests.ConnectionError:
+                    pass
+                time.sleep(0.05)
+            return summarize(replay(base_url, entries, args.scale, args.concurrency))
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+
+
+def print_summary(name, summary):
+    print(f"\n{name}")
+    print(f"  {'endpoint':42} {'count':>6} {'err':>4} {'chg':>4} "
+          + ''.join(f"{f'p{p}':>9}" for p in PERCENTILES) + f" {'max':>9} {'lag':>9}")
+    for endpoint in sorted(summary, key=lambda e: (e != 'all', e)):
+        row = summary[endpoint]
+        print(f"  {endpoint:42} {row['count']:6} {row['errors']:4} {row['status_changed']:4} "
+              + ''.join(f"{row[f'p{p}_ms']:7.1f}ms" for p in PERCENTILES)
+              + f" {row['max_ms']:7.1f}ms {row['max_lag_ms']:7.1f}ms")
+
+
+def print_diff(before, after):
+    print("\nchange (second vs first)")
+    print(f"  {'endpoint':42} " + ''.join(f"{f'p{p}':>16}" for p in PERCENTILES))
+    for endpoint in sorted(set(before) & set(after), key=lambda e: (e != 'all', e)):
+        cells = []
+        for p in PERCENTILES:
+            old, new = before[endpoint][f"p{p}_ms"], after[endpoint][f"p{p}_ms"]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+            cells.append(f"{new - old:+7.1f}ms {change:>7}")
+        print(f"  {endpoint:42} " + ''.join(f"{cell:>16}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded payment traffic against one or two builds")
+    parser.add_argument('recordings', nargs='*', help="Capture files or directories")
+    parser.add_argument('--build', action='append', help="Build directory with main.py, up to two (default: this tree)")
+    parser.add_argument('--target', help="Replay against a running server instead of starting builds")
+    parser.add_argument('--scale', type=float, default=1.0, help="Speed-up over the recorded rate")
+    parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+    parser.add_argument('--concurrency', type=int, default=32, help="Requests in flight at most")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--upstream-ms', type=float, default=50.0, help="Latency of the upstream mock")
+    parser.add_argument('--keep-limits', action='store_true', help="Keep rate limits and velocity checks on")
+    parser.add_argument('--save', help="Write the summary of the (last) run as JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help="Diff two saved summaries")
+    args = parser.parse_args()
+
+    if args.compare:
+        summaries = []
+        for path in args.compare:
+            with open(path) as f:
+                summaries.append(json.load(f))
+        for path, summary in zip(args.compare, summaries):
+            print_summary(path, summary)
+        print_diff(*summaries)
+        return
+
+    entries = load_recordings(args.recordings)[:args.limit]
+    if not entries:
+        parser.error("no recorded requests found")
+    span = entries[-1]['ts'] - entries[0]['ts']
+    print(f"{len(entries)} requests over {span:.1f}s, replayed at {args.scale:g}x")
+
+    if args.target:
+        runs = [(args.target, summarize(replay(args.target.rstrip('/'), entries, args.scale, args.concurrency)))]
+    else:
+        builds = args.build or [ROOT]
+        if len(builds) > 2:
+            parser.error("at most two builds")
+        runs = [(os.path.abspath(build), run_build(os.path.abspath(build), entries, args)) for build in builds]
+
+    for name, summary in runs:
+        print_summary(name, summary)
+    if len(runs) == 2:
+        print_diff(runs[0][1], runs[1][1])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(runs[-1][1], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark revenue rollup backfill aggregation and queries
+
+Aggregates synthetic payments and refunds with the NumPy and the pure
+Python paths, then times dashboard queries against the loaded buckets.
+
+Usage:
+    python -m benchmarks.bench_revenue [--rows N]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from utils import pricing
+from utils.revenue import RevenueColumns, RevenueRollup, GRANULARITIES
+
+METHODS = ['CREDIT_CARD', 'QR', 'RABBIT_LINE_PAY', 'INSTALLMENT', 'INTERNET_BANKING']
+MERCHANTS = [f"MERCH-{i:05d}" for i in range(20)]
+ROUTES = ['Donsak - Samui', 'Donsak - Phangan', 'Samui - Phangan', 'Khanom - Samui']
+
+
+def build_columns(rows, days):
+    start = 1_735_664_400.0
+    columns = RevenueColumns()
+    for _ in range(rows):
+        dims = (random.choice(METHODS), random.choice(MERCHANTS), random.choice(ROUTES))
+        timestamp = start + random.random() * days * 86400
+        if random.random() < 0.05:
+            columns.append(timestamp, dims, refunds=1, refund_amount=random.randint(10000, 200000))
+        else:
+            columns.append(timestamp, dims, payments=1, amount=random.randint(10000, 200000))
+    return columns, start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark revenue rollup aggregation and queries")
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    columns, start = build_columns(args.rows, args.days)
+    numpy = pricing.import_numpy()
+
+    results = {}
+    for backend in ('numpy', 'python'):
+        if backend == 'numpy' and numpy is None:
+            print("numpy:   not installed")
+            continue
+        pricing._numpy = numpy if backend == 'numpy' else False
+        began = time.perf_counter()
+        results[backend] = {g: columns.aggregate(g, 7 * 3600) for g in GRANULARITIES}
+        elapsed = time.perf_counter() - began
+        print(f"{backend + ':':8} {elapsed:7.3f}s aggregate  ({args.rows / elapsed:,.0f} rows/s)")
+    pricing._numpy = numpy or False
+
+    if len(results) == 2:
+        assert sorted(results['numpy']['hour']) == sorted(results['python']['hour'])
+        assert sorted(results['numpy']['day']) == sorted(results['python']['day'])
+
+    with tempfile.TemporaryDirectory() as directory:
+        rollup = RevenueRollup(os.path.join(directory, 'revenue.db'), utc_offset=7 * 3600)
+        rows = next(iter(results.values()))
+        began = time.perf_counter()
+        for granularity, aggregated in rows.items():
+            rollup.load(aggregated, granularity)
+        print(f"load:    {time.perf_counter() - began:7.3f}s for {sum(len(r) for r in rows.values()):,} bucket rows")
+
+        queries = [
+            ('day', {'group_by': ('payment_method',), 'route': 'Donsak - Samui'}),
+            ('hour', {'group_by': (), 'payment_method': 'QR'}),
+            ('hour', {}),
+        ]
+        for granularity, options in queries:
+            day = start + random.randint(0, args.days - 1) * 86400
+            began = time.perf_counter()
+            for _ in range(100):
+                result = rollup.query(granularity, day, day + 86400, **options)
+            elapsed = (time.perf_counter() - began) / 100
+            print(f"query {granularity:4} {options}: {elapsed * 1000:.2f} ms ({len(result)} rows)")
+
+
+if __name__ == '__main__':
+    main()
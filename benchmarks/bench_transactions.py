@@ -0,0 +1,88 @@
+"""
+Benchmark transaction search
+
+Indexes synthetic orders, then times searches by prefix, email and
+status, and compares paging deep into the results with the keyset cursor
+against the equivalent OFFSET query.
+
+Usage:
+    python -m benchmarks.bench_transactions [--orders N]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from utils.transactions import TransactionStore, COLUMNS
+
+STATUSES = ['CREATED', 'SUCCESS', 'SUCCESS', 'SUCCESS', 'FAILED', 'CANCELED']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transaction search")
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TransactionStore(os.path.join(directory, 'transactions.db'))
+        conn = store._connection()
+        start = time.time() - 90 * 86400
+
+        began = time.perf_counter()
+        conn.execute("BEGIN")
+        for i in range(args.orders):
+            store.record_order({
+                'order_id': f"ORD-{i:08d}",
+                'merchant_id': f"MERCH-{i % 20:05d}",
+                'amount': 529.66,
+                'currency': 'THB',
+                'customer_email': f"customer{i % 50000}@example.com",
+                'customer_phone': f"08{i % 50000:08d}",
+            }, payment_method='QR', now=start + i * 90 * 86400 / args.orders)
+            conn.execute("UPDATE transactions SET status = ? WHERE order_id = ?",
+                         (random.choice(STATUSES), f"ORD-{i:08d}"))
+        conn.execute("COMMIT")
+        print(f"index:  {args.orders / (time.perf_counter() - began):,.0f} orders/s")
+
+        searches = [
+            ('prefix', {'order_id_prefix': 'ORD-0012'}),
+            ('email', {'email': 'Customer123@example.com'}),
+            ('status', {'status': 'FAILED'}),
+            ('status+range', {'status': 'SUCCESS', 'start': start + 30 * 86400, 'end': start + 31 * 86400}),
+        ]
+        for name, criteria in searches:
+            began = time.perf_counter()
+            for _ in range(50):
+                rows, _ = store.search(limit=args.page_size, **criteria)
+            print(f"{name:13} {(time.perf_counter() - began) / 50 * 1000:7.2f} ms/page ({len(rows)} rows)")
+
+        # Walk to page 1000 of FAILED with the cursor, then fetch it with OFFSET
+        pages = min(1000, args.orders // 6 // args.page_size - 1)
+        cursor = None
+        for _ in range(pages):
+            _, cursor = store.search(status='FAILED', cursor=cursor, limit=args.page_size)
+        began = time.perf_counter()
+        for _ in range(20):
+            keyset_rows, _ = store.search(status='FAILED', cursor=cursor, limit=args.page_size)
+        keyset = (time.perf_counter() - began) / 20
+
+        began = time.perf_counter()
+        for _ in range(20):
+            offset_rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM transactions WHERE status = ?"
+                f" ORDER BY created_at DESC, order_id DESC LIMIT ? OFFSET ?",
+                ('FAILED', args.page_size, pages * args.page_size)
+            ).fetchall()
+        offset = (time.perf_counter() - began) / 20
+        assert [r['order_id'] for r in keyset_rows] == [r[0] for r in offset_rows]
+        print(f"page {pages}: cursor {keyset * 1000:.2f} ms, OFFSET {offset * 1000:.2f} ms")
+
+        began = time.perf_counter()
+        exported = sum(1 for _ in store.iter_search(status='SUCCESS'))
+        print(f"export: {exported:,} rows in {time.perf_counter() - began:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
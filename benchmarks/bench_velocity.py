@@ -0,0 +1,76 @@
+"""
+Benchmark the velocity engine
+
+Fills every rule with the requested number of tracked keys and reports the
+cost of a check and the memory held per key. Every worker process holds
+its own counters, so the total is per worker.
+
+Usage:
+    python -m benchmarks.bench_velocity [--keys N]
+"""
+
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from utils.velocity import VelocityEngine, parse_rules
+from config import VELOCITY_RULES, VELOCITY_MAX_KEYS
+
+
+def make_payload(i):
+    return {
+        'merchant_id': 'MERCH-12345',
+        'order_id': f"ORD-{i:08d}",
+        'amount': random.choice((529.73, 450.00, 12.00)),
+        'customer_email': f"customer{i}@example.com",
+        'customer_phone': f"08{i:08d}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the velocity engine")
+    parser.add_argument('--keys', type=int, default=VELOCITY_MAX_KEYS, help="Keys per rule")
+    parser.add_argument('--checks', type=int, default=200000)
+    args = parser.parse_args()
+
+    # Blocked attempts are logged; keep the output to the numbers
+    logging.disable(logging.WARNING)
+
+    rules = parse_rules(VELOCITY_RULES)
+    payloads = [make_payload(i) for i in range(args.keys)]
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(args.keys)]
+    now = time.time()
+
+    tracemalloc.start()
+    engine = VelocityEngine(rules, max_keys=args.keys)
+    began = time.perf_counter()
+    for payload, ip in zip(payloads, ips):
+        engine.check(payload, ip, now)
+    fill = time.perf_counter() - began
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    keys = sum(rule['keys'] for rule in engine.stats()['rules'].values())
+    print(f"fill:   {fill / args.keys * 1e6:7.2f} us/check   {held / keys:5.0f} bytes/key "
+          f"({held / 1e6:.1f} MB per worker for {keys:,} keys over {len(rules)} rules)")
+
+    # Steady state: mostly known keys, some new ones forcing evictions
+    samples = []
+    for n in range(args.checks):
+        i = random.randrange(args.keys * 11 // 10)
+        payload = payloads[i] if i < args.keys else make_payload(i)
+        ip = ips[i] if i < args.keys else f"172.16.{i >> 8 & 255}.{i & 255}"
+        began = time.perf_counter()
+        engine.check(payload, ip, now + n * 0.01)
+        samples.append(time.perf_counter() - began)
+
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    print(f"check:  mean {mean * 1e6:.2f} us, p50 {samples[len(samples) // 2] * 1e6:.2f} us, "
+          f"p99 {samples[int(len(samples) * 0.99)] * 1e6:.2f} us, max {samples[-1] * 1e6:.1f} us")
+    print(f"blocked {engine.stats()['blocked']:,} of {engine.stats()['checked']:,} checks")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Create Request-to-Pay links for a file of bookings
+
+Usage:
+    python -m cli.bulk_links bookings.csv --output links.jsonl
+    python -m cli.bulk_links bookings.jsonl --output - --concurrency 16
+"""
+
+import argparse
+import logging
+import sys
+import time
+from utils.payment_links import read_bookings, create_payment_links, write_results
+from config import BULK_LINK_CONCURRENCY
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create mPAY ONE payment links in bulk")
+    parser.add_argument('input', help="CSV or JSONL file with one booking per row")
+    parser.add_argument('--output', '-o', default='-', help="JSONL results file, '-' for stdout")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="Input format (default: from extension)")
+    parser.add_argument('--concurrency', '-c', type=int, default=BULK_LINK_CONCURRENCY,
+                        help="Maximum concurrent gateway calls")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    started = time.monotonic()
+    bookings = read_bookings(args.input, args.format)
+    results = create_payment_links(bookings, concurrency=args.concurrency)
+
+    if args.output == '-':
+        summary = write_results(results, sys.stdout)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            summary = write_results(results, output)
+
+    elapsed = time.monotonic() - started
+    total = sum(summary.values())
+    counts = ", ".join(f"{status}: {count}" for status, count in sorted(summary.items()))
+    print(f"Processed {total} bookings in {elapsed:.1f}s ({counts})", file=sys.stderr)
+
+    return 0 if summary.get('SUCCESS', 0) == total else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
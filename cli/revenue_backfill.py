@@ -0,0 +1,40 @@
+"""
+Rebuild revenue rollups from the payment event log
+
+Usage:
+    python -m cli.revenue_backfill
+    python -m cli.revenue_backfill --events /var/lib/mpay/events --add
+"""
+
+import argparse
+import logging
+import sys
+import time
+from utils.event_log import EventLogReader, KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK
+from utils.revenue import get_revenue_rollup, backfill
+from utils.pricing import import_numpy
+from config import EVENT_LOG_DIR
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild revenue rollups from the payment event log")
+    parser.add_argument('--events', default=EVENT_LOG_DIR, help="Event log root directory")
+    parser.add_argument('--add', action='store_true',
+                        help="Add to existing buckets instead of replacing the covered range")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    started = time.monotonic()
+    events = EventLogReader(args.events).scan_merged({KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK})
+    count = backfill(get_revenue_rollup(), events, replace=not args.add)
+
+    elapsed = time.monotonic() - started
+    backend = "numpy" if import_numpy() is not None else "python"
+    print(f"Aggregated {count} payments and refunds in {elapsed:.1f}s ({backend})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Re-run webhook handling for stored mPAY ONE notifications
+
+Usage:
+    python -m cli.webhook_backfill --jsonl webhooks.jsonl --checkpoint backfill.ckpt
+    python -m cli.webhook_backfill --events /var/lib/mpay/events --dry-run --output diff.jsonl
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from utils import json_codec
+from utils.webhook_backfill import (
+    WebhookBackfill, JsonlSource, EventLogSource, BackfillError, load_checkpoint
+)
+from config import EVENT_LOG_DIR
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run webhook handling for stored notifications")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--jsonl', help="File with one signed webhook payload per line, '-' for stdin")
+    source.add_argument('--events', default=EVENT_LOG_DIR, help="Payment event log root directory")
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=500, help="Webhooks per worker batch")
+    parser.add_argument('--checkpoint', help="Checkpoint file; an existing one is resumed from")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Write nothing and output the status changes the run would make")
+    parser.add_argument('--output', '-o', default='-', help="Dry-run diff as JSONL, '-' for stdout")
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    if args.jsonl:
+        path = args.jsonl if args.jsonl == '-' else os.path.abspath(args.jsonl)
+    else:
+        path = os.path.abspath(args.events)
+
+    start = offset = 0
+    checkpoint = load_checkpoint(args.checkpoint) if args.checkpoint and not args.dry_run else None
+    if checkpoint is not None:
+        if checkpoint.get('source') != path:
+            print(f"Checkpoint {args.checkpoint} belongs to {checkpoint.get('source')}", file=sys.stderr)
+            return 2
+        start, offset = checkpoint['events'], checkpoint.get('offset') or 0
+        print(f"Resuming after {start} events", file=sys.stderr)
+
+    if not args.jsonl:
+        events = EventLogSource(path, skip=start)
+    elif offset and path != '-':
+        events = JsonlSource(path, offset=offset)
+    else:
+        events = JsonlSource(path, skip=start)
+
+    backfill = WebhookBackfill(
+        workers=args.workers,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+        checkpoint_path=args.checkpoint,
+        log_level=args.log_level.upper()
+    )
+
+    started = time.monotonic()
+    try:
+        counts = backfill.run(events, start=start)
+    except BackfillError as e:
+        print(f"Backfill failed ({e}); rerun with the same checkpoint to resume", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with the same checkpoint to resume", file=sys.stderr)
+        return 130
+    elapsed = time.monotonic() - started
+
+    if args.dry_run:
+        changes = sorted(backfill.changes, key=lambda change: change['order_id'])
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            for change in changes:
+                output.write(json_codec.dumps_bytes(change) + b'\n')
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+            else:
+                output.flush()
+        print(f"{len(changes)} orders would change", file=sys.stderr)
+
+    total = sum(counts.values())
+    summary = ", ".join(f"{outcome}: {n}" for outcome, n in sorted(counts.items()))
+    print(f"Processed {total} webhooks in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f}/s; {summary})",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
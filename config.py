@@ -23,6 +23,166 @@ RAJA_FERRY_API_KEY = os.environ.get("RAJA_FERRY_API_KEY", "test_raja_ferry_api_k
 # Raja Ferry Port Website URL (for redirects)
 RAJA_FERRY_WEBSITE = os.environ.get("RAJA_FERRY_WEBSITE", "https://www.rajaferryport.com")
 
+# Local data directory for state shared between workers
+DATA_DIR = os.environ.get("MPAY_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "var"))
+
+# Number of reverse proxies in front of the app that set X-Forwarded-For,
+# X-Forwarded-Proto and X-Forwarded-Host. Leave at 0 when clients connect
+# directly, or they could spoof their address past the rate limits and
+# velocity rules; behind a proxy every client would otherwise share its address.
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "0"))
+
+# Rate Limiting Configuration
+# Limits are "<requests>/<seconds>"; set a limit to "off" to disable it
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "sqlite")  # "memory" or "sqlite"
+RATE_LIMIT_SQLITE_PATH = os.environ.get("RATE_LIMIT_SQLITE_PATH", os.path.join(DATA_DIR, "rate_limit.db"))
+RATE_LIMIT_MERCHANT = os.environ.get("RATE_LIMIT_MERCHANT", "600/60")
+RATE_LIMIT_CLIENT = os.environ.get("RATE_LIMIT_CLIENT", "20/60")
+RATE_LIMIT_ENDPOINT = os.environ.get("RATE_LIMIT_ENDPOINT", "3000/60")
+
+# Maximum pooled connections per upstream host
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "32"))
+
+# Bulk Request-to-Pay link creation
+BULK_LINK_CONCURRENCY = int(os.environ.get("BULK_LINK_CONCURRENCY", "8"))
+
+# Adaptive concurrency cap for outbound mPAY ONE calls
+MPAY_CONCURRENCY_INITIAL = int(os.environ.get("MPAY_CONCURRENCY_INITIAL", "20"))
+MPAY_CONCURRENCY_MIN = int(os.environ.get("MPAY_CONCURRENCY_MIN", "2"))
+MPAY_CONCURRENCY_MAX = int(os.environ.get("MPAY_CONCURRENCY_MAX", "200"))
+MPAY_LATENCY_TOLERANCE = float(os.environ.get("MPAY_LATENCY_TOLERANCE", "2.0"))
+
+# Admin API token (X-Admin-Token header); admin endpoints are disabled when empty
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+
+# Profiling
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILING_SECRET = os.environ.get("PROFILING_SECRET", "")
+PROFILING_SAMPLE_INTERVAL = float(os.environ.get("PROFILING_SAMPLE_INTERVAL", "0.01"))
+PROFILING_MAX_DURATION = float(os.environ.get("PROFILING_MAX_DURATION", "300"))
+
+# Distributed tracing with tail sampling: slow and failed traces are always kept
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", os.path.join(DATA_DIR, "traces.jsonl"))
+TRACE_EXPORT_MAX_BYTES = int(os.environ.get("TRACE_EXPORT_MAX_BYTES", str(64 * 1024 * 1024)))  # rotate above this size
+TRACE_EXPORT_BACKUPS = int(os.environ.get("TRACE_EXPORT_BACKUPS", "3"))  # rotated files kept
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_THRESHOLD = float(os.environ.get("TRACE_SLOW_THRESHOLD", "1.0"))
+
+# Outbox for pushing payment results to Raja Ferry
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "true").lower() == "true"
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", os.path.join(DATA_DIR, "outbox.db"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_LINGER = float(os.environ.get("OUTBOX_LINGER", "1.0"))  # seconds
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "12"))
+OUTBOX_RETENTION = int(os.environ.get("OUTBOX_RETENTION", "86400"))  # seconds delivered rows are kept
+
+# Fan-out of verified payment events to internal subscribers (utils/fanout.py)
+# Comma separated "<name>=<url>" entries, e.g. "ticketing=https://ticketing.internal/payment-events".
+# Each subscriber needs WEBHOOK_SUBSCRIBER_<NAME>_SECRET to sign its deliveries and can
+# limit its events with WEBHOOK_SUBSCRIBER_<NAME>_STATUSES, e.g. "SUCCESS|CANCELED".
+WEBHOOK_SUBSCRIBERS = os.environ.get("WEBHOOK_SUBSCRIBERS", "")
+FANOUT_DB_PATH = os.environ.get("FANOUT_DB_PATH", os.path.join(DATA_DIR, "fanout.db"))
+FANOUT_BATCH_SIZE = int(os.environ.get("FANOUT_BATCH_SIZE", "50"))
+FANOUT_LINGER = float(os.environ.get("FANOUT_LINGER", "0.5"))  # seconds
+FANOUT_MAX_ATTEMPTS = int(os.environ.get("FANOUT_MAX_ATTEMPTS", "12"))
+FANOUT_TIMEOUT = float(os.environ.get("FANOUT_TIMEOUT", "10"))  # seconds per delivery
+FANOUT_RETENTION = int(os.environ.get("FANOUT_RETENTION", "86400"))  # seconds delivered events are kept
+
+# Append-only payment event log
+EVENT_LOG_ENABLED = os.environ.get("EVENT_LOG_ENABLED", "true").lower() == "true"
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR", os.path.join(DATA_DIR, "events"))
+EVENT_LOG_SEGMENT_SIZE = int(os.environ.get("EVENT_LOG_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+EVENT_LOG_FSYNC_BATCH = int(os.environ.get("EVENT_LOG_FSYNC_BATCH", "256"))
+EVENT_LOG_FSYNC_INTERVAL = float(os.environ.get("EVENT_LOG_FSYNC_INTERVAL", "0.05"))  # seconds
+
+# Expiry of pending QR and internet banking orders (seconds)
+ORDER_EXPIRY_ENABLED = os.environ.get("ORDER_EXPIRY_ENABLED", "true").lower() == "true"
+QR_ORDER_TTL = int(os.environ.get("QR_ORDER_TTL", "900"))
+BANKING_ORDER_TTL = int(os.environ.get("BANKING_ORDER_TTL", "1800"))
+EXPIRY_TICK = float(os.environ.get("EXPIRY_TICK", "1.0"))
+EXPIRY_SNAPSHOT_DIR = os.environ.get("EXPIRY_SNAPSHOT_DIR", os.path.join(DATA_DIR, "expiry"))
+
+# Revenue rollups per payment method, merchant and route
+REVENUE_ENABLED = os.environ.get("REVENUE_ENABLED", "true").lower() == "true"
+REVENUE_DB_PATH = os.environ.get("REVENUE_DB_PATH", os.path.join(DATA_DIR, "revenue.db"))
+REVENUE_UTC_OFFSET = int(os.environ.get("REVENUE_UTC_OFFSET", str(7 * 3600)))  # seconds, day buckets follow Thai time
+
+# Velocity checks screening payment attempts before signing
+# Rules are "<rule>:<attempts>/<seconds>" for rules email, phone, ip, small_amount and order
+VELOCITY_ENABLED = os.environ.get("VELOCITY_ENABLED", "true").lower() == "true"
+VELOCITY_RULES = os.environ.get("VELOCITY_RULES", "email:5/600,phone:5/600,ip:10/300,small_amount:20/600,order:10/600")
+# Keys are held per rule in every worker process, about 250 bytes each: the
+# default caps the counters at roughly 25 MB per worker with all five rules on
+VELOCITY_MAX_KEYS = int(os.environ.get("VELOCITY_MAX_KEYS", "20000"))
+VELOCITY_SMALL_AMOUNT = float(os.environ.get("VELOCITY_SMALL_AMOUNT", "50"))  # THB
+
+# Pricing: service fee (rate of the fare plus a fixed THB amount per passenger) and VAT
+PRICING_SERVICE_FEE_RATE = os.environ.get("PRICING_SERVICE_FEE_RATE", "0.10")
+PRICING_SERVICE_FEE_FIXED = os.environ.get("PRICING_SERVICE_FEE_FIXED", "0.00")
+PRICING_VAT_RATE = os.environ.get("PRICING_VAT_RATE", "0.07")
+
+# Local transaction index for support searches
+TRANSACTIONS_ENABLED = os.environ.get("TRANSACTIONS_ENABLED", "true").lower() == "true"
+TRANSACTIONS_DB_PATH = os.environ.get("TRANSACTIONS_DB_PATH", os.path.join(DATA_DIR, "transactions.db"))
+
+# Graceful shutdown: seconds to wait for in-flight mPAY calls and flush queues
+# (keep below the server's graceful timeout, 30s for gunicorn)
+LIFECYCLE_DRAIN_TIMEOUT = float(os.environ.get("LIFECYCLE_DRAIN_TIMEOUT", "25"))
+
+# Production server (main.py)
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "0"))  # workers, 0 = 2 x CPUs + 1
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "4"))
+
+# Worker warm-up before reporting ready
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "5"))  # seconds
+WARMUP_CONNECTIONS = int(os.environ.get("WARMUP_CONNECTIONS", "2"))  # per upstream
+
+# Application factory (app.create_app)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# API blueprints to register; workers serving a subset only import those resources
+APP_BLUEPRINTS = [
+    name.strip() for name in os.environ.get("APP_BLUEPRINTS", "payments,webhook,admin").split(",")
+    if name.strip()
+]
+
+# Speculative prefetch of QR codes and installment plans by the payment page
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_DB_PATH = os.environ.get("PREFETCH_DB_PATH", os.path.join(DATA_DIR, "prefetch.db"))
+PREFETCH_WAIT = float(os.environ.get("PREFETCH_WAIT", "10"))  # seconds to wait for a concurrent creation
+INSTALLMENT_PLANS_MAX_AGE = int(os.environ.get("INSTALLMENT_PLANS_MAX_AGE", "300"))  # browser cache, seconds
+CARD_SEAMLESS_TTL = int(os.environ.get("CARD_SEAMLESS_TTL", "900"))  # seconds a seamless card registration is reused
+# Origins the payment page preconnects to, comma-separated; defaults to the mPAY ONE origin
+PRECONNECT_ORIGINS = [
+    origin.strip() for origin in os.environ.get("PRECONNECT_ORIGINS", "").split(",")
+    if origin.strip()
+]
+
+# Capture of sanitized payment traffic for replay benchmarks (benchmarks/bench_replay.py)
+TRAFFIC_CAPTURE_ENABLED = os.environ.get("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true"
+TRAFFIC_CAPTURE_DIR = os.environ.get("TRAFFIC_CAPTURE_DIR", os.path.join(DATA_DIR, "traffic"))
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+TRAFFIC_CAPTURE_BATCH = int(os.environ.get("TRAFFIC_CAPTURE_BATCH", "256"))  # records per compressed write
+TRAFFIC_CAPTURE_MAX_BODY = int(os.environ.get("TRAFFIC_CAPTURE_MAX_BODY", str(1024 * 1024)))  # bytes, larger requests are not recorded
+
+# Answer mPAY ONE and Raja Ferry calls locally instead of over the network (benchmarks only)
+UPSTREAM_MOCK_ENABLED = os.environ.get("UPSTREAM_MOCK_ENABLED", "false").lower() == "true"
+UPSTREAM_MOCK_LATENCY = float(os.environ.get("UPSTREAM_MOCK_LATENCY", "0.05"))  # seconds per call
+
+# Memory instrumentation and worker recycling (utils/memory.py)
+MEMORY_TRACK_REQUESTS = os.environ.get("MEMORY_TRACK_REQUESTS", "false").lower() == "true"  # always on in debug mode
+MEMORY_TRACE_FRAMES = int(os.environ.get("MEMORY_TRACE_FRAMES", "1"))  # frames stored per traced allocation
+MEMORY_MAX_RSS_MB = int(os.environ.get("MEMORY_MAX_RSS_MB", "0"))  # recycle a worker above this RSS, 0 disables
+MEMORY_CHECK_INTERVAL = int(os.environ.get("MEMORY_CHECK_INTERVAL", "100"))  # requests between RSS checks
+MEMORY_RECYCLE_JITTER = float(os.environ.get("MEMORY_RECYCLE_JITTER", "0.1"))  # random extra threshold per worker
+
+# Webhook replay protection (seconds)
+WEBHOOK_REPLAY_WINDOW = int(os.environ.get("WEBHOOK_REPLAY_WINDOW", "21600"))
+WEBHOOK_MAX_CLOCK_SKEW = int(os.environ.get("WEBHOOK_MAX_CLOCK_SKEW", "300"))
+WEBHOOK_REPLAY_DB_PATH = os.environ.get("WEBHOOK_REPLAY_DB_PATH", os.path.join(DATA_DIR, "webhook_replay.db"))
+
 
 # API Endpoints
 CREDIT_CARD_PAYMENT_ENDPOINT = " /service-txn-gateway/v1/cc/txns/payment_order"
@@ -55,5 +215,8 @@ ERROR_CODES = {
     "INVALID_REQUEST": "INVALID_REQUEST",
     "PAYMENT_FAILED": "PAYMENT_FAILED",
     "RESOURCE_NOT_FOUND": "RESOURCE_NOT_FOUND",
-    "SYSTEM_ERROR": "SYSTEM_ERROR"
+    "SYSTEM_ERROR": "SYSTEM_ERROR",
+    "RATE_LIMITED": "RATE_LIMITED",
+    "VELOCITY_LIMIT": "VELOCITY_LIMIT",
+    "DUPLICATE_ORDER": "DUPLICATE_ORDER"
 }
@@ -1 +1,87 @@
+"""
+Production server entrypoint
 
+Runs the app under gunicorn with the app preloaded in the master, so
+workers fork with modules imported and templates compiled. Each worker
+then primes its signing state and opens pooled connections to mPAY ONE
+and Raja Ferry before it reports ready on /readyz, and drains in-flight
+calls and background queues when it is asked to stop.
+
+Usage:
+    python main.py
+    python main.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+"""
+
+import argparse
+import multiprocessing
+import time
+from gunicorn.app.base import BaseApplication
+from utils.lifecycle import lifecycle
+from config import WEB_CONCURRENCY, WEB_THREADS, LIFECYCLE_DRAIN_TIMEOUT, WARMUP_ENABLED
+
+
+def post_fork(server, worker):
+    """Restart the uptime clock, which was inherited from the master"""
+    lifecycle.started_at = time.time()
+
+
+def post_worker_init(worker):
+    """Warm up the worker and hook draining into gunicorn's SIGTERM handling"""
+    from app import start_worker
+    # After gunicorn's own handlers, which ours hand the signal on to
+    lifecycle.install_signal_handlers()
+    start_worker()
+
+
+def worker_exit(server, worker):
+    """Flush anything queued after the drain, e.g. webhooks accepted meanwhile"""
+    lifecycle.drain(timeout=2)
+
+
+class PaymentServer(BaseApplication):
+    """Gunicorn application preloading the Flask app"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Workers prepare themselves in post_worker_init
+        lifecycle.managed = True
+        from app import get_app
+        app = get_app()
+        if WARMUP_ENABLED:
+            from utils.warmup import warm_up_app
+            warm_up_app(app)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the payment gateway under gunicorn")
+    parser.add_argument('--bind', '-b', default='0.0.0.0:5000')
+    parser.add_argument('--workers', '-w', type=int, default=WEB_CONCURRENCY or multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--threads', type=int, default=WEB_THREADS)
+    parser.add_argument('--timeout', type=int, default=60, help="Seconds before a silent worker is killed")
+    args = parser.parse_args(argv)
+
+    PaymentServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        # Leave room for the drain deadline before gunicorn kills the worker
+        'graceful_timeout': int(LIFECYCLE_DRAIN_TIMEOUT) + 5,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,268 @@
+"""
+Domain objects for payment orders, gateway responses and webhook events
+
+Requests used to travel as loose dicts that every resource validated, copied
+and looked keys up in again. These classes parse a payload once into
+__slots__ attributes: no per-instance __dict__, so they are small to queue
+and cache, and the fields mPAY ONE defines are plain attribute reads.
+Fields the gateway adds that are not listed here are kept in ``extra`` so
+nothing is lost, and ``to_dict()`` gives back exactly the payload that was
+parsed, which is what gets signed.
+
+Fields absent from a payload read as None. An explicit null in the payload
+is kept in ``extra`` instead, so it still takes part in the signature.
+"""
+
+from utils import json_codec
+from utils.pricing import normalize_amount
+from utils.signature import sign_canonical, verify_canonical
+
+# Fields a payment request must carry
+PAYMENT_REQUIRED_FIELDS = ('merchant_id', 'order_id', 'amount', 'currency')
+
+# Fields a webhook must carry to be processed
+WEBHOOK_REQUIRED_FIELDS = ('status', 'payment_method', 'order_id')
+
+
+class ValidationError(ValueError):
+    """Raised when a payload is missing a required field or has an invalid value"""
+
+
+class _Model:
+    """Base class: subclasses list their attributes in FIELDS and __slots__"""
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, extra=None, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(f"Unknown fields for {type(self).__name__}: {', '.join(fields)}")
+        # No empty dict per instance when the payload has nothing extra
+        self.extra = extra or None
+
+    @classmethod
+    def _parse(cls, payload):
+        """Create an instance from a dict without validating it"""
+        obj = cls.__new__(cls)
+        get = payload.get
+        for field in cls.FIELDS:
+            setattr(obj, field, get(field))
+        fields = cls._FIELD_SET
+        obj.extra = {key: value for key, value in payload.items() if value is None or key not in fields} or None
+        return obj
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def get(self, key, default=None):
+        """Read a field or extra value by name, like dict.get()"""
+        if key in self._FIELD_SET:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def to_dict(self):
+        """Return the payload as a dict, without the fields that are absent"""
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __reduce__(self):
+        # Slot values in order, without the field names a pickled dict would carry
+        return _restore, (type(self), tuple(getattr(self, slot) for slot in self.__slots__))
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _restore(cls, values):
+    obj = cls.__new__(cls)
+    for slot, value in zip(cls.__slots__, values):
+        setattr(obj, slot, value)
+    return obj
+
+
+class PaymentOrder(_Model):
+    """A payment order sent to mPAY ONE
+
+    ``signature`` is kept apart from the signed fields: ``canonical_bytes()``
+    leaves it out and ``to_dict()`` adds it once set.
+    """
+
+    FIELDS = (
+        'merchant_id', 'order_id', 'transaction_id', 'amount', 'currency', 'description',
+        'customer_name', 'customer_email', 'customer_phone', 'language',
+        'redirect_url', 'cancel_url', 'backend_url', 'bank_code', 'payment_ref', 'card_token',
+    )
+    __slots__ = FIELDS + ('extra', 'signature')
+
+    def __init__(self, extra=None, signature=None, **fields):
+        super().__init__(extra, **fields)
+        self.signature = signature
+
+    @classmethod
+    def from_payload(cls, payload, required=PAYMENT_REQUIRED_FIELDS):
+        """
+        Parse and validate a payment request
+
+        The amount is rounded to satang so the signed value is the one mPAY sees.
+
+        Args:
+            payload (dict): Request payload
+            required (tuple, optional): Fields that must be present
+
+        Returns:
+            PaymentOrder: Parsed order
+
+        Raises:
+            ValidationError: If a required field is missing or the amount is invalid
+        """
+        if not isinstance(payload, dict):
+            raise ValidationError("Invalid request payload")
+        for field in required:
+            if field not in payload:
+                raise ValidationError(f"Missing required field: {field}")
+
+        signature = payload.get('signature')
+        if 'signature' in payload:
+            payload = {key: value for key, value in payload.items() if key != 'signature'}
+        order = cls._parse(payload)
+        order.signature = signature
+        if order.amount is not None:
+            try:
+                order.amount = normalize_amount(order.amount)
+            except ValueError:
+                raise ValidationError("Invalid amount")
+        return order
+
+    def canonical_bytes(self):
+        """Return the canonical JSON the signature is computed over"""
+        return json_codec.canonical_dumps(_Model.to_dict(self))
+
+    def sign(self):
+        """Sign the order with the API secret; returns the signature"""
+        self.signature = sign_canonical(self.canonical_bytes())
+        return self.signature
+
+    def to_dict(self):
+        data = _Model.to_dict(self)
+        if self.signature is not None:
+            data['signature'] = self.signature
+        return data
+
+
+class GatewayResponse(_Model):
+    """A response from mPAY ONE, or the simulated one returned in its place"""
+
+    FIELDS = (
+        'status', 'message', 'order_id', 'transaction_id', 'payment_id', 'amount', 'currency',
+        'redirect_url', 'authorize_url', 'payment_url', 'qr_code', 'qr_image', 'error',
+    )
+    __slots__ = FIELDS + ('extra',)
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Parse a gateway response body
+
+        Args:
+            payload (dict): Decoded JSON body
+
+        Returns:
+            GatewayResponse: Parsed response
+
+        Raises:
+            ValidationError: If the body is not a JSON object
+        """
+        if not isinstance(payload, dict):
+            raise ValidationError("Gateway response is not a JSON object")
+        return cls._parse(payload)
+
+    @classmethod
+    def from_http(cls, response):
+        """Parse a requests.Response from the gateway"""
+        try:
+            payload = json_codec.loads(response.content)
+        except ValueError:
+            raise ValidationError(f"Gateway response is not JSON (HTTP {response.status_code})")
+        return cls.from_payload(payload)
+
+    @property
+    def ok(self):
+        return self.status == 'SUCCESS'
+
+
+class WebhookEvent(_Model):
+    """A payment notification from mPAY ONE
+
+    The signature is split off when parsing; ``to_dict()`` is the payload
+    without it, as the signature is verified over and the handlers expect.
+    """
+
+    FIELDS = (
+        'merchant_id', 'order_id', 'transaction_id', 'payment_id', 'amount', 'currency', 'status',
+        'payment_method', 'payment_channel', 'paid_agent', 'paid_channel', 'transaction_time',
+    )
+    __slots__ = FIELDS + ('extra', 'signature')
+
+    def __init__(self, extra=None, signature=None, **fields):
+        super().__init__(extra, **fields)
+        self.signature = signature
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Parse a webhook body
+
+        Required fields are not checked here, only after the signature and
+        replay checks; see missing_fields().
+
+        Args:
+            payload (dict): Decoded JSON body, including its signature
+
+        Returns:
+            WebhookEvent: Parsed event
+
+        Raises:
+            ValidationError: If the body is empty or not a JSON object
+        """
+        if not payload or not isinstance(payload, dict):
+            raise ValidationError("No data received")
+        signature = payload.get('signature')
+        if 'signature' in payload:
+            payload = {key: value for key, value in payload.items() if key != 'signature'}
+        event = cls._parse(payload)
+        event.signature = signature
+        return event
+
+    def missing_fields(self):
+        """Return the required fields absent from the event"""
+        return [field for field in WEBHOOK_REQUIRED_FIELDS if not getattr(self, field)]
+
+    def canonical_bytes(self):
+        """Return the canonical JSON the signature is computed over"""
+        return json_codec.canonical_dumps(self.to_dict())
+
+    def verify(self):
+        """Check the signature against the API secret"""
+        return isinstance(self.signature, str) and verify_canonical(self.canonical_bytes(), self.signature)
+
 
 #   from flask_sqlalchemy import SQLAlchemy
 
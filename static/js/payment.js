@@ -6,8 +6,19 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize payment form
     initPaymentForm();
+    
+    // Initialize background prefetch of QR codes and installment plans
+    initPrefetch();
 });
 
+// Artifacts prefetched when a payment method is selected
+const prefetchState = {
+    enabled: false,
+    qr: null,       // { fingerprint, controller, settled, submitted }
+    card: null,     // { fingerprint, promise }
+    plans: null     // { fingerprint, promise }
+};
+
 /**
  * Initialize payment method selector
  * Shows only the selected payment method form while hiding others
@@ -53,6 +64,9 @@ function initPaymentMethodSelector() {
                     selectedForm.style.opacity = '1';
                 }, 10);
             }
+            
+            // Start fetching what this method needs before the customer confirms
+            prefetchForPaymentMethod(this.value);
         });
     });
 }
@@ -80,17 +94,15 @@ function initPaymentForm() {
                 // Build form data based on payment method
                 const formData = buildFormData(paymentMethod);
                 
-                // Call appropriate API endpoint
-                const endpoint = getEndpointForPaymentMethod(paymentMethod);
-                const response = await fetch(endpoint, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
-                    body: JSON.stringify(formData)
-                });
+                // The server reuses a prefetched QR code for the same order and amount
+                if (paymentMethod === 'qr_payment' && prefetchState.qr) {
+                    prefetchState.qr.submitted = true;
+                }
                 
-                const result = await response.json();
+                // Cards are charged in the page; other methods call their API endpoint
+                const { response, result } = paymentMethod === 'credit_card'
+                    ? await payWithCard(formData)
+                    : await postJSON(getEndpointForPaymentMethod(paymentMethod), formData);
                 
                 if (response.ok) {
                     handleSuccessResponse(result, paymentMethod);
@@ -160,6 +172,7 @@ function buildFormData(paymentMethod) {
             
             if (installmentPlan && installmentPlan.value) formData.installment_plan = installmentPlan.value;
             if (installmentBank && installmentBank.value) formData.installment_bank = installmentBank.value;
+            formData.redirect_url = `${window.location.origin}/payment/success/${formData.order_id}`;
             break;
             
         case 'internet_banking':
@@ -172,6 +185,277 @@ function buildFormData(paymentMethod) {
     return formData;
 }
 
+/**
+ * Initialize background prefetch
+ * Prefetched QR codes the customer never confirmed are canceled when the page goes away
+ */
+function initPrefetch() {
+    const paymentForm = document.getElementById('payment-form');
+    prefetchState.enabled = Boolean(paymentForm && paymentForm.dataset.prefetch === 'true');
+    if (!prefetchState.enabled) return;
+    
+    window.addEventListener('pagehide', cancelQRPrefetch);
+    
+    const selected = document.querySelector('input[name="payment_method"]:checked');
+    if (selected) {
+        prefetchForPaymentMethod(selected.value);
+    }
+}
+
+/**
+ * Prefetch the artifacts of the selected payment method
+ */
+function prefetchForPaymentMethod(paymentMethod) {
+    if (!prefetchState.enabled) return;
+    
+    // Leaving QR only stops the download; the server keeps the QR code for a return visit
+    if (paymentMethod !== 'qr_payment' && prefetchState.qr && !prefetchState.qr.settled) {
+        prefetchState.qr.controller.abort();
+    }
+    
+    switch (paymentMethod) {
+        case 'credit_card':
+            prefetchCardRegistration();
+            break;
+        case 'qr_payment':
+            prefetchQRCode();
+            break;
+        case 'installment':
+            prefetchInstallmentPlans();
+            break;
+    }
+}
+
+/**
+ * Fingerprint of the payment details a prefetched artifact was created for
+ */
+function prefetchFingerprint(formData) {
+    return [formData.merchant_id, formData.order_id, formData.amount, formData.currency].join('|');
+}
+
+/**
+ * Create the QR code in the background; the final request reuses it
+ */
+function prefetchQRCode() {
+    const formData = buildFormData('qr_payment');
+    const fingerprint = prefetchFingerprint(formData);
+    const qr = prefetchState.qr;
+    if (qr && qr.fingerprint === fingerprint && !qr.controller.signal.aborted) return;
+    
+    const controller = new AbortController();
+    const entry = { fingerprint, controller, settled: false, submitted: false, token: null };
+    fetch('/api/qr/generate?prefetch=1', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(formData),
+        signal: controller.signal
+    }).then(response => response.json()).then(data => {
+        // Only returned to the page that created the QR code
+        entry.token = data.prefetch_token || null;
+        entry.settled = true;
+    }).catch(() => {
+        entry.settled = true;
+    });
+    
+    prefetchState.qr = entry;
+}
+
+/**
+ * Cancel a prefetched QR code the customer did not confirm
+ */
+function cancelQRPrefetch() {
+    const qr = prefetchState.qr;
+    if (!qr || qr.submitted) return;
+    
+    if (!qr.settled) qr.controller.abort();
+    prefetchState.qr = null;
+    // Without a token (still being created, or reused) the QR code simply expires
+    if (!qr.token) return;
+    
+    // keepalive lets the request outlive the page
+    fetch('/api/qr/generate', {
+        method: 'DELETE',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ order_id: document.getElementById('order_id').value, prefetch_token: qr.token }),
+        keepalive: true
+    }).catch(() => {});
+}
+
+/**
+ * Register the seamless card payment in the background; the final registration reuses it
+ */
+function prefetchCardRegistration() {
+    const formData = buildFormData('credit_card');
+    const fingerprint = prefetchFingerprint(formData);
+    if (prefetchState.card && prefetchState.card.fingerprint === fingerprint) return;
+    
+    const promise = postJSON('/api/credit-card/seamless/register?prefetch=1', formData)
+        .then(({ response }) => {
+            // Let the next selection try again
+            if (!response.ok) prefetchState.card = null;
+        })
+        .catch(() => {
+            prefetchState.card = null;
+        });
+    prefetchState.card = { fingerprint, promise };
+}
+
+/**
+ * Fetch the installment plans for the order amount and fill in the plan choices
+ */
+function prefetchInstallmentPlans() {
+    const formData = buildFormData('installment');
+    const fingerprint = prefetchFingerprint(formData);
+    if (prefetchState.plans && prefetchState.plans.fingerprint === fingerprint) return;
+    
+    const params = new URLSearchParams({
+        merchant_id: formData.merchant_id,
+        amount: formData.amount,
+        currency: formData.currency
+    });
+    const promise = fetch(`/api/installment/plans?${params}`)
+        .then(response => response.ok ? response.json() : null)
+        .catch(() => null);
+    prefetchState.plans = { fingerprint, promise };
+    
+    promise.then(result => {
+        if (result && result.plans) {
+            renderInstallmentPlans(result.plans, formData.currency);
+        } else {
+            // Let the next selection try again
+            prefetchState.plans = null;
+        }
+    });
+}
+
+/**
+ * Render card issuers and their plans
+ */
+function renderInstallmentPlans(plans, currency) {
+    const banksContainer = document.getElementById('installment-banks');
+    const planSelect = document.getElementById('installment_plan');
+    if (!banksContainer || !planSelect) return;
+    
+    banksContainer.innerHTML = plans.map(plan => `
+        <div class="custom-control custom-radio custom-control-inline">
+            <input type="radio" class="custom-control-input" id="installment_bank_${plan.bank}" name="installment_bank" value="${plan.bank}">
+            <label class="custom-control-label" for="installment_bank_${plan.bank}">${plan.bank_name}</label>
+        </div>
+    `).join('');
+    
+    banksContainer.querySelectorAll('input[name="installment_bank"]').forEach(radio => {
+        radio.addEventListener('change', function() {
+            const plan = plans.find(p => p.bank === this.value);
+            planSelect.innerHTML = plan.terms.map(term => `
+                <option value="${term.months}">${term.months} months x ${formatCurrency(term.monthly_amount, currency)} (${term.interest_rate}% interest)</option>
+            `).join('');
+            planSelect.disabled = false;
+        });
+    });
+}
+
+/**
+ * POST JSON to an endpoint and parse the JSON reply
+ */
+async function postJSON(endpoint, data) {
+    const response = await fetch(endpoint, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(data)
+    });
+    const result = await response.json();
+    return { response, result };
+}
+
+/**
+ * Seamless card payment: register, tokenize the card with mPAY, confirm server to server
+ * Card data only ever goes to mPAY; this server sees the token.
+ */
+async function payWithCard(formData) {
+    const card = readCardFields();
+    if (!card) {
+        return { response: { ok: false }, result: { error: 'INVALID_REQUEST', message: 'Please check the card details' } };
+    }
+    
+    // Reuses the registration prefetched when the card tab was selected
+    if (prefetchState.card) await prefetchState.card.promise;
+    const registration = await postJSON('/api/credit-card/seamless/register', formData);
+    if (!registration.response.ok) return registration;
+    
+    let cardToken;
+    try {
+        cardToken = await tokenizeCard(registration.result, card);
+    } catch (error) {
+        return { response: { ok: false }, result: { error: 'PAYMENT_FAILED', message: error.message } };
+    }
+    
+    const confirmation = await postJSON('/api/credit-card/seamless/confirm', {
+        merchant_id: formData.merchant_id,
+        order_id: formData.order_id,
+        payment_ref: registration.result.payment_ref,
+        card_token: cardToken
+    });
+    if (confirmation.response.ok) clearCardFields();
+    return confirmation;
+}
+
+/**
+ * Read and check the card fields, or return null if they are incomplete
+ */
+function readCardFields() {
+    const value = id => (document.getElementById(id) || {}).value || '';
+    const card = {
+        number: value('card_number').replace(/\D/g, ''),
+        expiry_month: value('card_expiry_month').trim(),
+        expiry_year: value('card_expiry_year').trim(),
+        cvv: value('cvv').trim(),
+        holder_name: value('cardholder_name').trim()
+    };
+    if (card.number.length < 12 || card.number.length > 19) return null;
+    if (!/^\d{1,2}$/.test(card.expiry_month) || !/^\d{2,4}$/.test(card.expiry_year)) return null;
+    if (!/^\d{3,4}$/.test(card.cvv)) return null;
+    return card;
+}
+
+/**
+ * Clear the card fields once the card has been charged
+ */
+function clearCardFields() {
+    ['card_number', 'card_expiry_month', 'card_expiry_year', 'cvv'].forEach(id => {
+        const input = document.getElementById(id);
+        if (input) input.value = '';
+    });
+}
+
+/**
+ * Exchange the card for a single-use token at mPAY
+ */
+async function tokenizeCard(registration, card) {
+    if (!registration.tokenize_url) {
+        // Sandbox: mPAY is simulated, so issue a test token without sending the card anywhere
+        return `tok_sandbox_${registration.payment_ref}_${card.number.slice(-4)}`;
+    }
+    
+    const response = await fetch(registration.tokenize_url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ payment_ref: registration.payment_ref, ...card })
+    });
+    const result = await response.json().catch(() => ({}));
+    if (!response.ok || !result.card_token) {
+        throw new Error(result.message || 'The card could not be verified');
+    }
+    return result.card_token;
+}
+
 /**
  * Get API endpoint based on payment method
  */
@@ -199,6 +483,11 @@ function handleSuccessResponse(result, paymentMethod) {
     if (paymentMethod === 'qr_payment' && result.qr_image) {
         // Show QR code for QR payment
         showQRCode(result.qr_image);
+    } else if (result.authorize_url) {
+        // The card issuer asks for 3-D Secure: the only redirect of a seamless card payment
+        window.location.href = result.authorize_url;
+    } else if (paymentMethod === 'credit_card' && result.payment_ref) {
+        showSuccessMessage(`Payment completed. Order ID: ${result.order_id}`);
     } else if (result.redirect_url) {
         // For demo purposes, just show success message instead of redirecting
         showSuccessMessage(`Payment initiated successfully for ${paymentMethod}. Order ID: ${result.order_id}`);
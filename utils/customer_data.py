@@ -2,9 +2,11 @@ import logging
 import requests
 from requests.exceptions import RequestException
 from config import RAJA_FERRY_API_URL, RAJA_FERRY_API_KEY
+from utils.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+@tracer.traced('raja_ferry.get_customer_data')
 def get_customer_data(booking_id):
     """
     Fetch customer data from Raja Ferry Port API
@@ -16,6 +18,8 @@ def get_customer_data(booking_id):
         dict: Customer data including personal details and booking information
         None: If data retrieval fails
     """
+    tracer.current_span().set_attribute('booking_id', booking_id)
+    
     try:
         # For demo purposes, generate sample data when the API is not available
         # In production, this would be replaced with actual API calls
@@ -50,6 +54,7 @@ def get_customer_data(booking_id):
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+        tracer.inject(headers)
         
         # Make request to Raja Ferry API
         endpoint = f"{RAJA_FERRY_API_URL}/bookings/{booking_id}"
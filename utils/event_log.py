@@ -0,0 +1,580 @@
+"""
+Append-only payment event log
+
+Every request, response and webhook seen by the API is appended to a log
+made of segment files. Each process writes its own stream directory so
+gunicorn workers never interleave writes; readers merge all streams.
+
+Record layout (little endian):
+    payload length  uint32
+    CRC32           uint32  (over order_id + payload)
+    timestamp       float64 (seconds since the epoch)
+    kind            uint8   (see KIND_* constants)
+    order_id length uint8
+    order_id        bytes
+    payload         bytes   (JSON)
+
+Writes are buffered and fsynced in batches. A segment is sealed once it
+reaches the configured size, when its writer closes, or when a new writer
+finds its process gone: a sparse index (order_id -> offset of its first
+record in the segment) is written next to it, so looking up one order only
+scans the segments that contain it. Reads use mmap and decode
+the JSON payload only for records that are actually returned.
+"""
+
+import heapq
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<IIdBB')
+
+KIND_REQUEST = 1
+KIND_RESPONSE = 2
+KIND_WEBHOOK = 3
+
+KIND_NAMES = {
+    KIND_REQUEST: 'request',
+    KIND_RESPONSE: 'response',
+    KIND_WEBHOOK: 'webhook',
+}
+
+SEGMENT_SUFFIX = '.log'
+INDEX_SUFFIX = '.idx'
+
+
+class Event:
+    """A record read back from the log"""
+
+    __slots__ = ('timestamp', 'kind', 'order_id', 'raw', 'segment', 'offset', 'end')
+
+    def __init__(self, timestamp, kind, order_id, raw, segment, offset, end):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.order_id = order_id
+        self.raw = raw
+        self.segment = segment
+        self.offset = offset
+        self.end = end
+
+    @property
+    def kind_name(self):
+        return KIND_NAMES.get(self.kind, str(self.kind))
+
+    @property
+    def data(self):
+        return json_codec.loads(self.raw)
+
+
+def encode_record(kind, order_id, payload, timestamp=None):
+    """
+    Encode one record
+
+    Args:
+        kind (int): Record kind
+        order_id (str): Order the record belongs to, may be empty
+        payload (bytes): JSON payload
+        timestamp (float, optional): Record time, defaults to now
+
+    Returns:
+        bytes: Encoded record
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    order_bytes = (order_id or '').encode('utf-8')[:255]
+    crc = zlib.crc32(payload, zlib.crc32(order_bytes))
+    return HEADER.pack(len(payload), crc, timestamp, kind, len(order_bytes)) + order_bytes + payload
+
+
+def _intact_at(mm, offset, size):
+    """Return the end of the record at ``offset`` if it is complete and its CRC matches, else None"""
+    if offset + HEADER.size > size:
+        return None
+    length, crc, _, kind, order_len = HEADER.unpack_from(mm, offset)
+    body_start = offset + HEADER.size
+    end = body_start + order_len + length
+    if kind not in KIND_NAMES or end > size:
+        return None
+    if zlib.crc32(mm[body_start + order_len:end], zlib.crc32(mm[body_start:body_start + order_len])) != crc:
+        return None
+    return end
+
+
+def _framed_at(mm, offset, size):
+    """Cheap sync check: a segment end, or a header of a known kind whose record fits"""
+    if offset == size:
+        return True
+    if offset + HEADER.size > size:
+        return False
+    length, _, _, kind, order_len = HEADER.unpack_from(mm, offset)
+    return kind in KIND_NAMES and offset + HEADER.size + order_len + length <= size
+
+
+def _resync(mm, offset, end, size):
+    """Find the next intact record after a corrupt one at ``offset``, or None
+
+    The corrupt record's own length is tried first; when that is damaged
+    too, the following bytes are searched for a record boundary.
+    """
+    if end <= size and _intact_at(mm, end, size) is not None:
+        return end
+    for candidate in range(offset + 1, size - HEADER.size + 1):
+        if _intact_at(mm, candidate, size) is not None:
+            return candidate
+    return None
+
+
+def iter_segment(path, start=0, order_id=None):
+    """
+    Read records from a segment file with mmap
+
+    A corrupt record is skipped and reading resumes at the next intact
+    record; reading stops at a torn tail.
+
+    Args:
+        path (str): Segment file
+        start (int, optional): Byte offset to start at
+        order_id (str, optional): Only yield records of this order
+
+    Yields:
+        Event: Records in append order
+    """
+    size = os.path.getsize(path)
+    if size <= start:
+        return
+
+    wanted = order_id.encode('utf-8')[:255] if order_id is not None else None
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = start
+            while offset + HEADER.size <= size:
+                length, crc, timestamp, kind, order_len = HEADER.unpack_from(mm, offset)
+                body_start = offset + HEADER.size
+                end = body_start + order_len + length
+                order_bytes = mm[body_start:body_start + order_len]
+                # Other orders' records are skipped without a CRC check, but only
+                # when their length leads to another record: a damaged length
+                # would misalign every read after it
+                if wanted is not None and order_bytes != wanted and kind in KIND_NAMES \
+                        and end <= size and _framed_at(mm, end, size):
+                    offset = end
+                    continue
+                payload = mm[body_start + order_len:end]
+                if end > size or zlib.crc32(payload, zlib.crc32(order_bytes)) != crc:
+                    # A torn tail, or a damaged record with intact ones after it
+                    offset = _resync(mm, offset, end, size)
+                    if offset is None:
+                        break
+                    logger.error(f"Skipped corrupt record in {path}, resuming at offset {offset}")
+                    continue
+                if wanted is None or order_bytes == wanted:
+                    yield Event(timestamp, kind, order_bytes.decode('utf-8', 'replace'), payload, path, offset, end)
+                offset = end
+
+
+def _scan_valid_end(path):
+    """Return the byte offset just past the last intact record and the segment's index
+
+    Intact records after a corrupt one are kept; only a torn tail lies
+    beyond the returned offset.
+    """
+    index = {}
+    end = 0
+    for event in iter_segment(path):
+        index.setdefault(event.order_id, event.offset)
+        end = event.end
+    return end, index
+
+
+def _write_index(segment, index):
+    """Seal a segment by writing its sparse index next to it"""
+    index_path = segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+    # Per process temp name: two workers may seal the same dead stream at once
+    temp = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(json_codec.dumps_bytes(index))
+    os.replace(temp, index_path)
+
+
+def seal_stream(stream):
+    """
+    Seal the active segment of a stream whose writer is gone
+
+    A torn tail left by a crash is truncated first.
+
+    Args:
+        stream (str): Stream directory
+
+    Returns:
+        bool: True if a segment was sealed
+    """
+    segments = sorted(n for n in os.listdir(stream) if n.endswith(SEGMENT_SUFFIX))
+    if not segments:
+        return False
+    path = os.path.join(stream, segments[-1])
+    if os.path.exists(path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+        return False
+
+    end, index = _scan_valid_end(path)
+    if end != os.path.getsize(path):
+        logger.warning(f"Truncating torn tail of {path} at offset {end}")
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    _write_index(path, index)
+    return True
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def seal_dead_streams(root):
+    """
+    Seal the streams of this host's processes that are no longer running
+
+    Readers only use the index of sealed segments, so without this every
+    lookup would rescan the last segment of each dead worker in full.
+    Streams of other hosts are left alone, their processes cannot be checked.
+
+    Args:
+        root (str): Log root directory
+
+    Returns:
+        int: Number of streams sealed
+    """
+    host = socket.gethostname()
+    sealed = 0
+    for name in os.listdir(root):
+        stream_host, _, pid = name.rpartition('-')
+        if stream_host != host or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        stream = os.path.join(root, name)
+        if os.path.isdir(stream) and not _pid_alive(int(pid)) and seal_stream(stream):
+            sealed += 1
+    return sealed
+
+
+class EventLogWriter:
+    """Append records to one stream of segment files"""
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, fsync_batch=256, fsync_interval=0.05):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._index = {}
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._stop = threading.Event()
+        self._open_active_segment()
+
+        self._syncer = threading.Thread(target=self._sync_loop, name='event-log-sync', daemon=True)
+        self._syncer.start()
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{number:010d}{SEGMENT_SUFFIX}")
+
+    def _open_active_segment(self):
+        segments = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        if segments and not os.path.exists(os.path.join(self.directory, segments[-1][:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX)):
+            # Reopen the unsealed segment, dropping a torn tail from a crash
+            path = os.path.join(self.directory, segments[-1])
+            end, self._index = _scan_valid_end(path)
+            if end != os.path.getsize(path):
+                logger.warning(f"Truncating torn tail of {path} at offset {end}")
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            self._path = path
+            self._size = end
+        else:
+            number = int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1 if segments else 0
+            self._path = self._segment_path(number)
+            self._size = 0
+            self._index = {}
+        self._file = open(self._path, 'ab', buffering=1024 * 1024)
+
+    def _seal_segment(self):
+        self._sync_locked()
+        self._file.close()
+        _write_index(self._path, self._index)
+
+        number = int(os.path.basename(self._path)[:-len(SEGMENT_SUFFIX)]) + 1
+        self._path = self._segment_path(number)
+        self._size = 0
+        self._index = {}
+        self._file = open(self._path, 'ab', buffering=1024 * 1024)
+
+    def append(self, kind, order_id, payload, timestamp=None):
+        """
+        Append a record
+
+        Args:
+            kind (int): Record kind
+            order_id (str): Order the record belongs to, may be empty
+            payload (bytes | dict): JSON payload or object to encode
+            timestamp (float, optional): Record time, defaults to now
+        """
+        self.append_many([(kind, order_id, payload)], timestamp)
+
+    def append_many(self, records, timestamp=None):
+        """
+        Append several records under one lock acquisition
+
+        Args:
+            records (list): (kind, order_id, payload) tuples
+            timestamp (float, optional): Record time, defaults to now
+        """
+        encoded = []
+        for kind, order_id, payload in records:
+            if not isinstance(payload, (bytes, bytearray)):
+                payload = json_codec.dumps_bytes(payload)
+            encoded.append((order_id or '', encode_record(kind, order_id, payload, timestamp)))
+
+        with self._lock:
+            for order_id, record in encoded:
+                if self._size and self._size + len(record) > self.segment_size:
+                    self._seal_segment()
+                self._index.setdefault(order_id, self._size)
+                self._file.write(record)
+                self._size += len(record)
+            self._unsynced += len(encoded)
+            if self._unsynced >= self.fsync_batch:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced:
+                    self._sync_locked()
+
+    def flush(self):
+        """Write and fsync everything appended so far"""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        """Flush, close and seal the active segment"""
+        self._stop.set()
+        with self._lock:
+            self._sync_locked()
+            self._file.close()
+            # Nothing appends to this segment again, so index it for readers
+            _write_index(self._path, self._index)
+
+
+class EventLogReader:
+    """Read records from every stream under a log root"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def streams(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            os.path.join(self.root, name) for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+        )
+
+    @staticmethod
+    def segments(stream):
+        return sorted(
+            os.path.join(stream, name) for name in os.listdir(stream) if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def scan(self, kinds=None):
+        """
+        Iterate every record, stream by stream in append order
+
+        Args:
+            kinds (set, optional): Only yield these record kinds
+
+        Yields:
+            Event: Records
+        """
+        for stream in self.streams():
+            for segment in self.segments(stream):
+                for event in iter_segment(segment):
+                    if kinds is None or event.kind in kinds:
+                        yield event
+
+    def scan_merged(self, kinds=None):
+        """
+        Iterate every record across streams in timestamp order
+
+        Args:
+            kinds (set, optional): Only yield these record kinds
+
+        Yields:
+            Event: Records
+        """
+        def stream_events(stream):
+            for segment in self.segments(stream):
+                for event in iter_segment(segment):
+                    if kinds is None or event.kind in kinds:
+                        yield event
+
+        yield from heapq.merge(*(stream_events(s) for s in self.streams()), key=lambda e: e.timestamp)
+
+    def read_order(self, order_id):
+        """
+        Return every record of one order in timestamp order
+
+        Sealed segments are only read when their index lists the order,
+        starting at the order's first offset; unsealed segments are scanned.
+
+        Args:
+            order_id (str): Order id
+
+        Returns:
+            list: Events
+        """
+        events = []
+        for stream in self.streams():
+            for segment in self.segments(stream):
+                index_path = segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+                start = 0
+                if os.path.exists(index_path):
+                    with open(index_path, 'rb') as f:
+                        index = json_codec.loads(f.read())
+                    if order_id not in index:
+                        continue
+                    start = index[order_id]
+                events.extend(iter_segment(segment, start=start, order_id=order_id))
+        events.sort(key=lambda e: e.timestamp)
+        return events
+
+
+# Payment creation endpoints whose successful response opens an order
+ORDER_CREATION_PATHS = {
+    '/api/credit-card/payment', '/api/credit-card/seamless/register', '/api/qr/generate',
+    '/api/rabbit-line-pay/payment', '/api/installment/payment', '/api/banking/payment',
+}
+
+
+def apply_event(orders, event):
+    """
+    Fold one event into a dict of order states
+
+    Args:
+        orders (dict): order_id -> state dict, updated in place
+        event (Event): Event to apply
+    """
+    if not event.order_id:
+        return
+    data = event.data
+    body = data.get('body') or {}
+
+    if event.kind == KIND_WEBHOOK:
+        # Rejected webhooks (bad signature, replays) are logged but never applied
+        if not data.get('accepted'):
+            return
+        state = orders.setdefault(event.order_id, {'order_id': event.order_id})
+        state['status'] = body.get('status', state.get('status'))
+        for field in ('payment_id', 'payment_method', 'amount', 'currency'):
+            if field in body:
+                state[field] = body[field]
+        state['updated_at'] = event.timestamp
+
+    elif event.kind == KIND_RESPONSE and data.get('status_code') == 200:
+        path = data.get('path')
+        if path in ORDER_CREATION_PATHS and not data.get('prefetch'):
+            state = orders.setdefault(event.order_id, {'order_id': event.order_id})
+            state.setdefault('status', 'CREATED')
+            for field in ('amount', 'currency'):
+                if field in body:
+                    state.setdefault(field, body[field])
+            state['updated_at'] = event.timestamp
+        elif path == '/api/payment/void-refund':
+            state = orders.setdefault(event.order_id, {'order_id': event.order_id})
+            state['status'] = 'VOIDED' if body.get('refund_type') == 'VOID' else 'REFUNDED'
+            state['updated_at'] = event.timestamp
+
+
+def rebuild_order_status(reader, order_id=None):
+    """
+    Rebuild order state by replaying the log
+
+    Args:
+        reader (EventLogReader): Log to replay
+        order_id (str, optional): Only rebuild this order, using the index
+
+    Returns:
+        dict: order_id -> state dict with status, amount, updated_at, ...
+    """
+    orders = {}
+    events = reader.read_order(order_id) if order_id is not None else reader.scan_merged({KIND_RESPONSE, KIND_WEBHOOK})
+    for event in events:
+        apply_event(orders, event)
+    return orders
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_event_log(root, **options):
+    """
+    Get this process's writer, creating its stream directory on first use
+
+    Args:
+        root (str): Log root directory
+        **options: EventLogWriter options
+
+    Returns:
+        EventLogWriter: Writer for this process
+    """
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                stream = f"{socket.gethostname()}-{os.getpid()}"
+                _writer = EventLogWriter(os.path.join(root, stream), **options)
+                _writer_pid = os.getpid()
+                try:
+                    seal_dead_streams(root)
+                except OSError:
+                    logger.exception("Failed to seal event log streams of exited processes")
+    return _writer
+
+
+def close_event_log(timeout=None):
+    """
+    Flush and close this process's writer, if it was opened
+
+    Args:
+        timeout (float, optional): Unused; accepted for drain callbacks
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is not None and _writer_pid == os.getpid():
+            _writer.close()
+            _writer = None
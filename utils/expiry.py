@@ -0,0 +1,375 @@
+"""
+Expiry of pending QR and internet banking orders
+
+Orders created by GenerateQR and InternetBankingPayment stay PENDING when
+the customer walks away, holding ferry seats. Every pending order is
+tracked in a hierarchical timing wheel from creation; a terminal webhook
+cancels its timer, and timers that fire are handed to the expiry handler
+in batches.
+
+Scheduling and cancelling are O(1) dict operations, and each timer costs
+one entry in the slot dict plus one in the key index, so a single process
+can hold hundreds of thousands of timers.
+"""
+
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from utils import json_codec
+from utils.outbox import update_order_status, get_dispatcher
+from config import (
+    ORDER_EXPIRY_ENABLED, EXPIRY_TICK, EXPIRY_SNAPSHOT_DIR, OUTBOX_ENABLED
+)
+
+logger = logging.getLogger(__name__)
+
+# Webhook statuses after which an order no longer needs to expire
+TERMINAL_STATUSES = {'SUCCESS', 'FAILED', 'CANCELED', 'AUTHORIZED'}
+
+
+class TimingWheel:
+    """Hierarchical timing wheel keyed by order id
+
+    Level 0 has ``slots`` buckets of one tick each; every higher level
+    covers ``slots`` times the span of the level below. Timers are placed
+    on the lowest level whose span covers their delay and cascade down as
+    the wheel turns. Not thread-safe; ExpiryScheduler adds the locking.
+    """
+
+    def __init__(self, tick=1.0, slots=256, levels=4, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots ** level for level in range(levels)]
+        self._wheels = [[None] * slots for _ in range(levels)]
+        self._timers = {}
+        self._current = int((time.time() if now is None else now) / tick)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def _place(self, key, due):
+        delta = due - self._current
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        slot = (due // self._spans[level]) % self.slots
+        bucket = self._wheels[level][slot]
+        if bucket is None:
+            bucket = self._wheels[level][slot] = {}
+        bucket[key] = due
+        # Location packed into one int, cheaper than a (level, slot) tuple
+        self._timers[key] = level * self.slots + slot
+
+    def schedule(self, key, deadline):
+        """
+        Schedule (or reschedule) a timer
+
+        Args:
+            key (str): Timer key, e.g. an order id
+            deadline (float): Expiry time in seconds since the epoch
+        """
+        self.cancel(key)
+        due = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._place(key, due)
+
+    def cancel(self, key):
+        """
+        Cancel a timer
+
+        Args:
+            key (str): Timer key
+
+        Returns:
+            bool: True if a timer was cancelled
+        """
+        location = self._timers.pop(key, None)
+        if location is None:
+            return False
+        level, slot = divmod(location, self.slots)
+        bucket = self._wheels[level][slot]
+        del bucket[key]
+        if not bucket:
+            self._wheels[level][slot] = None
+        return True
+
+    def timers(self):
+        """
+        List every pending timer
+
+        Returns:
+            list: (key, deadline in seconds since the epoch) tuples
+        """
+        timers = []
+        for key, location in self._timers.items():
+            level, slot = divmod(location, self.slots)
+            timers.append((key, self._wheels[level][slot][key] * self.tick))
+        return timers
+
+    def advance(self, now):
+        """
+        Turn the wheel up to ``now`` and collect expired timers
+
+        Args:
+            now (float): Current time in seconds since the epoch
+
+        Returns:
+            list: Keys of expired timers
+        """
+        target = int(now / self.tick)
+        expired = []
+        while self._current < target:
+            self._current += 1
+            current = self._current
+
+            # Cascade higher levels whose bucket starts at this tick
+            for level in range(1, self.levels):
+                span = self._spans[level]
+                if current % span:
+                    break
+                slot = (current // span) % self.slots
+                bucket = self._wheels[level][slot]
+                if bucket:
+                    self._wheels[level][slot] = None
+                    for key, due in bucket.items():
+                        self._place(key, due)
+
+            slot = current % self.slots
+            bucket = self._wheels[0][slot]
+            if bucket:
+                self._wheels[0][slot] = None
+                for key in bucket:
+                    del self._timers[key]
+                expired.extend(bucket)
+        return expired
+
+
+class ExpiryScheduler:
+    """Thread-safe timing wheel with a background thread firing batches"""
+
+    def __init__(self, handler, tick=1.0, batch_size=500):
+        self.handler = handler
+        self.tick = tick
+        self.batch_size = batch_size
+        self._wheel = TimingWheel(tick=tick)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.counters = {'scheduled': 0, 'cancelled': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def start(self):
+        """Start the firing thread if it is not running in this process"""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name='order-expiry', daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        """Stop the firing thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, key, ttl):
+        """
+        Expire ``key`` after ``ttl`` seconds unless cancelled
+
+        Args:
+            key (str): Order id
+            ttl (float): Seconds until expiry
+        """
+        with self._lock:
+            self._wheel.schedule(key, time.time() + ttl)
+            self.counters['scheduled'] += 1
+        self.start()
+
+    def cancel(self, key):
+        """
+        Cancel the expiry of ``key``
+
+        Returns:
+            bool: True if a timer was cancelled
+        """
+        with self._lock:
+            cancelled = self._wheel.cancel(key)
+            if cancelled:
+                self.counters['cancelled'] += 1
+        return cancelled
+
+    def fire_due(self, now=None):
+        """
+        Advance the wheel and pass expired keys to the handler in batches
+
+        Args:
+            now (float, optional): Current time
+
+        Returns:
+            int: Number of expired keys
+        """
+        with self._lock:
+            expired = self._wheel.advance(time.time() if now is None else now)
+            self.counters['expired'] += len(expired)
+
+        for start in range(0, len(expired), self.batch_size):
+            batch = expired[start:start + self.batch_size]
+            try:
+                self.handler(batch)
+            except Exception:
+                logger.exception(f"Order expiry handler failed for {len(batch)} orders")
+        return len(expired)
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.fire_due()
+
+    def save(self, path):
+        """
+        Write pending timers to a JSON file so another worker can resume them
+
+        Args:
+            path (str): Snapshot file
+
+        Returns:
+            int: Number of timers written
+        """
+        with self._lock:
+            timers = dict(self._wheel.timers())
+        if not timers:
+            return 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json_codec.dumps_bytes(timers))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(timers)
+
+    def restore(self, directory):
+        """
+        Take over timers saved by workers that have exited
+
+        Each snapshot is claimed with an atomic rename, so only one worker
+        restores it.
+
+        Args:
+            directory (str): Snapshot directory
+
+        Returns:
+            int: Number of timers restored
+        """
+        if not os.path.isdir(directory):
+            return 0
+        restored = 0
+        now = time.time()
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(directory, name)
+            claimed = f"{path}.claimed-{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, 'rb') as f:
+                    timers = json_codec.loads(f.read())
+                for key, deadline in timers.items():
+                    self.schedule(key, deadline - now)
+                restored += len(timers)
+            except Exception:
+                logger.exception(f"Failed to restore order expiry snapshot {name}")
+            finally:
+                os.remove(claimed)
+        if restored:
+            logger.info(f"Restored {restored} order expiry timers")
+        return restored
+
+    def stats(self):
+        """Return counters and the number of tracked orders"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._wheel)
+            return stats
+
+
+def expire_orders(order_ids):
+    """
+    Mark pending orders as expired at Raja Ferry so their seats are released
+
+    Orders that another worker has already seen a terminal webhook for are
+    skipped; the outbox is shared between workers and records every
+    status change.
+
+    Args:
+        order_ids (list): Order ids whose timers fired
+    """
+    if OUTBOX_ENABLED:
+        latest = get_dispatcher().outbox.latest_statuses(order_ids)
+        order_ids = [order_id for order_id in order_ids if latest.get(order_id) in (None, 'pending')]
+
+    for order_id in order_ids:
+        logger.info(f"Payment expired for order {order_id}")
+        update_order_status(order_id, 'expired', {'reason': 'payment_timeout'})
+
+
+# Process-wide scheduler for pending orders
+order_expiry = ExpiryScheduler(expire_orders, tick=EXPIRY_TICK)
+
+
+def track_pending_order(order_id, ttl):
+    """
+    Start the expiry timer of a newly created pending order
+
+    Args:
+        order_id (str): Order id
+        ttl (float): Seconds the customer has to complete payment
+    """
+    if ORDER_EXPIRY_ENABLED and order_id:
+        order_expiry.schedule(order_id, ttl)
+
+
+def settle_order(order_id, status):
+    """
+    Cancel the expiry timer once a webhook reports a terminal status
+
+    Args:
+        order_id (str): Order id
+        status (str): Webhook status
+    """
+    if status in TERMINAL_STATUSES:
+        order_expiry.cancel(order_id)
+
+
+def restore_pending_orders():
+    """Resume expiry timers saved by workers that have shut down"""
+    if ORDER_EXPIRY_ENABLED:
+        order_expiry.restore(EXPIRY_SNAPSHOT_DIR)
+
+
+def save_pending_orders(timeout=None):
+    """
+    Stop the expiry thread and save pending timers for the next worker
+
+    Args:
+        timeout (float, optional): Unused; accepted for drain callbacks
+    """
+    order_expiry.stop()
+    path = os.path.join(EXPIRY_SNAPSHOT_DIR, f"{socket.gethostname()}-{os.getpid()}.json")
+    saved = order_expiry.save(path)
+    if saved:
+        logger.info(f"Saved {saved} pending order expiry timers to {path}")
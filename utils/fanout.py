@@ -0,0 +1,508 @@
+"""
+Fan-out of verified payment events to internal subscribers
+
+Ticketing, accounting and notifications each get every verified mPAY ONE
+webhook (or the statuses they asked for) without the webhook handler
+calling any of them. Publishing appends one row per subscriber to a local
+SQLite table inside the webhook request, so the mPAY acknowledgement never
+waits for a subscriber. Each subscriber has its own queue in that table and
+its own dispatcher thread: a slow or failing subscriber only delays and
+retries its own deliveries.
+
+Dispatchers send events in batches over the pooled HTTP session, as one
+JSON document signed with the subscriber's own key:
+
+    X-Signature-Timestamp: <unix seconds>
+    X-Signature: sha256=<hex HMAC-SHA256 of "<timestamp>." + body>
+
+Events of the same order reach a subscriber in the order they were
+published. Every event carries an ``event_id`` derived from the webhook's
+content, the same for every subscriber and when the backfill tool
+reprocesses the webhook, so a subscriber can drop the duplicates that
+retries and reprocessing produce. Failed batches are retried with
+exponential backoff and given up on after FANOUT_MAX_ATTEMPTS. Delivered
+events are purged after FANOUT_RETENTION seconds.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+from utils import json_codec
+from utils.sqlite_store import SQLiteStore
+from utils.http_client import get_session
+from utils.outbox import OutboxDispatcher
+from utils.tracing import tracer
+from config import (
+    WEBHOOK_SUBSCRIBERS, FANOUT_DB_PATH, FANOUT_BATCH_SIZE, FANOUT_LINGER, FANOUT_MAX_ATTEMPTS, FANOUT_TIMEOUT,
+    FANOUT_RETENTION
+)
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Signature'
+TIMESTAMP_HEADER = 'X-Signature-Timestamp'
+
+
+class Subscriber:
+    """An internal system receiving payment events"""
+
+    __slots__ = ('name', 'url', 'secret', 'statuses', 'timeout')
+
+    def __init__(self, name, url, secret, statuses=None, timeout=10.0):
+        self.name = name
+        self.url = url
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        # None receives every status
+        self.statuses = frozenset(statuses) if statuses else None
+        self.timeout = timeout
+
+    def wants(self, status):
+        return self.statuses is None or status in self.statuses
+
+    def sign(self, body, timestamp):
+        """Return the signature header value for a delivery body"""
+        mac = hmac.new(self.secret, f"{timestamp}.".encode('ascii'), hashlib.sha256)
+        mac.update(body)
+        return f"sha256={mac.hexdigest()}"
+
+
+def parse_subscribers(spec, environ=None, timeout=10.0):
+    """
+    Parse the subscriber configuration
+
+    Args:
+        spec (str): Comma separated "<name>=<url>" entries
+        environ (dict, optional): Where WEBHOOK_SUBSCRIBER_<NAME>_SECRET and
+            _STATUSES are read, defaults to os.environ
+        timeout (float, optional): Seconds per delivery
+
+    Returns:
+        list: Subscribers
+
+    Raises:
+        ValueError: If an entry has no URL or a subscriber has no secret
+    """
+    environ = os.environ if environ is None else environ
+    subscribers = []
+    for entry in spec.split(','):
+        name, _, url = entry.strip().partition('=')
+        name, url = name.strip(), url.strip()
+        if not name:
+            continue
+        if not url:
+            raise ValueError(f"Webhook subscriber {name} has no URL")
+        prefix = f"WEBHOOK_SUBSCRIBER_{name.upper().replace('-', '_')}_"
+        secret = environ.get(f"{prefix}SECRET")
+        if not secret:
+            raise ValueError(f"Webhook subscriber {name} has no {prefix}SECRET")
+        statuses = [status.strip() for status in environ.get(f"{prefix}STATUSES", '').split('|') if status.strip()]
+        subscribers.append(Subscriber(name, url, secret, statuses, timeout))
+    return subscribers
+
+
+class FanoutStore(SQLiteStore):
+    """Durable per-subscriber queues of payment events, shared by all workers"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS deliveries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subscriber TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            available_at REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            delivered_at REAL,
+            dead INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS deliveries_pending
+            ON deliveries (subscriber, available_at, id) WHERE delivered_at IS NULL AND dead = 0;
+        CREATE INDEX IF NOT EXISTS deliveries_order
+            ON deliveries (subscriber, order_id, id);
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=12, base_backoff=1.0, max_backoff=300.0):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def append(self, subscribers, order_id, event):
+        """
+        Queue an event for several subscribers
+
+        Args:
+            subscribers (list): Subscriber names
+            order_id (str): Order the event belongs to
+            event (dict): Event data, encoded once for every subscriber
+
+        Returns:
+            str: Event id shared by the subscribers' copies
+        """
+        event_id = hashlib.sha256(json_codec.canonical_dumps(event)).hexdigest()[:32]
+        payload = json_codec.dumps(event)
+        now = time.time()
+        self._connection().executemany(
+            "INSERT INTO deliveries (subscriber, event_id, order_id, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(name, event_id, order_id, payload, now) for name in subscribers]
+        )
+        return event_id
+
+    def claim(self, subscriber, limit, now=None):
+        """
+        Lease the next batch of a subscriber's deliverable events
+
+        Args:
+            subscriber (str): Subscriber name
+            limit (int): Maximum number of events
+            now (float, optional): Current time
+
+        Returns:
+            list: Rows as (id, event_id, order_id, payload, attempts)
+        """
+        if now is None:
+            now = time.time()
+
+        with self.batch() as conn:
+            rows = conn.execute(
+                """
+                SELECT d.id, d.event_id, d.order_id, d.payload, d.attempts
+                FROM deliveries d
+                WHERE d.subscriber = :subscriber AND d.delivered_at IS NULL AND d.dead = 0
+                  AND d.available_at <= :now
+                  AND NOT EXISTS (
+                      SELECT 1 FROM deliveries p
+                      WHERE p.subscriber = d.subscriber AND p.order_id = d.order_id AND p.id < d.id
+                        AND p.delivered_at IS NULL AND p.dead = 0 AND p.available_at > :now
+                  )
+                ORDER BY d.id
+                LIMIT :limit
+                """,
+                {'subscriber': subscriber, 'now': now, 'limit': limit}
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE deliveries SET available_at = ? WHERE id = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows]
+                )
+        return rows
+
+    def mark_delivered(self, ids, now=None):
+        """Mark deliveries as done"""
+        if now is None:
+            now = time.time()
+        self._connection().executemany(
+            "UPDATE deliveries SET delivered_at = ? WHERE id = ?", [(now, row_id) for row_id in ids]
+        )
+
+    def mark_failed(self, subscriber, rows, error, now=None):
+        """
+        Schedule a retry with exponential backoff, or give up after max_attempts
+
+        Args:
+            subscriber (str): Subscriber name, for the logs
+            rows (list): Rows returned by claim()
+            error (str): Failure description
+            now (float, optional): Current time
+        """
+        if now is None:
+            now = time.time()
+
+        updates = []
+        for row_id, event_id, order_id, _, attempts in rows:
+            attempts += 1
+            dead = 1 if attempts >= self.max_attempts else 0
+            if dead:
+                logger.error(f"Giving up on event {event_id} of order {order_id} for {subscriber} "
+                             f"after {attempts} attempts: {error}")
+            delay = min(self.max_backoff, self.base_backoff * (2 ** (attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+            updates.append((attempts, now + delay, dead, error, row_id))
+
+        self._connection().executemany(
+            "UPDATE deliveries SET attempts = ?, available_at = ?, dead = ?, last_error = ? WHERE id = ?",
+            updates
+        )
+
+    def counts(self):
+        """
+        Return the queue state of every subscriber
+
+        Returns:
+            dict: subscriber -> {"pending", "dead", "delivered"}
+        """
+        rows = self._connection().execute(
+            "SELECT subscriber,"
+            " SUM(delivered_at IS NULL AND dead = 0), SUM(dead), SUM(delivered_at IS NOT NULL)"
+            " FROM deliveries GROUP BY subscriber"
+        ).fetchall()
+        return {
+            name: {'pending': pending or 0, 'dead': dead or 0, 'delivered': delivered or 0}
+            for name, pending, dead, delivered in rows
+        }
+
+    def purge_delivered(self, older_than=86400, subscriber=None, now=None):
+        """Delete deliveries completed more than ``older_than`` seconds ago, of one or every subscriber"""
+        if now is None:
+            now = time.time()
+        if subscriber is None:
+            self._connection().execute(
+                "DELETE FROM deliveries WHERE delivered_at IS NOT NULL AND delivered_at < ?", (now - older_than,)
+            )
+        else:
+            self._connection().execute(
+                "DELETE FROM deliveries WHERE subscriber = ? AND delivered_at IS NOT NULL AND delivered_at < ?",
+                (subscriber, now - older_than)
+            )
+
+
+class SubscriberQueue:
+    """One subscriber's view of the store, as OutboxDispatcher dispatches it"""
+
+    def __init__(self, store, subscriber):
+        self.store = store
+        self.subscriber = subscriber
+
+    def claim(self, limit):
+        return self.store.claim(self.subscriber, limit)
+
+    def mark_delivered(self, ids):
+        self.store.mark_delivered(ids)
+
+    def mark_failed(self, rows, error):
+        self.store.mark_failed(self.subscriber, rows, error)
+
+    def purge_delivered(self, older_than):
+        self.store.purge_delivered(older_than, subscriber=self.subscriber)
+
+
+def send_event_batch(subscriber, rows):
+    """
+    Deliver a batch of events to a subscriber in one signed call
+
+    Args:
+        subscriber (Subscriber): Receiving subscriber
+        rows (list): Rows returned by FanoutStore.claim()
+
+    Returns:
+        tuple: (delivered, error message or None)
+    """
+    # Payloads are stored as JSON; splice them in instead of decoding and re-encoding
+    events = b','.join(
+        b'{"event_id":' + json_codec.dumps_bytes(event_id) + b',"order_id":' + json_codec.dumps_bytes(order_id)
+        + b',"data":' + payload.encode('utf-8') + b'}'
+        for _, event_id, order_id, payload, _ in rows
+    )
+    body = b'{"subscriber":' + json_codec.dumps_bytes(subscriber.name) + b',"events":[' + events + b']}'
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: subscriber.sign(body, timestamp),
+    }
+
+    with tracer.span('fanout.deliver', subscriber=subscriber.name, batch_size=len(rows)) as span:
+        tracer.inject(headers)
+        try:
+            response = get_session().post(subscriber.url, data=body, headers=headers, timeout=subscriber.timeout)
+        except Exception as e:
+            span.record_error(e)
+            return False, str(e)
+
+        span.set_attribute('http.status_code', response.status_code)
+        if response.ok:
+            return True, None
+        span.record_error(f"HTTP {response.status_code}")
+        return False, f"HTTP {response.status_code}: {response.text[:200]}"
+
+
+class SubscriberRegistry:
+    """Subscribers and their dispatchers in this process"""
+
+    def __init__(self, store, batch_size=50, linger=0.5, send=send_event_batch, retention=86400):
+        self.store = store
+        self.batch_size = batch_size
+        self.linger = linger
+        self.send = send
+        # Seconds delivered events are kept before the dispatchers purge them
+        self.retention = retention
+
+        self._subscribers = {}
+        self._dispatchers = {}
+        self._lock = threading.Lock()
+
+    def register(self, subscriber):
+        """Add a subscriber, or replace the one with the same name"""
+        dispatcher = OutboxDispatcher(
+            SubscriberQueue(self.store, subscriber.name),
+            batch_size=self.batch_size,
+            linger=self.linger,
+            send=lambda rows: self.send(subscriber, rows),
+            name=f"fanout-{subscriber.name}",
+            target=f"subscriber {subscriber.name}",
+            retention=self.retention
+        )
+        with self._lock:
+            previous = self._dispatchers.get(subscriber.name)
+            self._subscribers[subscriber.name] = subscriber
+            self._dispatchers[subscriber.name] = dispatcher
+        if previous is not None:
+            previous.stop(0)
+
+    @property
+    def subscribers(self):
+        return list(self._subscribers.values())
+
+    def publish(self, event, deliver=True):
+        """
+        Queue an event for every subscriber that wants its status
+
+        Args:
+            event (dict): Verified webhook payload without its signature
+            deliver (bool, optional): Deliver from this process; batch jobs
+                only queue for the server's dispatchers
+
+        Returns:
+            list: Names of the subscribers the event was queued for
+        """
+        status = event.get('status')
+        names = [subscriber.name for subscriber in self._subscribers.values() if subscriber.wants(status)]
+        if not names:
+            return names
+        self.store.append(names, str(event.get('order_id') or ''), event)
+        if deliver:
+            for name in names:
+                dispatcher = self._dispatchers[name]
+                # Threads do not survive fork, so (re)start lazily in each worker
+                dispatcher.start()
+                dispatcher.notify()
+        return names
+
+    def start(self):
+        """Start every dispatcher, e.g. to resume deliveries queued before a restart"""
+        for dispatcher in list(self._dispatchers.values()):
+            dispatcher.start()
+
+    def stop(self, timeout=None):
+        """
+        Deliver what is pending and stop the dispatchers
+
+        Args:
+            timeout (float, optional): Seconds to spend flushing, shared by all subscribers
+
+        Returns:
+            int: Number of events delivered while flushing
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        delivered = 0
+        for dispatcher in list(self._dispatchers.values()):
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            delivered += dispatcher.stop(remaining)
+        return delivered
+
+    def status(self):
+        """Return each subscriber's configuration and queue state"""
+        counts = self.store.counts()
+        return {
+            subscriber.name: {
+                'url': subscriber.url,
+                'statuses': sorted(subscriber.statuses) if subscriber.statuses else None,
+                **counts.get(subscriber.name, {'pending': 0, 'dead': 0, 'delivered': 0}),
+            }
+            for subscriber in self._subscribers.values()
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the process-wide subscriber registry, creating it on first use
+
+    Returns:
+        SubscriberRegistry: Registry with the configured subscribers, or
+            None when WEBHOOK_SUBSCRIBERS is empty
+    """
+    global _registry
+    if _registry is None and WEBHOOK_SUBSCRIBERS.strip():
+        with _registry_lock:
+            if _registry is None:
+                registry = SubscriberRegistry(
+                    FanoutStore(FANOUT_DB_PATH, max_attempts=FANOUT_MAX_ATTEMPTS),
+                    batch_size=FANOUT_BATCH_SIZE,
+                    linger=FANOUT_LINGER,
+                    retention=FANOUT_RETENTION
+                )
+                for subscriber in parse_subscribers(WEBHOOK_SUBSCRIBERS, timeout=FANOUT_TIMEOUT):
+                    registry.register(subscriber)
+                _registry = registry
+    return _registry
+
+
+def check_subscribers():
+    """
+    Validate WEBHOOK_SUBSCRIBERS at startup
+
+    publish_event() never raises, so a bad entry would otherwise only show
+    as an error logged for every webhook.
+
+    Raises:
+        ValueError: If an entry has no URL or a subscriber has no secret
+    """
+    parse_subscribers(WEBHOOK_SUBSCRIBERS, timeout=FANOUT_TIMEOUT)
+
+
+def publish_event(event, deliver=True):
+    """
+    Queue a verified webhook for the subscribers; never raises
+
+    Args:
+        event (dict): Webhook payload without its signature
+        deliver (bool, optional): See SubscriberRegistry.publish()
+
+    Returns:
+        list: Names of the subscribers the event was queued for
+    """
+    try:
+        registry = get_registry()
+        if registry is None:
+            return []
+        return registry.publish(event, deliver)
+    except Exception:
+        logger.exception(f"Failed to queue order {event.get('order_id')} for webhook subscribers")
+        return []
+
+
+def start_dispatchers():
+    """Start delivering what is queued, if there are subscribers; never raises"""
+    try:
+        registry = get_registry()
+        if registry is not None:
+            registry.start()
+    except Exception:
+        logger.exception("Failed to start webhook subscriber dispatchers")
+
+
+def shutdown(timeout=None):
+    """
+    Deliver what is pending and stop this process's dispatchers
+
+    Args:
+        timeout (float, optional): Seconds to spend flushing
+
+    Returns:
+        int: Number of events delivered while flushing
+    """
+    if _registry is None:
+        return 0
+    return _registry.stop(timeout)
@@ -0,0 +1,47 @@
+"""
+Flask and flask_restful integration for the JSON codec
+"""
+
+from flask import make_response
+from flask.json.provider import JSONProvider
+from werkzeug.wrappers import Response
+from utils import json_codec
+
+
+class CodecJSONProvider(JSONProvider):
+    """Flask JSON provider backed by utils.json_codec
+
+    Installed as ``app.json`` so request.get_json() and jsonify() use the
+    same encoder as the API representation.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+
+def output_json(data, code, headers=None):
+    """
+    flask_restful representation for application/json
+
+    Args:
+        data: Resource return value
+        code (int): HTTP status code
+        headers (dict, optional): Extra response headers
+
+    Returns:
+        flask.Response: JSON response
+    """
+    # Error paths in the resources return jsonify(...) responses together
+    # with a status code, so pass those through instead of encoding them again
+    if isinstance(data, Response):
+        data.status_code = code
+        data.headers.extend(headers or {})
+        return data
+
+    resp = make_response(json_codec.dumps_bytes(data), code)
+    resp.mimetype = 'application/json'
+    resp.headers.extend(headers or {})
+    return resp
@@ -1,9 +1,66 @@
 import logging
+import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from utils.rate_limit import AdaptiveConcurrencyLimiter
+from utils.tracing import tracer
+from utils.lifecycle import lifecycle
+from config import (
+    MPAY_CONCURRENCY_INITIAL, MPAY_CONCURRENCY_MIN, MPAY_CONCURRENCY_MAX,
+    MPAY_LATENCY_TOLERANCE, HTTP_POOL_MAXSIZE, MPAY_ONE_BASE_URL, RAJA_FERRY_API_URL,
+    UPSTREAM_MOCK_ENABLED, UPSTREAM_MOCK_LATENCY
+)
 
 logger = logging.getLogger(__name__)
 
+
+class UpstreamOverloadedError(RequestException):
+    """Raised when an outbound call is shed by the concurrency limiter"""
+
+
+# Shared cap on concurrent calls to mPAY ONE for this worker
+mpay_concurrency = AdaptiveConcurrencyLimiter(
+    initial_limit=MPAY_CONCURRENCY_INITIAL,
+    min_limit=MPAY_CONCURRENCY_MIN,
+    max_limit=MPAY_CONCURRENCY_MAX,
+    tolerance=MPAY_LATENCY_TOLERANCE
+)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Get the shared HTTP session for this process
+    
+    The session keeps connections to mPAY ONE and Raja Ferry open between
+    requests instead of paying for DNS, TCP and TLS setup on every call.
+    
+    Returns:
+        requests.Session: Pooled session
+    """
+    global _session, _session_pid
+    # Sockets must not be shared with a forked worker
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                if UPSTREAM_MOCK_ENABLED:
+                    # Benchmarks: answer mPAY ONE and Raja Ferry locally
+                    from utils.upstream_mock import MockUpstreamAdapter
+                    mock = MockUpstreamAdapter(latency=UPSTREAM_MOCK_LATENCY)
+                    session.mount(MPAY_ONE_BASE_URL, mock)
+                    session.mount(RAJA_FERRY_API_URL, mock)
+                _session = session
+                _session_pid = os.getpid()
+    return _session
+
 def make_request(method, url, data=None, headers=None, timeout=30):
     """
     Make HTTP request to mPAY ONE API
@@ -20,28 +77,39 @@ def make_request(method, url, data=None, headers=None, timeout=30):
     
     Raises:
         RequestException: If request fails
+        UpstreamOverloadedError: If the call is shed because mPAY is slow
     """
     if headers is None:
         headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+    else:
+        headers = dict(headers)
+    
+    span = tracer.start_span('mpay.request', {'http.method': method, 'http.url': url})
+    tracer.inject(headers)
     
     try:
         logger.debug(f"Making {method} request to {url}")
-        if data:
+        # Formatting full payloads and decoding response bodies is only worth it when they are logged
+        if data and logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Request payload: {data}")
         
-        response = requests.request(
-            method=method,
-            url=url,
-            json=data,
-            headers=headers,
-            timeout=timeout
-        )
+        # Counted as in flight so a draining worker waits for it
+        with lifecycle.track_call(), mpay_concurrency.slot():
+            response = get_session().request(
+                method=method,
+                url=url,
+                json=data,
+                headers=headers,
+                timeout=timeout
+            )
         
+        span.set_attribute('http.status_code', response.status_code)
         logger.debug(f"Response status: {response.status_code}")
-        logger.debug(f"Response content: {response.text}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Response content: {response.text}")
         
         # Raise exception for 4XX/5XX responses
         response.raise_for_status()
@@ -50,10 +118,14 @@ def make_request(method, url, data=None, headers=None, timeout=30):
     
     except RequestException as e:
         logger.error(f"HTTP request failed: {str(e)}")
+        span.record_error(e)
         
         # Return the response even if status code indicates error
         if hasattr(e, 'response') and e.response is not None:
             return e.response
         
         # Re-raise the exception if no response
-        raise
\ No newline at end of file
+        raise
+    
+    finally:
+        tracer.end_span(span)
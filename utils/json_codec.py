@@ -0,0 +1,129 @@
+"""
+JSON encoding and decoding utilities
+
+Uses orjson when it is installed and falls back to the standard library
+json module otherwise. Everything that serializes API payloads (response
+representation, request parsing, signing) goes through this module so the
+output stays identical whichever backend is active.
+"""
+
+import datetime
+import decimal
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Name of the active backend, useful for logging and benchmarks
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj):
+    """
+    Serialize types that the JSON backends do not handle natively
+
+    Args:
+        obj: Object that could not be serialized
+
+    Returns:
+        str: JSON compatible representation of the object
+
+    Raises:
+        TypeError: If the object type is not supported
+    """
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """
+    Serialize an object to compact UTF-8 encoded JSON
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        bytes: JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def dumps(obj):
+    """
+    Serialize an object to a compact JSON string
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        str: JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, default=_default)
+
+
+def loads(data):
+    """
+    Parse a JSON document
+
+    Args:
+        data (str | bytes): JSON document
+
+    Returns:
+        object: Parsed value
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _is_canonical_scalar(value):
+    """
+    Check whether a value serializes identically with both backends
+
+    Floats are only accepted in the range where repr() does not switch to
+    exponent notation, which covers every amount the gateway deals with.
+    """
+    if isinstance(value, float):
+        return value == 0 or 1e-4 <= abs(value) < 1e16
+    return value is None or isinstance(value, (str, int))
+
+
+def canonical_dumps(data):
+    """
+    Serialize a payload to the canonical form used for signing
+
+    Top-level keys are sorted alphabetically and the output uses compact
+    separators with ASCII escaping, matching json.dumps(separators=(',', ':')).
+    orjson is only used for flat payloads whose output is pure ASCII without
+    DEL (0x7f), which json.dumps escapes and orjson writes raw; that is where
+    both backends are guaranteed to produce the same bytes.
+
+    Args:
+        data (dict): Request payload
+
+    Returns:
+        bytes: Canonical JSON document
+    """
+    sorted_data = {k: data[k] for k in sorted(data.keys())}
+
+    if orjson is not None and all(_is_canonical_scalar(v) for v in sorted_data.values()):
+        try:
+            encoded = orjson.dumps(sorted_data, default=_default)
+        except TypeError:
+            encoded = None
+        if encoded is not None and encoded.isascii() and b'\x7f' not in encoded:
+            return encoded
+
+    return json.dumps(sorted_data, separators=(',', ':'), default=_default).encode('utf-8')
@@ -0,0 +1,169 @@
+"""
+Worker lifecycle: readiness, draining and shutdown
+
+A worker is "starting" until the app marks it ready, "ready" while it
+serves traffic, and "draining" once SIGTERM arrives. While draining, new
+payment requests are refused with 503 and the readiness probe fails so the
+load balancer moves traffic away, but webhooks and calls already in flight
+keep running. The drain waits for outstanding mPAY calls up to a
+deadline, then runs the registered flush callbacks (outbox, event log,
+expiry timers) with whatever time is left, and finally hands the signal
+to the previous handler, e.g. gunicorn's graceful worker exit.
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from config import LIFECYCLE_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+STARTING = 'starting'
+READY = 'ready'
+DRAINING = 'draining'
+STOPPED = 'stopped'
+
+
+class Lifecycle:
+    """State of this worker and its in-flight upstream calls"""
+
+    def __init__(self, drain_timeout=25.0):
+        self.drain_timeout = drain_timeout
+        self.state = STARTING
+        self.started_at = time.time()
+        # Set by a server entrypoint that prepares each worker itself
+        self.managed = False
+
+        self._in_flight = 0
+        self._idle = threading.Condition()
+        self._flushers = []
+        self._drain_lock = threading.Lock()
+        self._previous_handlers = {}
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def draining(self):
+        return self.state in (DRAINING, STOPPED)
+
+    def mark_ready(self):
+        """Start reporting ready, unless the worker is already draining"""
+        if self.state == STARTING:
+            self.state = READY
+            logger.info(f"Worker {os.getpid()} ready after {time.time() - self.started_at:.2f}s")
+
+    @contextmanager
+    def track_call(self):
+        """Count an upstream call as in flight for its duration"""
+        with self._idle:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                if self._in_flight == 0:
+                    self._idle.notify_all()
+
+    def register_flush(self, name, callback):
+        """
+        Register a callback to run while draining
+
+        Args:
+            name (str): Name used in logs
+            callback (callable): Called with the remaining seconds before the deadline
+        """
+        self._flushers.append((name, callback))
+
+    def drain(self, timeout=None):
+        """
+        Stop taking new work, wait for in-flight calls and flush queues
+
+        Safe to call more than once; later calls flush again, which picks
+        up anything queued since.
+
+        Args:
+            timeout (float, optional): Overall deadline in seconds
+
+        Returns:
+            bool: True if every in-flight call finished before the deadline
+        """
+        with self._drain_lock:
+            if self.state != STOPPED:
+                self.state = DRAINING
+            deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+            logger.info(f"Draining worker {os.getpid()} with {self._in_flight} upstream calls in flight")
+
+            with self._idle:
+                while self._in_flight and time.monotonic() < deadline:
+                    self._idle.wait(deadline - time.monotonic())
+                idle = self._in_flight == 0
+            if not idle:
+                logger.error(f"Drain deadline reached with {self._in_flight} upstream calls still in flight")
+
+            for name, callback in self._flushers:
+                try:
+                    callback(max(0.0, deadline - time.monotonic()))
+                except Exception:
+                    logger.exception(f"Failed to flush {name} while draining")
+
+            self.state = STOPPED
+            logger.info(f"Worker {os.getpid()} drained")
+            return idle
+
+    def install_signal_handlers(self, signals=(signal.SIGTERM,)):
+        """
+        Drain on the given signals, then pass them to the previous handler
+
+        Must be called from the main thread after the server installed its
+        own handlers (for gunicorn, in post_worker_init).
+        """
+        for signum in signals:
+            self._previous_handlers[signum] = signal.getsignal(signum)
+            signal.signal(signum, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        if self.draining:
+            return
+        self.state = DRAINING
+        logger.info(f"Received signal {signum}, draining worker {os.getpid()}")
+        # Drain off the signal handler so requests keep being served meanwhile
+        threading.Thread(target=self._drain_and_exit, args=(signum, frame), name='drain', daemon=True).start()
+
+    def _drain_and_exit(self, signum, frame):
+        try:
+            self.drain()
+        finally:
+            previous = self._previous_handlers.get(signum)
+            if callable(previous):
+                previous(signum, frame)
+                # Interrupt the main thread's wait (e.g. gunicorn's select on its
+                # wakeup pipe) so it notices the handler ran; ours ignores the repeat
+                os.kill(os.getpid(), signum)
+            elif previous != signal.SIG_IGN:
+                # Default action; handlers can only be reset from the main thread,
+                # so terminate directly now that everything is flushed
+                logging.shutdown()
+                os._exit(128 + signum)
+
+    def status(self):
+        """Return the state for health endpoints"""
+        return {
+            'state': self.state,
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started_at, 3),
+            'in_flight': self._in_flight,
+        }
+
+
+# Process-wide lifecycle
+lifecycle = Lifecycle(drain_timeout=LIFECYCLE_DRAIN_TIMEOUT)
@@ -0,0 +1,277 @@
+"""
+Memory instrumentation for long-lived workers
+
+Reports each worker's resident set size, Python heap figures and
+tracemalloc statistics, and takes tracemalloc snapshots on demand through
+the admin API, optionally diffed against a baseline snapshot to show what
+grew in between. With request tracking on (always in debug mode) every
+request gets the bytes it allocated and its peak added to the response
+headers.
+
+Workers under the production server check their RSS every few requests
+and recycle themselves above MEMORY_MAX_RSS_MB: they stop the way a
+SIGTERM from gunicorn would make them, draining in-flight work, and the
+master starts a fresh one. Each worker's threshold gets a little random
+jitter so workers that grew together do not all restart at once.
+
+tracemalloc costs CPU and memory while it traces, so it only runs once
+requested; the RSS check reads one /proc file every MEMORY_CHECK_INTERVAL
+requests.
+"""
+
+import gc
+import linecache
+import logging
+import os
+import random
+import resource
+import signal
+import threading
+import time
+import tracemalloc
+from config import (
+    PROFILE_DIR, MEMORY_TRACE_FRAMES, MEMORY_MAX_RSS_MB, MEMORY_CHECK_INTERVAL, MEMORY_RECYCLE_JITTER
+)
+
+logger = logging.getLogger(__name__)
+
+# Response headers set by per-request tracking
+ALLOCATED_HEADER = 'X-Alloc-Bytes'
+PEAK_HEADER = 'X-Alloc-Peak'
+
+# Snapshot statistics grouping
+GROUP_BY = ('lineno', 'filename', 'traceback')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Allocations by the tracing machinery itself are left out of snapshots
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+)
+
+
+def rss_bytes():
+    """Return the resident set size of this process, or the peak where the current size is unknown"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of this process"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTracker:
+    """Heap statistics, tracemalloc snapshots and RSS-based recycling for one worker"""
+
+    def __init__(self, max_rss=0, check_interval=100, jitter=0.1):
+        # 0 disables recycling; the jitter spreads restarts of workers that grew together
+        self.base_max_rss = max_rss
+        self.jitter = jitter
+        self.max_rss = self._roll_threshold()
+        self.check_interval = max(1, check_interval)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._baseline = None
+        self._recycling = False
+        self._pid = os.getpid()
+
+    def _roll_threshold(self):
+        if not self.base_max_rss:
+            return 0
+        return int(self.base_max_rss * (1 + random.uniform(0, self.jitter)))
+
+    def status(self):
+        """Return RSS, heap and tracing figures for this worker"""
+        rss = rss_bytes()
+        status = {
+            'pid': os.getpid(),
+            'rss_bytes': rss,
+            'peak_rss_bytes': max(rss, peak_rss_bytes()),
+            'max_rss_bytes': self.max_rss or None,
+            'requests': self._requests,
+            'recycling': self._recycling,
+            'gc_objects': len(gc.get_objects()),
+            'gc_counts': list(gc.get_count()),
+            'tracing': tracemalloc.is_tracing(),
+            'baseline': self._baseline is not None,
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            status['traced_bytes'] = current
+            status['traced_peak_bytes'] = peak
+            status['tracemalloc_overhead_bytes'] = tracemalloc.get_tracemalloc_memory()
+        return status
+
+    def start_tracing(self, frames=None):
+        """
+        Start tracemalloc if it is not running
+
+        Args:
+            frames (int, optional): Frames stored per allocation, defaults to MEMORY_TRACE_FRAMES
+
+        Returns:
+            bool: False if it was already running
+        """
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(int(frames or MEMORY_TRACE_FRAMES))
+        return True
+
+    def stop_tracing(self):
+        """Stop tracemalloc and drop the baseline"""
+        self._baseline = None
+        tracemalloc.stop()
+
+    def take_baseline(self):
+        """Keep a snapshot that later snapshots are compared against"""
+        self.start_tracing()
+        self._baseline = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+    def snapshot(self, top=25, group_by='lineno', compare=False, dump=False):
+        """
+        Summarize what the traced memory is allocated by
+
+        Args:
+            top (int, optional): Number of entries returned
+            group_by (str, optional): "lineno", "filename" or "traceback"
+            compare (bool, optional): Report growth since the baseline instead of totals
+            dump (bool, optional): Also write the raw snapshot under PROFILE_DIR
+                for offline analysis
+
+        Returns:
+            dict: Top allocation sites, totals and the dump file if any
+
+        Raises:
+            ValueError: If tracing is off, group_by is unknown or there is no baseline to compare with
+        """
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not tracing; start tracing first")
+        if group_by not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        if compare and self._baseline is None:
+            raise ValueError("No baseline snapshot to compare with")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        if compare:
+            stats = snapshot.compare_to(self._baseline, group_by)
+            entries = [
+                {
+                    'site': _site(stat.traceback, group_by),
+                    'size_bytes': stat.size,
+                    'size_diff_bytes': stat.size_diff,
+                    'count': stat.count,
+                    'count_diff': stat.count_diff,
+                }
+                for stat in stats[:top]
+            ]
+        else:
+            stats = snapshot.statistics(group_by)
+            entries = [
+                {'site': _site(stat.traceback, group_by), 'size_bytes': stat.size, 'count': stat.count}
+                for stat in stats[:top]
+            ]
+
+        result = {
+            'pid': os.getpid(),
+            'group_by': group_by,
+            'traced_bytes': sum(stat.size for stat in snapshot.statistics('filename')),
+            'top': entries,
+        }
+        if dump:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"memory-{os.getpid()}-{int(time.time())}.tracemalloc")
+            snapshot.dump(path)
+            result['file'] = path
+        return result
+
+    def count_request(self):
+        """
+        Count a served request and recycle the worker if its RSS is over the limit
+
+        Returns:
+            bool: True if this call started the recycle
+        """
+        if not self.max_rss:
+            return False
+        with self._lock:
+            # A fork inherits the parent's counters, and its threshold: with a
+            # preloaded app every worker would otherwise get the same one
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._requests = 0
+                self._recycling = False
+                self.max_rss = self._roll_threshold()
+            self._requests += 1
+            if self._recycling or self._requests % self.check_interval:
+                return False
+            rss = rss_bytes()
+            if rss <= self.max_rss:
+                return False
+            self._recycling = True
+
+        logger.warning(
+            f"Worker {os.getpid()} RSS {rss / 1048576:.0f}MB is over {self.max_rss / 1048576:.0f}MB "
+            f"after {self._requests} requests, recycling"
+        )
+        self.recycle()
+        return True
+
+    def recycle(self):
+        """Ask this worker to shut down gracefully, as gunicorn's SIGTERM would"""
+        self._recycling = True
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _site(traceback, group_by):
+    if group_by == 'traceback':
+        return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+    frame = traceback[0]
+    return frame.filename if group_by == 'filename' else f"{frame.filename}:{frame.lineno}"
+
+
+class RequestAllocations:
+    """Bytes allocated while handling one request, measured with tracemalloc
+
+    tracemalloc counts every thread, so with concurrent requests in one
+    worker the figures include their allocations too; run single-threaded
+    for exact numbers.
+    """
+
+    __slots__ = ('start',)
+
+    def __init__(self):
+        self.start = None
+
+    def begin(self):
+        """Start counting; starts tracemalloc if needed"""
+        memory_tracker.start_tracing()
+        tracemalloc.reset_peak()
+        self.start = tracemalloc.get_traced_memory()[0]
+
+    def end(self):
+        """
+        Returns:
+            tuple: (bytes still allocated since begin(), peak bytes above the start)
+        """
+        # Tracing stopped through the admin API while the request ran
+        if not tracemalloc.is_tracing():
+            return 0, 0
+        current, peak = tracemalloc.get_traced_memory()
+        return current - self.start, peak - self.start
+
+
+# Process-wide tracker
+memory_tracker = MemoryTracker(
+    max_rss=MEMORY_MAX_RSS_MB * 1048576,
+    check_interval=MEMORY_CHECK_INTERVAL,
+    jitter=MEMORY_RECYCLE_JITTER
+)
@@ -0,0 +1,434 @@
+"""
+Transactional outbox for pushing payment results to the Raja Ferry API
+
+Status changes are appended to a local SQLite table inside the webhook
+request, which keeps the mPAY acknowledgement fast. A background
+dispatcher claims pending rows in batches and sends them to Raja Ferry in
+one bulk call over the pooled HTTP session, retrying with exponential
+backoff. Updates for the same booking are always delivered in the order
+they were appended: a row is only claimed once every earlier undelivered
+row for its booking is claimable too.
+
+Several workers can share the same outbox file; rows are claimed with a
+lease so each batch is delivered by one worker at a time.
+"""
+
+import logging
+import random
+import threading
+import time
+from utils import json_codec
+from utils.sqlite_store import SQLiteStore
+from utils.http_client import get_session
+from utils.tracing import tracer
+from config import (
+    RAJA_FERRY_API_URL, RAJA_FERRY_API_KEY, OUTBOX_ENABLED, OUTBOX_PATH,
+    OUTBOX_BATCH_SIZE, OUTBOX_LINGER, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETENTION
+)
+
+logger = logging.getLogger(__name__)
+
+# Raja Ferry endpoint accepting a batch of booking status updates
+RAJA_FERRY_STATUS_ENDPOINT = "/bookings/payment-status/bulk"
+
+
+class Outbox(SQLiteStore):
+    """Durable queue of booking status updates"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            booking_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            available_at REAL NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            delivered_at REAL,
+            dead INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS outbox_pending
+            ON outbox (available_at, id) WHERE delivered_at IS NULL AND dead = 0;
+        CREATE INDEX IF NOT EXISTS outbox_booking
+            ON outbox (booking_id, id);
+    """
+
+    def __init__(self, path, lease_seconds=60, max_attempts=12, base_backoff=1.0, max_backoff=300.0):
+        super().__init__(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def append(self, booking_id, status, details=None):
+        """
+        Record a status change for delivery to Raja Ferry
+
+        Args:
+            booking_id (str): Raja Ferry booking / order id
+            status (str): New booking payment status, e.g. "paid"
+            details (dict, optional): Extra fields sent with the update
+
+        Returns:
+            int: Outbox row id
+        """
+        cursor = self._connection().execute(
+            "INSERT INTO outbox (booking_id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+            (booking_id, status, json_codec.dumps(details or {}), time.time())
+        )
+        return cursor.lastrowid
+
+    def claim(self, limit, now=None):
+        """
+        Lease the next batch of deliverable rows
+
+        Args:
+            limit (int): Maximum number of rows
+            now (float, optional): Current time
+
+        Returns:
+            list: Rows as (id, booking_id, status, payload, attempts)
+        """
+        if now is None:
+            now = time.time()
+
+        with self.batch() as conn:
+            rows = conn.execute(
+                """
+                SELECT o.id, o.booking_id, o.status, o.payload, o.attempts
+                FROM outbox o
+                WHERE o.delivered_at IS NULL AND o.dead = 0 AND o.available_at <= :now
+                  AND NOT EXISTS (
+                      SELECT 1 FROM outbox p
+                      WHERE p.booking_id = o.booking_id AND p.id < o.id
+                        AND p.delivered_at IS NULL AND p.dead = 0 AND p.available_at > :now
+                  )
+                ORDER BY o.id
+                LIMIT :limit
+                """,
+                {'now': now, 'limit': limit}
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET available_at = ? WHERE id = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows]
+                )
+        return rows
+
+    def mark_delivered(self, ids, now=None):
+        """Mark rows as delivered"""
+        if now is None:
+            now = time.time()
+        self._connection().executemany(
+            "UPDATE outbox SET delivered_at = ? WHERE id = ?", [(now, row_id) for row_id in ids]
+        )
+
+    def mark_failed(self, rows, error, now=None):
+        """
+        Schedule a retry with exponential backoff, or give up after max_attempts
+
+        Args:
+            rows (list): Rows returned by claim()
+            error (str): Failure description
+            now (float, optional): Current time
+        """
+        if now is None:
+            now = time.time()
+
+        updates = []
+        for row_id, booking_id, _, _, attempts in rows:
+            attempts += 1
+            dead = 1 if attempts >= self.max_attempts else 0
+            if dead:
+                logger.error(f"Giving up on outbox row {row_id} for booking {booking_id} after {attempts} attempts: {error}")
+            delay = min(self.max_backoff, self.base_backoff * (2 ** (attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+            updates.append((attempts, now + delay, dead, error, row_id))
+
+        self._connection().executemany(
+            "UPDATE outbox SET attempts = ?, available_at = ?, dead = ?, last_error = ? WHERE id = ?",
+            updates
+        )
+
+    def latest_statuses(self, booking_ids):
+        """
+        Return the most recently appended status of each booking
+
+        Args:
+            booking_ids (list): Booking ids to look up
+
+        Returns:
+            dict: booking_id -> status for bookings that have any row
+        """
+        statuses = {}
+        conn = self._connection()
+        booking_ids = list(booking_ids)
+        # Stay well under SQLite's bound parameter limit
+        for start in range(0, len(booking_ids), 500):
+            chunk = booking_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT booking_id, status FROM outbox WHERE id IN ("
+                f" SELECT MAX(id) FROM outbox WHERE booking_id IN ({placeholders}) GROUP BY booking_id)",
+                chunk
+            ).fetchall()
+            statuses.update(rows)
+        return statuses
+
+    def pending_count(self):
+        """Return the number of rows not yet delivered"""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM outbox WHERE delivered_at IS NULL AND dead = 0"
+        ).fetchone()[0]
+
+    def purge_delivered(self, older_than=86400, now=None):
+        """Delete delivered rows older than ``older_than`` seconds"""
+        if now is None:
+            now = time.time()
+        self._connection().execute(
+            "DELETE FROM outbox WHERE delivered_at IS NOT NULL AND delivered_at < ?", (now - older_than,)
+        )
+
+
+def send_status_batch(rows):
+    """
+    Push a batch of status updates to Raja Ferry in one call
+
+    Args:
+        rows (list): Rows returned by Outbox.claim()
+
+    Returns:
+        tuple: (delivered, error message or None)
+    """
+    updates = [
+        {
+            'event_id': row_id,
+            'booking_id': booking_id,
+            'status': status,
+            'details': json_codec.loads(payload),
+        }
+        for row_id, booking_id, status, payload, _ in rows
+    ]
+    headers = {
+        'Authorization': f'Bearer {RAJA_FERRY_API_KEY}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    with tracer.span('raja_ferry.push_status', batch_size=len(rows)) as span:
+        tracer.inject(headers)
+        try:
+            response = get_session().post(
+                f"{RAJA_FERRY_API_URL}{RAJA_FERRY_STATUS_ENDPOINT}",
+                data=json_codec.dumps_bytes({'updates': updates}),
+                headers=headers,
+                timeout=30
+            )
+        except Exception as e:
+            span.record_error(e)
+            return False, str(e)
+
+        span.set_attribute('http.status_code', response.status_code)
+        if response.ok:
+            return True, None
+        span.record_error(f"HTTP {response.status_code}")
+        return False, f"HTTP {response.status_code}: {response.text[:200]}"
+
+
+class OutboxDispatcher:
+    """Background thread delivering outbox rows in batches
+
+    A batch is sent as soon as ``batch_size`` updates were appended by this
+    process, and otherwise at least every ``linger`` seconds. Any queue with
+    the claim(), mark_delivered() and mark_failed() methods of Outbox can be
+    dispatched; ``name`` and ``target`` label the thread and the logs. With a
+    ``retention``, the queue's purge_delivered() drops rows delivered more
+    than that many seconds ago every ``purge_interval`` seconds.
+    """
+
+    def __init__(self, outbox, batch_size=50, linger=1.0, send=send_status_batch,
+                 name='outbox-dispatcher', target='Raja Ferry', retention=None, purge_interval=3600):
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.linger = linger
+        self.send = send
+        self.name = name
+        self.target = target
+        self.retention = retention
+        self.purge_interval = purge_interval
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._appended = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the dispatcher thread if it is not running in this process"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Signal that a row was appended"""
+        self._appended += 1
+        if self._appended >= self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        next_purge = time.monotonic()
+        while not self._stop.is_set():
+            self._wakeup.wait(self.linger)
+            self._wakeup.clear()
+            self._appended = 0
+            try:
+                self.dispatch_pending()
+            except Exception:
+                logger.exception(f"Dispatch to {self.target} failed")
+
+            if self.retention is not None and time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + self.purge_interval
+                try:
+                    self.outbox.purge_delivered(self.retention)
+                except Exception:
+                    logger.exception(f"Failed to purge rows delivered to {self.target}")
+
+    def dispatch_pending(self, deadline=None):
+        """
+        Deliver batches until nothing is deliverable
+
+        Args:
+            deadline (float, optional): time.monotonic() value to stop at
+
+        Returns:
+            int: Number of rows delivered
+        """
+        delivered = 0
+        while deadline is None or time.monotonic() < deadline:
+            rows = self.outbox.claim(self.batch_size)
+            if not rows:
+                break
+
+            ok, error = self.send(rows)
+            if ok:
+                self.outbox.mark_delivered([row[0] for row in rows])
+                delivered += len(rows)
+            else:
+                logger.warning(f"Failed to push {len(rows)} updates to {self.target}: {error}")
+                self.outbox.mark_failed(rows, error)
+                break
+
+            if len(rows) < self.batch_size:
+                break
+        return delivered
+
+    def stop(self, timeout=None):
+        """
+        Stop the dispatcher after a final delivery attempt
+
+        Args:
+            timeout (float, optional): Seconds to spend flushing pending rows
+
+        Returns:
+            int: Number of rows delivered while flushing
+        """
+        self._stop.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            self._thread = None
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        return self.dispatch_pending(deadline)
+
+
+_outbox = None
+_dispatcher = None
+_init_lock = threading.Lock()
+
+
+def get_outbox():
+    """Get the process-wide outbox, creating it on first use"""
+    global _outbox
+    if _outbox is None:
+        with _init_lock:
+            if _outbox is None:
+                _outbox = Outbox(OUTBOX_PATH, max_attempts=OUTBOX_MAX_ATTEMPTS)
+    return _outbox
+
+
+def get_dispatcher():
+    """
+    Get this process's outbox dispatcher, starting it on first use
+
+    Returns:
+        OutboxDispatcher: Running dispatcher
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        outbox = get_outbox()
+        with _init_lock:
+            if _dispatcher is None:
+                _dispatcher = OutboxDispatcher(outbox, batch_size=OUTBOX_BATCH_SIZE, linger=OUTBOX_LINGER,
+                                               retention=OUTBOX_RETENTION)
+    # Threads do not survive fork, so (re)start lazily in each worker
+    _dispatcher.start()
+    return _dispatcher
+
+
+def update_order_status(order_id, status, details=None):
+    """
+    Queue a booking status update for Raja Ferry
+
+    Args:
+        order_id (str): Raja Ferry booking / order id
+        status (str): New status, e.g. "paid", "failed"
+        details (dict, optional): Payment details to forward
+
+    Returns:
+        int: Outbox row id, or None when the outbox is disabled
+    """
+    if not OUTBOX_ENABLED:
+        return None
+    dispatcher = get_dispatcher()
+    row_id = dispatcher.outbox.append(order_id, status, details)
+    dispatcher.notify()
+    return row_id
+
+
+def queue_order_status(order_id, status, details=None):
+    """
+    Queue a booking status update without starting a dispatcher here
+
+    For batch jobs: the server workers' dispatchers poll the shared outbox
+    and deliver the update.
+
+    Args:
+        order_id (str): Raja Ferry booking / order id
+        status (str): New status, e.g. "paid", "failed"
+        details (dict, optional): Payment details to forward
+
+    Returns:
+        int: Outbox row id, or None when the outbox is disabled
+    """
+    if not OUTBOX_ENABLED:
+        return None
+    return get_outbox().append(order_id, status, details)
+
+
+def shutdown(timeout=None):
+    """
+    Deliver what is pending and stop this process's dispatcher
+
+    Args:
+        timeout (float, optional): Seconds to spend flushing
+
+    Returns:
+        int: Number of rows delivered while flushing
+    """
+    if _dispatcher is None:
+        return 0
+    return _dispatcher.stop(timeout)
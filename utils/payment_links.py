@@ -0,0 +1,252 @@
+"""
+Bulk Request-to-Pay link creation for group and agent bookings
+
+Bookings are read lazily from CSV or JSONL, signed and sent to the mPAY ONE
+createlink endpoint with bounded parallelism, and results are yielded as
+they complete. At most ``concurrency * 2`` bookings are held in memory at
+any time, whatever the size of the input.
+"""
+
+import csv
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.exceptions import RequestException
+from utils import json_codec
+from utils.signature import generate_signature
+from utils.http_client import make_request
+from utils.pricing import normalize_amount
+from config import (
+    MPAY_ONE_BASE_URL, REQUEST_TO_PAY_ENDPOINT, DEFAULT_MERCHANT_ID,
+    BULK_LINK_CONCURRENCY
+)
+
+logger = logging.getLogger(__name__)
+
+# Booking fields copied into the createlink payload when present
+OPTIONAL_FIELDS = (
+    'description', 'customer_name', 'customer_email', 'customer_phone',
+    'language', 'redirect_url', 'backend_url', 'expire_date',
+    'reference1', 'reference2', 'reference3'
+)
+
+
+class MalformedBooking:
+    """Stands in for an input line that could not be parsed"""
+
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_jsonl(lines):
+    """
+    Parse JSON Lines, skipping blank lines
+
+    A line that is not valid JSON yields a MalformedBooking, so it is
+    reported as INVALID and the rest of the input is still processed.
+
+    Args:
+        lines (iterable): Lines as str or bytes
+
+    Yields:
+        dict: One booking per line
+    """
+    for line in lines:
+        if line.strip():
+            try:
+                yield json_codec.loads(line)
+            except ValueError as e:
+                yield MalformedBooking(f"Malformed JSON line: {e}")
+
+
+def iter_csv(lines):
+    """
+    Parse CSV with a header row, dropping empty values
+
+    Args:
+        lines (iterable): Lines as str
+
+    Yields:
+        dict: One booking per row
+    """
+    for row in csv.DictReader(lines):
+        yield {k: v for k, v in row.items() if k and v not in (None, '')}
+
+
+def read_bookings(path, input_format=None):
+    """
+    Stream bookings from a CSV or JSONL file
+
+    Args:
+        path (str): Input file path
+        input_format (str, optional): "csv" or "jsonl", guessed from the
+            file extension when omitted
+
+    Yields:
+        dict: One booking at a time
+    """
+    if input_format is None:
+        input_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if input_format == 'csv':
+            yield from iter_csv(f)
+        else:
+            yield from iter_jsonl(f)
+
+
+def build_link_payload(booking):
+    """
+    Build the createlink payload for one booking
+
+    Args:
+        booking (dict): Booking with at least order_id (or booking_id) and amount
+
+    Returns:
+        dict: Unsigned payload
+
+    Raises:
+        ValueError: If a required field is missing or invalid
+    """
+    order_id = booking.get('order_id') or booking.get('booking_id')
+    if not order_id:
+        raise ValueError("Missing required field: order_id")
+    if booking.get('amount') in (None, ''):
+        raise ValueError("Missing required field: amount")
+
+    try:
+        amount = normalize_amount(booking['amount'])
+    except ValueError:
+        raise ValueError(f"Invalid amount: {booking['amount']}")
+
+    payload = {
+        'merchant_id': booking.get('merchant_id', DEFAULT_MERCHANT_ID),
+        'order_id': str(order_id),
+        'amount': amount,
+        'currency': booking.get('currency', 'THB'),
+    }
+    for field in OPTIONAL_FIELDS:
+        if booking.get(field):
+            payload[field] = booking[field]
+    payload.setdefault('description', f"Payment for Raja Ferry booking {order_id}")
+
+    return payload
+
+
+def create_payment_link(booking, index=None):
+    """
+    Sign and create a Request-to-Pay link for one booking
+
+    Never raises; failures are reported in the returned record so one bad
+    booking does not stop a bulk run.
+
+    Args:
+        booking (dict): Booking data
+        index (int, optional): Position of the booking in the input
+
+    Returns:
+        dict: Result record with order_id, status and the gateway response
+    """
+    if not isinstance(booking, dict):
+        error = booking.error if isinstance(booking, MalformedBooking) else "Booking must be a JSON object"
+        return {'index': index, 'order_id': None, 'status': 'INVALID', 'error': error}
+
+    result = {'index': index, 'order_id': booking.get('order_id') or booking.get('booking_id')}
+
+    try:
+        payload = build_link_payload(booking)
+        payload['signature'] = generate_signature(payload)
+
+        endpoint = f"{MPAY_ONE_BASE_URL}{REQUEST_TO_PAY_ENDPOINT}"
+        response = make_request('POST', endpoint, payload)
+
+        result['http_status'] = response.status_code
+        try:
+            result['response'] = response.json()
+        except ValueError:
+            result['response'] = response.text
+        result['status'] = 'SUCCESS' if response.ok else 'FAILED'
+
+    except ValueError as e:
+        result['status'] = 'INVALID'
+        result['error'] = str(e)
+    except RequestException as e:
+        result['status'] = 'FAILED'
+        result['error'] = str(e)
+    except Exception as e:
+        logger.exception(f"Unexpected error creating payment link for {result['order_id']}")
+        result['status'] = 'FAILED'
+        result['error'] = str(e)
+
+    return result
+
+
+def create_payment_links(bookings, concurrency=BULK_LINK_CONCURRENCY, create=create_payment_link):
+    """
+    Create payment links for a stream of bookings with bounded parallelism
+
+    Results are yielded in completion order; each carries the ``index`` of
+    its booking in the input.
+
+    Args:
+        bookings (iterable): Booking dicts, consumed lazily
+        concurrency (int, optional): Maximum concurrent gateway calls
+        create (callable, optional): Function creating a single link
+
+    Yields:
+        dict: Result record per booking
+    """
+    max_pending = max(1, concurrency) * 2
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='bulk-link') as executor:
+        pending = set()
+        for index, booking in enumerate(bookings, start=1):
+            pending.add(executor.submit(create, booking, index))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def write_results(results, output):
+    """
+    Write result records to a text stream as JSON Lines
+
+    Args:
+        results (iterable): Result records
+        output: Writable text stream
+
+    Returns:
+        dict: Count of records per status
+    """
+    summary = {}
+    for result in results:
+        output.write(json_codec.dumps(result))
+        output.write('\n')
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    output.flush()
+    return summary
+
+
+def iter_request_bookings(stream, content_type):
+    """
+    Stream bookings from an HTTP request body
+
+    Args:
+        stream: Binary request stream
+        content_type (str): Request mimetype, "text/csv" or JSON Lines
+
+    Yields:
+        dict: One booking at a time
+    """
+    if content_type == 'text/csv':
+        yield from iter_csv(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    else:
+        yield from iter_jsonl(stream)
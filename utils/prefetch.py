@@ -0,0 +1,280 @@
+"""
+Speculative pre-creation of payment artifacts
+
+The payment page asks for a QR code or a seamless card registration as
+soon as the customer picks the method, before they press pay. The
+artifact created at mPAY is kept here,
+keyed by payment method and order id together with a fingerprint of the
+fields it was created for, and the final request reuses it when the
+fingerprint matches. Neither a prefetch racing the submit nor a double
+click creates a second gateway order.
+
+A prefetched artifact has no side effects until a final request commits
+it: no expiry timer, no transaction index entry and no count against the
+velocity rules, which screen the final request instead. Until then the page
+that created it can cancel it with the token returned by the prefetch;
+artifacts nobody commits are dropped when they expire.
+
+The table is shared by all workers. A request that finds the artifact
+being created by another request waits for it instead of creating its own;
+a creation that has not finished within the wait is assumed lost and is
+taken over.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from utils import json_codec
+from utils.sqlite_store import SQLiteStore
+from config import PREFETCH_ENABLED, PREFETCH_DB_PATH, PREFETCH_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Artifact states
+CREATING = 'CREATING'
+READY = 'READY'
+COMMITTED = 'COMMITTED'
+
+# Fields an artifact is created for; any change means a different artifact
+FINGERPRINT_FIELDS = ('merchant_id', 'amount', 'currency')
+
+# A prefetched artifact closer than this to expiry is created again (seconds)
+MIN_REMAINING = 60
+
+# Query parameter marking a speculative request from the payment page
+PREFETCH_PARAM = 'prefetch'
+
+# Polling interval while another request creates the artifact (seconds)
+POLL_INTERVAL = 0.05
+
+
+class ArtifactConflict(Exception):
+    """Raised when a committed artifact exists for different payment details"""
+
+
+def is_prefetch(args):
+    """Whether a request's query arguments mark it as a speculative prefetch"""
+    return args.get(PREFETCH_PARAM, '').lower() in ('1', 'true')
+
+
+def fingerprint(payload):
+    """Return a digest of the fields an artifact is created for"""
+    values = [str(payload.get(field, '')) for field in FINGERPRINT_FIELDS]
+    return hashlib.sha256('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+class Claim:
+    """Result of claiming an artifact
+
+    Either ``response`` holds a stored artifact to reuse, or the caller
+    owns its creation and must call ``complete()`` or ``release()``.
+    """
+
+    def __init__(self, store, key, fingerprint, token=None, state=None, response=None, expires_at=None):
+        self.store = store
+        self.key = key
+        self.fingerprint = fingerprint
+        self.token = token
+        # State of the stored artifact before this claim, None when created anew
+        self.state = state
+        self.response = response
+        self.expires_at = expires_at
+
+    @property
+    def owned(self):
+        return self.token is not None
+
+    def complete(self, response, ttl, commit):
+        """Store the created artifact; returns False if it was canceled meanwhile"""
+        self.expires_at = time.time() + ttl
+        return self.store.complete(self.key, self.token, response, self.expires_at, commit)
+
+    def release(self):
+        """Give up a creation that failed so the next request can retry it"""
+        self.store.release(self.key, self.token)
+
+
+class ArtifactStore(SQLiteStore):
+    """SQLite table of pre-created payment artifacts shared by all workers"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS artifacts (
+            key TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            state TEXT NOT NULL,
+            token TEXT,
+            response TEXT,
+            updated_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS artifacts_expires ON artifacts (expires_at);
+    """
+
+    def __init__(self, path, wait=10.0):
+        super().__init__(path)
+        self.wait = wait
+
+    def claim(self, key, fingerprint, commit, now=None):
+        """
+        Reuse the stored artifact for a key or take over its creation
+
+        Args:
+            key (str): Artifact key, see artifact_key()
+            fingerprint (str): Fingerprint of the requested payment details
+            commit (bool): Whether this is the final request, which commits
+                a prefetched artifact
+            now (float, optional): Current time in seconds since the epoch
+
+        Returns:
+            Claim: Claim holding the artifact, owning its creation, or with
+                state CREATING and neither if another request is creating it
+
+        Raises:
+            ArtifactConflict: If the artifact is committed for other payment details
+        """
+        now = time.time() if now is None else now
+        with self.batch() as conn:
+            row = conn.execute(
+                "SELECT fingerprint, state, response, updated_at, expires_at FROM artifacts WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                stored_fingerprint, state, response, updated_at, expires_at = row
+                if state == COMMITTED and expires_at > now:
+                    if stored_fingerprint != fingerprint:
+                        raise ArtifactConflict(f"{key} was already created for different payment details")
+                    return Claim(self, key, fingerprint, state=state,
+                                 response=json_codec.loads(response), expires_at=expires_at)
+                if stored_fingerprint == fingerprint:
+                    if state == READY and expires_at > now + MIN_REMAINING:
+                        if commit:
+                            conn.execute("UPDATE artifacts SET state = ?, token = NULL, updated_at = ? WHERE key = ?",
+                                         (COMMITTED, now, key))
+                        return Claim(self, key, fingerprint, state=state,
+                                     response=json_codec.loads(response), expires_at=expires_at)
+                    if state == CREATING and now - updated_at < self.wait:
+                        return Claim(self, key, fingerprint, state=state)
+
+            # Nothing reusable: create it, dropping expired artifacts on the way
+            token = uuid.uuid4().hex
+            conn.execute("DELETE FROM artifacts WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, fingerprint, state, token, response, updated_at, expires_at)"
+                " VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (key, fingerprint, CREATING, token, now, now + self.wait)
+            )
+        return Claim(self, key, fingerprint, token=token)
+
+    def complete(self, key, token, response, expires_at, commit):
+        """Store a created artifact if the claim still owns it
+
+        A prefetched artifact keeps the creator's token until it is
+        committed, so only its creator can cancel it.
+        """
+        cursor = self._connection().execute(
+            "UPDATE artifacts SET state = ?, token = ?, response = ?, updated_at = ?, expires_at = ?"
+            " WHERE key = ? AND token = ?",
+            (COMMITTED if commit else READY, None if commit else token, json_codec.dumps(response),
+             time.time(), expires_at, key, token)
+        )
+        return cursor.rowcount == 1
+
+    def committed(self, key, now=None):
+        """Return the response of a committed, unexpired artifact, or None"""
+        now = time.time() if now is None else now
+        row = self._connection().execute(
+            "SELECT response FROM artifacts WHERE key = ? AND state = ? AND expires_at > ?",
+            (key, COMMITTED, now)
+        ).fetchone()
+        return json_codec.loads(row[0]) if row is not None else None
+
+    def release(self, key, token):
+        """Drop an artifact whose creation failed"""
+        self._connection().execute("DELETE FROM artifacts WHERE key = ? AND token = ?", (key, token))
+
+    def cancel(self, key, token):
+        """
+        Discard a prefetched artifact nobody has committed
+
+        Args:
+            key (str): Artifact key
+            token (str): Token the prefetch returned to its creator
+
+        Returns:
+            bool: False if there is no such uncommitted artifact
+        """
+        cursor = self._connection().execute(
+            "DELETE FROM artifacts WHERE key = ? AND token = ? AND state = ?", (key, token, READY)
+        )
+        return cursor.rowcount == 1
+
+    def acquire(self, key, fingerprint, commit):
+        """
+        Claim an artifact, waiting while another request creates it
+
+        Same as claim(), except that the returned claim always either holds
+        the artifact or owns its creation.
+        """
+        while True:
+            claim = self.claim(key, fingerprint, commit)
+            if claim.owned or claim.response is not None:
+                return claim
+            # claim() takes the creation over once the creator's wait has run out
+            time.sleep(POLL_INTERVAL)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """Get the process-wide artifact store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore(PREFETCH_DB_PATH, wait=PREFETCH_WAIT)
+    return _store
+
+
+def artifact_key(payment_method, order_id):
+    """Return the key of an order's artifact for a payment method"""
+    return f"{payment_method}:{order_id}"
+
+
+def claim_artifact(payment_method, payload, commit, required=False):
+    """
+    Claim the artifact of a payment request, see ArtifactStore.acquire()
+
+    Args:
+        payment_method (str): Artifact type, e.g. "QR"
+        payload (dict): Payment request with order_id and the fingerprint fields
+        commit (bool): Whether this is the final request
+        required (bool, optional): Keep the artifact even when prefetching
+            is disabled, for artifacts later requests are checked against
+
+    Returns:
+        Claim: Claim on the artifact, or None when prefetching is disabled
+            and every request creates its own
+
+    Raises:
+        ArtifactConflict: If the order's artifact is committed for other payment details
+    """
+    if not PREFETCH_ENABLED and not required:
+        return None
+    key = artifact_key(payment_method, payload['order_id'])
+    return get_artifact_store().acquire(key, fingerprint(payload), commit)
+
+
+def committed_artifact(payment_method, order_id):
+    """Return the committed artifact of an order, or None if there is none or it expired"""
+    return get_artifact_store().committed(artifact_key(payment_method, order_id))
+
+
+def cancel_artifact(payment_method, order_id, token):
+    """Discard an uncommitted artifact its creator no longer needs; returns False if there is none"""
+    if not PREFETCH_ENABLED:
+        return False
+    return get_artifact_store().cancel(artifact_key(payment_method, order_id), token)
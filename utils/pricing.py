@@ -0,0 +1,239 @@
+"""
+Fare, fee and tax computation in integer satang
+
+All money is handled as integer satang and every rate as an integer number
+of parts per million, so a quote is exact and rounds the same way wherever
+it is computed. Fees and tax are rounded half-up per passenger; booking
+totals are the sum of the passenger lines.
+
+Quotes for many passengers are computed with NumPy int64 arrays when NumPy
+is installed and with plain lists otherwise; both give identical results.
+NumPy is only imported by the first such quote, so processes that never
+price a large booking do not pay for importing it.
+
+Amounts leave this module either as display strings (format_amount) or as
+the JSON number placed in gateway payloads (amount_value), which is what
+the signing code hashes.
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from config import PRICING_SERVICE_FEE_RATE, PRICING_SERVICE_FEE_FIXED, PRICING_VAT_RATE
+
+# Quotes smaller than this are not worth converting to arrays
+VECTORIZE_THRESHOLD = 64
+
+PPM = 1000000
+
+_numpy = None
+
+
+def import_numpy():
+    """
+    Import NumPy on first use
+
+    Returns:
+        module: numpy, or None if it is not installed
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def to_satang(amount):
+    """
+    Convert a THB amount to integer satang, rounding half-up
+
+    Args:
+        amount (float|str|Decimal|int): Amount in baht
+
+    Returns:
+        int: Amount in satang
+
+    Raises:
+        ValueError: If the amount is not a finite number
+    """
+    try:
+        satang = (Decimal(str(amount).strip()) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return int(satang)
+
+
+def format_amount(satang):
+    """
+    Format satang as a baht string with two decimals, e.g. "529.66"
+
+    Args:
+        satang (int): Amount in satang
+
+    Returns:
+        str: Baht amount
+    """
+    sign = '-' if satang < 0 else ''
+    baht, rest = divmod(abs(satang), 100)
+    return f"{sign}{baht}.{rest:02d}"
+
+
+def amount_value(satang):
+    """
+    JSON number for a gateway payload
+
+    The float is the nearest double to the two-decimal amount, so it
+    serializes as that amount without trailing zeros ("529.6", "530.0").
+
+    Args:
+        satang (int): Amount in satang
+
+    Returns:
+        float: Amount in baht
+    """
+    return satang / 100
+
+
+def normalize_amount(amount):
+    """
+    Round an incoming amount to satang before it is signed
+
+    This is the amount validation of every payment and refund path, so
+    amounts that round to zero or below are rejected too.
+
+    Args:
+        amount (float|str|Decimal|int): Amount in baht
+
+    Returns:
+        float: Amount as placed in gateway payloads
+
+    Raises:
+        ValueError: If the amount is not a finite number of at least one satang
+    """
+    satang = to_satang(amount)
+    if satang <= 0:
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return amount_value(satang)
+
+
+def to_ppm(rate):
+    """Convert a rate such as "0.07" to integer parts per million"""
+    return int((Decimal(str(rate)) * PPM).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+class FeeRules:
+    """Service fee and VAT applied to each passenger fare
+
+    The service fee is ``service_fee_rate`` of the fare plus a fixed
+    ``service_fee_fixed`` per passenger; VAT is charged on fare plus fee.
+    """
+
+    def __init__(self, service_fee_rate='0', service_fee_fixed='0', vat_rate='0'):
+        self.service_fee_ppm = to_ppm(service_fee_rate)
+        self.service_fee_fixed = to_satang(service_fee_fixed)
+        self.vat_ppm = to_ppm(vat_rate)
+
+
+def _apply_rate(satang, ppm):
+    # Half-up rounding of satang * ppm / 1e6 for non-negative amounts
+    return (satang * ppm + PPM // 2) // PPM
+
+
+def _sum(values):
+    if isinstance(values, list):
+        return sum(values)
+    # NumPy array
+    return int(values.sum())
+
+
+class Quote:
+    """Per-passenger lines and booking totals of a priced booking"""
+
+    def __init__(self, fares, fees, taxes, totals):
+        self.fares = fares
+        self.fees = fees
+        self.taxes = taxes
+        self.totals = totals
+        self.fare = _sum(fares)
+        self.service_fee = _sum(fees)
+        self.tax = _sum(taxes)
+        self.total = _sum(totals)
+
+    def __len__(self):
+        return len(self.fares)
+
+    def line(self, index):
+        """Return one passenger's line as display strings"""
+        return {
+            'fare': format_amount(int(self.fares[index])),
+            'service_fee': format_amount(int(self.fees[index])),
+            'tax': format_amount(int(self.taxes[index])),
+            'total': format_amount(int(self.totals[index])),
+        }
+
+    def summary(self):
+        """Return booking totals as display strings"""
+        return {
+            'passengers': len(self),
+            'fare': format_amount(self.fare),
+            'service_fee': format_amount(self.service_fee),
+            'tax': format_amount(self.tax),
+            'total': format_amount(self.total),
+        }
+
+
+def quote(fares, rules=None):
+    """
+    Price a booking
+
+    Args:
+        fares (list): Fare of each passenger in baht (str, Decimal or float)
+        rules (FeeRules, optional): Fee rules, defaults to the configured ones
+
+    Returns:
+        Quote: Priced booking
+
+    Raises:
+        ValueError: If a fare is not a finite number or is negative, which
+            the half-up rounding of fees and tax does not handle
+    """
+    satang = [to_satang(fare) for fare in fares]
+    if any(fare < 0 for fare in satang):
+        raise ValueError(f"Invalid fare in {fares!r}")
+    return quote_satang(satang, rules)
+
+
+def quote_satang(fares, rules=None):
+    """
+    Price a booking whose fares are already in satang
+
+    Args:
+        fares (list|numpy.ndarray): Fare of each passenger in satang
+        rules (FeeRules, optional): Fee rules, defaults to the configured ones
+
+    Returns:
+        Quote: Priced booking
+    """
+    if rules is None:
+        rules = default_rules
+
+    np = import_numpy() if len(fares) >= VECTORIZE_THRESHOLD else None
+    if np is not None:
+        fares = np.asarray(fares, dtype=np.int64)
+        fees = _apply_rate(fares, rules.service_fee_ppm) + rules.service_fee_fixed
+        taxes = _apply_rate(fares + fees, rules.vat_ppm)
+        return Quote(fares, fees, taxes, fares + fees + taxes)
+
+    fees = [_apply_rate(fare, rules.service_fee_ppm) + rules.service_fee_fixed for fare in fares]
+    taxes = [_apply_rate(fare + fee, rules.vat_ppm) for fare, fee in zip(fares, fees)]
+    totals = [fare + fee + tax for fare, fee, tax in zip(fares, fees, taxes)]
+    return Quote(list(fares), fees, taxes, totals)
+
+
+# Fee rules from the configuration
+default_rules = FeeRules(
+    service_fee_rate=PRICING_SERVICE_FEE_RATE,
+    service_fee_fixed=PRICING_SERVICE_FEE_FIXED,
+    vat_rate=PRICING_VAT_RATE
+)
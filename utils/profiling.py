@@ -0,0 +1,279 @@
+"""
+On-demand profiling for the Flask process
+
+RequestProfiler captures a cProfile/pstats dump for individual requests,
+triggered either by a signed X-Profile-Signature header or by an admin
+toggle that profiles the next N matching requests. SamplingProfiler is a
+background thread that samples every thread's stack and writes
+collapsed-stack files for flamegraph tools.
+
+Neither costs anything beyond a flag check while idle: no profiler hooks
+are installed and no sampling thread runs until profiling is requested.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from config import PROFILE_DIR, PROFILING_SECRET, PROFILING_SAMPLE_INTERVAL, PROFILING_MAX_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Header carrying "<unix timestamp>:<hex HMAC-SHA256>" over "<timestamp>:<path>"
+PROFILE_HEADER = 'X-Profile-Signature'
+
+
+def sign_profile_request(secret, path, timestamp=None):
+    """
+    Build an X-Profile-Signature header value for a request path
+
+    Args:
+        secret (str): Profiling secret shared with the operator
+        path (str): Request path to profile, e.g. "/process-payment"
+        timestamp (int, optional): Unix timestamp, defaults to now
+
+    Returns:
+        str: Header value
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    digest = hmac.new(secret.encode('utf-8'), f"{timestamp}:{path}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+class RequestProfiler:
+    """Profile individual requests with cProfile"""
+
+    def __init__(self, output_dir, secret=None, max_age=300):
+        self.output_dir = output_dir
+        self.secret = secret
+        self.max_age = max_age
+
+        self._remaining = 0
+        self._path_prefix = None
+        self._lock = threading.Lock()
+
+    def enable(self, count=1, path_prefix=None):
+        """
+        Profile the next ``count`` requests matching ``path_prefix``
+
+        Args:
+            count (int, optional): Number of requests to profile
+            path_prefix (str, optional): Only profile paths with this prefix
+        """
+        with self._lock:
+            self._remaining = count
+            self._path_prefix = path_prefix
+
+    def disable(self):
+        """Cancel any pending admin toggle"""
+        with self._lock:
+            self._remaining = 0
+
+    def _verify_header(self, value, path):
+        if not self.secret or not value:
+            return False
+        timestamp, _, _ = value.partition(':')
+        try:
+            if abs(time.time() - int(timestamp)) > self.max_age:
+                return False
+        except ValueError:
+            return False
+        expected = sign_profile_request(self.secret, path, int(timestamp))
+        return hmac.compare_digest(expected, value)
+
+    def should_profile(self, path, header_value=None):
+        """
+        Decide whether a request should be profiled
+
+        Args:
+            path (str): Request path
+            header_value (str, optional): X-Profile-Signature header
+
+        Returns:
+            bool: True if the request should be profiled
+        """
+        if header_value is not None and self._verify_header(header_value, path):
+            return True
+
+        # Fast path while no admin toggle is armed
+        if not self._remaining:
+            return False
+
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            if self._path_prefix and not path.startswith(self._path_prefix):
+                return False
+            self._remaining -= 1
+            return True
+
+    def start(self):
+        """Start a profiler for the current request"""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler, method, path):
+        """
+        Stop a request profiler and write its stats
+
+        Args:
+            profiler (cProfile.Profile): Profiler returned by start()
+            method (str): HTTP method
+            path (str): Request path
+
+        Returns:
+            str: Path of the .pstats file
+        """
+        profiler.disable()
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = path.strip('/').replace('/', '_') or 'root'
+        filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{method}-{slug}.pstats"
+        output = os.path.join(self.output_dir, filename)
+        profiler.dump_stats(output)
+        logger.info(f"Wrote request profile {output}")
+        return output
+
+    def status(self):
+        """Return the admin toggle state"""
+        return {
+            'remaining': self._remaining,
+            'path_prefix': self._path_prefix,
+            'signed_header': bool(self.secret),
+        }
+
+
+class SamplingProfiler:
+    """Low-overhead statistical profiler writing collapsed stacks
+
+    A daemon thread periodically reads every thread's current frame and
+    counts the collapsed stacks. The sampling interval is stretched
+    whenever sampling itself takes more than ``max_overhead`` of wall time,
+    and sampling stops on its own after ``max_duration`` seconds.
+    """
+
+    def __init__(self, output_dir, interval=0.01, max_overhead=0.02, max_duration=300):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.max_duration = max_duration
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = Counter()
+        self._samples = 0
+        self._started = None
+        self._effective_interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None, duration=None):
+        """
+        Start sampling in the background
+
+        Args:
+            interval (float, optional): Seconds between samples
+            duration (float, optional): Stop automatically after this many seconds
+
+        Returns:
+            bool: False if the profiler was already running
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._samples = 0
+            self._effective_interval = interval or self.interval
+            self._started = time.monotonic()
+            self._stop.clear()
+            deadline = self._started + min(duration or self.max_duration, self.max_duration)
+            self._thread = threading.Thread(
+                target=self._run, args=(deadline,), name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """
+        Stop sampling and write the collapsed stacks
+
+        Returns:
+            str: Path of the .folded file, or None if nothing was sampled
+        """
+        thread = self._thread
+        if thread is None:
+            return None
+        self._stop.set()
+        thread.join()
+        self._thread = None
+        return self.dump()
+
+    def _run(self, deadline):
+        own_ident = threading.get_ident()
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            sample_started = time.perf_counter()
+            self._sample(own_ident)
+            cost = time.perf_counter() - sample_started
+
+            # Keep sampling cost under max_overhead of wall time
+            if cost > self._effective_interval * self.max_overhead:
+                self._effective_interval = cost / self.max_overhead
+
+            self._stop.wait(self._effective_interval)
+
+    def _sample(self, own_ident):
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+        self._samples += 1
+
+    def dump(self):
+        """
+        Write the current collapsed stacks without stopping
+
+        Returns:
+            str: Path of the .folded file, or None if nothing was sampled
+        """
+        stacks = dict(self._stacks)
+        if not stacks:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        output = os.path.join(self.output_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.folded")
+        with open(output, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote sampling profile {output} ({self._samples} samples)")
+        return output
+
+    def status(self):
+        """Return the sampler state"""
+        return {
+            'running': self.running,
+            'samples': self._samples,
+            'interval': self._effective_interval,
+            'elapsed': time.monotonic() - self._started if self._started and self.running else 0,
+        }
+
+
+# Process-wide profilers used by the app hooks and the admin API
+request_profiler = RequestProfiler(PROFILE_DIR, secret=PROFILING_SECRET)
+sampling_profiler = SamplingProfiler(
+    PROFILE_DIR,
+    interval=PROFILING_SAMPLE_INTERVAL,
+    max_duration=PROFILING_MAX_DURATION
+)
@@ -0,0 +1,386 @@
+"""
+Rate limiting and admission control
+
+Token buckets keyed by merchant, client IP and endpoint protect the workers
+and our mPAY quota from a single misbehaving integration. Buckets live in
+process memory or in a shared SQLite file so the limits hold across
+gunicorn workers. AdaptiveConcurrencyLimiter caps outbound mPAY calls and
+sheds load when upstream latency rises.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils.sqlite_store import SQLiteStore
+from config import (
+    RATE_LIMIT_BACKEND, RATE_LIMIT_SQLITE_PATH, RATE_LIMIT_MERCHANT,
+    RATE_LIMIT_CLIENT, RATE_LIMIT_ENDPOINT
+)
+
+
+def parse_limit(spec):
+    """
+    Parse a "<requests>/<seconds>" limit specification
+
+    Args:
+        spec (str): Limit specification, e.g. "30/60"
+
+    Returns:
+        tuple: (rate in tokens per second, bucket capacity) or None if disabled
+
+    Raises:
+        ValueError: If the specification is malformed or not positive
+    """
+    if not spec or spec.strip() in ('0', 'off', 'none'):
+        return None
+    requests_part, _, seconds_part = spec.partition('/')
+    capacity = float(requests_part)
+    seconds = float(seconds_part or 1)
+    # A zero bucket would never refill; "0", "off" or "none" disable a limit
+    if not (capacity > 0 and seconds > 0):
+        raise ValueError(f"Invalid limit: {spec}")
+    return capacity / seconds, capacity
+
+
+def _refill(tokens, updated, rate, capacity, now):
+    """Return the bucket level at ``now`` after refilling since ``updated``"""
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBackend:
+    """Token bucket storage in process memory
+
+    The number of tracked buckets is bounded; the least recently used
+    bucket is evicted first, which at worst grants that key a fresh burst.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, cost=1.0, now=None):
+        """
+        Take tokens from a bucket
+
+        Args:
+            key (str): Bucket key
+            rate (float): Refill rate in tokens per second
+            capacity (float): Maximum number of tokens
+            cost (float, optional): Tokens to take
+            now (float, optional): Current time, defaults to time.monotonic()
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        return self.consume_all([(key, rate, capacity)], cost, now)
+
+    def consume_all(self, buckets, cost=1.0, now=None):
+        """
+        Take tokens from several buckets, or from none of them
+
+        Args:
+            buckets (list): (key, rate, capacity) tuples
+            cost (float, optional): Tokens to take from each bucket
+            now (float, optional): Current time, defaults to time.monotonic()
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            levels = []
+            for key, rate, capacity in buckets:
+                state = self._buckets.get(key)
+                if state is None:
+                    tokens = capacity
+                else:
+                    tokens = _refill(state[0], state[1], rate, capacity, now)
+                levels.append(tokens)
+
+            retry_after = max(
+                ((cost - tokens) / rate for tokens, (_, rate, _) in zip(levels, buckets) if tokens < cost),
+                default=0.0
+            )
+            allowed = not retry_after
+
+            for tokens, (key, _, _) in zip(levels, buckets):
+                if key in self._buckets:
+                    self._buckets.move_to_end(key)
+                elif len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+                self._buckets[key] = (tokens - cost if allowed else tokens, now)
+
+            return allowed, retry_after
+
+
+class SQLiteBackend(SQLiteStore):
+    """Token bucket storage shared between processes through SQLite
+
+    Each worker opens its own connection; updates run inside an immediate
+    transaction so concurrent workers see a consistent bucket level.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+    """
+
+    # Requests wait on this, so give up on the lock sooner
+    timeout = 5
+
+    def __init__(self, path, purge_interval=300):
+        super().__init__(path)
+        # Idle buckets are purged from the request path every few minutes
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    def consume(self, key, rate, capacity, cost=1.0, now=None):
+        """
+        Take tokens from a bucket
+
+        Args:
+            key (str): Bucket key
+            rate (float): Refill rate in tokens per second
+            capacity (float): Maximum number of tokens
+            cost (float, optional): Tokens to take
+            now (float, optional): Current time, defaults to time.time()
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        return self.consume_all([(key, rate, capacity)], cost, now)
+
+    def consume_all(self, buckets, cost=1.0, now=None):
+        """
+        Take tokens from several buckets in one transaction, or from none of them
+
+        Args:
+            buckets (list): (key, rate, capacity) tuples
+            cost (float, optional): Tokens to take from each bucket
+            now (float, optional): Current time, defaults to time.time()
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        # Wall clock time, monotonic clocks are not comparable across processes
+        if now is None:
+            now = time.time()
+
+        with self.batch() as conn:
+            levels = []
+            for key, rate, capacity in buckets:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                levels.append(capacity if row is None else _refill(row[0], row[1], rate, capacity, now))
+
+            retry_after = max(
+                ((cost - tokens) / rate for tokens, (_, rate, _) in zip(levels, buckets) if tokens < cost),
+                default=0.0
+            )
+            allowed = not retry_after
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, tokens - cost if allowed else tokens, now) for tokens, (key, _, _) in zip(levels, buckets)]
+            )
+
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            self.purge(now=now)
+
+        return allowed, retry_after
+
+    def purge(self, max_idle=3600, now=None):
+        """Delete buckets that have not been touched for ``max_idle`` seconds
+
+        A missing bucket starts full, so dropping one that has had time to
+        refill completely does not change any limit.
+        """
+        if now is None:
+            now = time.time()
+        self._connection().execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - max_idle,))
+
+
+class RateLimiter:
+    """Apply token bucket limits per merchant, client IP and endpoint"""
+
+    def __init__(self, backend, merchant_limit=None, client_limit=None, endpoint_limit=None):
+        self.backend = backend
+        self.rules = [
+            (scope, limit) for scope, limit in (
+                ('merchant', merchant_limit),
+                ('client', client_limit),
+                ('endpoint', endpoint_limit),
+            ) if limit is not None
+        ]
+
+    def check(self, merchant_id=None, client_ip=None, endpoint=None):
+        """
+        Check and consume one request against every configured limit
+
+        Args:
+            merchant_id (str, optional): Merchant making the request
+            client_ip (str, optional): Remote address of the client
+            endpoint (str, optional): Request path
+
+        Returns:
+            float: Seconds until the request may be retried, or 0 if allowed
+        """
+        identities = {
+            'merchant': merchant_id,
+            'client': client_ip,
+            'endpoint': endpoint,
+        }
+
+        buckets = []
+        for scope, (rate, capacity) in self.rules:
+            identity = identities[scope]
+            if not identity:
+                continue
+            # Client buckets are per endpoint so a burst on one page does
+            # not lock the same client out of the others
+            key = f"{scope}:{identity}:{endpoint}" if scope == 'client' else f"{scope}:{identity}"
+            buckets.append((key, rate, capacity))
+        if not buckets:
+            return 0.0
+
+        # Tokens are only taken when every limit allows the request, so a
+        # request refused by one limit does not use up the others
+        allowed, retry_after = self.backend.consume_all(buckets)
+        return 0.0 if allowed else retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """Cap concurrent upstream calls and adapt the cap to observed latency
+
+    The limit grows additively while latency stays close to the best
+    latency seen recently and shrinks multiplicatively once it rises above
+    ``tolerance`` times that baseline. Calls beyond the limit are rejected
+    immediately instead of queueing behind a slow upstream.
+    """
+
+    def __init__(self, initial_limit=20, min_limit=2, max_limit=200,
+                 tolerance=2.0, backoff=0.9, smoothing=0.2, baseline_window=60.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.baseline_window = baseline_window
+
+        self.in_flight = 0
+        self.shed_count = 0
+        self.latency = None
+        self._baseline = None
+        self._baseline_reset = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Reserve a slot, returning False if the limit is reached"""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.shed_count += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, failed=False):
+        """
+        Release a slot and feed the observed latency into the limit
+
+        Args:
+            latency (float): Duration of the call in seconds
+            failed (bool, optional): Whether the call timed out or errored
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+
+            # The baseline is the best latency seen in the current window,
+            # reset periodically so it can follow a permanently slower upstream
+            if now - self._baseline_reset > self.baseline_window:
+                self._baseline = None
+                self._baseline_reset = now
+            if self._baseline is None or latency < self._baseline:
+                self._baseline = latency
+
+            if failed or self.latency > self._baseline * self.tolerance:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    @contextmanager
+    def slot(self):
+        """
+        Context manager guarding one upstream call
+
+        Raises:
+            UpstreamOverloadedError: If the call is shed
+        """
+        if not self.try_acquire():
+            # Defined with the HTTP client so rate limiting does not import requests
+            from utils.http_client import UpstreamOverloadedError
+            raise UpstreamOverloadedError(
+                f"Upstream concurrency limit reached ({int(self.limit)} in flight)"
+            )
+
+        started = time.monotonic()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(time.monotonic() - started, failed)
+
+    def stats(self):
+        """Return a snapshot of the limiter state"""
+        with self._lock:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'latency': self.latency,
+                'baseline': self._baseline,
+                'shed': self.shed_count,
+            }
+
+
+def retry_after_header(retry_after):
+    """Format a delay in seconds as a Retry-After header value"""
+    return str(max(1, math.ceil(retry_after)))
+
+
+def create_rate_limiter():
+    """
+    Build the request rate limiter from configuration
+
+    Returns:
+        RateLimiter: Limiter using the configured backend
+    """
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        backend = SQLiteBackend(RATE_LIMIT_SQLITE_PATH)
+    else:
+        backend = MemoryBackend()
+
+    return RateLimiter(
+        backend,
+        merchant_limit=parse_limit(RATE_LIMIT_MERCHANT),
+        client_limit=parse_limit(RATE_LIMIT_CLIENT),
+        endpoint_limit=parse_limit(RATE_LIMIT_ENDPOINT)
+    )
@@ -0,0 +1,219 @@
+"""
+Webhook replay protection
+
+A correctly signed webhook stays valid forever, so a captured notification
+could be replayed. ReplayGuard rejects notifications whose transaction_time
+is missing or falls outside a freshness window and remembers the
+(order_id, payment_id, status) of every accepted notification for that
+window plus the allowed clock skew, so each one is processed at most once.
+
+Remembered notifications live in a SQLite file shared by every worker, so a
+replay is caught whichever worker it reaches. Expired entries are purged
+periodically from the request path.
+"""
+
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from utils import json_codec
+from utils.sqlite_store import SQLiteStore
+from config import WEBHOOK_REPLAY_WINDOW, WEBHOOK_MAX_CLOCK_SKEW, WEBHOOK_REPLAY_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# mPAY ONE reports times in Thailand local time
+DEFAULT_TIMEZONE = datetime.timezone(datetime.timedelta(hours=7))
+
+# Rejections caused by transaction_time rather than an earlier delivery
+TIME_REJECTIONS = ('stale', 'future', 'invalid_time')
+
+
+def parse_transaction_time(value):
+    """
+    Parse an ISO 8601 transaction_time into a POSIX timestamp
+
+    Args:
+        value (str): Timestamp such as "2024-01-01T12:00:00+07:00"
+
+    Returns:
+        float: Seconds since the epoch, or None if the value cannot be parsed
+    """
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=DEFAULT_TIMEZONE)
+    return parsed.timestamp()
+
+
+class ReplayGuard(SQLiteStore):
+    """Freshness window plus a shared store of recently seen notifications"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS webhook_seen (
+            key TEXT PRIMARY KEY,
+            seen REAL NOT NULL
+        );
+    """
+
+    # Checked while mPAY waits for the acknowledgement, so do not queue long behind a writer
+    timeout = 5
+
+    def __init__(self, path, window_seconds=21600, max_skew_seconds=300, purge_interval=300):
+        super().__init__(path)
+        self.window_seconds = window_seconds
+        self.max_skew_seconds = max_skew_seconds
+        self.purge_interval = purge_interval
+        # A notification dated up to max_skew_seconds ahead stays fresh that
+        # much longer, so it must be remembered that much longer too
+        self.retention_seconds = window_seconds + max_skew_seconds
+
+        self._next_purge = 0.0
+        # Counters are per process
+        self._lock = threading.Lock()
+        self.counters = {
+            'accepted': 0,
+            'duplicate': 0,
+            'stale': 0,
+            'future': 0,
+            'invalid_time': 0,
+        }
+
+    @staticmethod
+    def notification_key(data):
+        """Identify a notification by order, payment and status"""
+        return json_codec.dumps([data.get('order_id'), data.get('payment_id'), data.get('status')])
+
+    def _count(self, reason):
+        with self._lock:
+            self.counters[reason] += 1
+
+    def check_time(self, data, now=None):
+        """
+        Check the freshness of a webhook payload
+
+        Args:
+            data (dict): Webhook payload
+            now (float, optional): Current time, defaults to time.time()
+
+        Returns:
+            str: Rejection reason ("stale", "future", "invalid_time") or None
+        """
+        if now is None:
+            now = time.time()
+
+        # A missing transaction_time is rejected too, or dropping the field
+        # would bypass the window
+        timestamp = parse_transaction_time(data.get('transaction_time'))
+        if timestamp is None:
+            reason = 'invalid_time'
+        elif timestamp < now - self.window_seconds:
+            reason = 'stale'
+        elif timestamp > now + self.max_skew_seconds:
+            reason = 'future'
+        else:
+            return None
+
+        self._count(reason)
+        return reason
+
+    def check(self, data, now=None):
+        """
+        Cheap pre-verification check of a webhook payload
+
+        Args:
+            data (dict): Webhook payload
+            now (float, optional): Current time, defaults to time.time()
+
+        Returns:
+            str: Rejection reason ("stale", "future", "invalid_time",
+                 "duplicate") or None if the payload may be processed
+        """
+        if now is None:
+            now = time.time()
+
+        reason = self.check_time(data, now)
+        if reason is not None:
+            return reason
+
+        row = self._connection().execute(
+            "SELECT 1 FROM webhook_seen WHERE key = ? AND seen >= ?",
+            (self.notification_key(data), now - self.retention_seconds)
+        ).fetchone()
+        if row is None:
+            return None
+        self._count('duplicate')
+        return 'duplicate'
+
+    def mark_seen(self, data, now=None):
+        """
+        Record a verified notification
+
+        Must be called after the signature has been verified so forged
+        payloads cannot poison the filter.
+
+        Args:
+            data (dict): Webhook payload
+            now (float, optional): Current time, defaults to time.time()
+
+        Returns:
+            bool: False if the notification was recorded concurrently by
+                  another request and should be treated as a duplicate
+        """
+        if now is None:
+            now = time.time()
+
+        # One statement, so two workers racing on the same notification
+        # cannot both record it; an entry past its retention is reused
+        cursor = self._connection().execute(
+            "INSERT INTO webhook_seen (key, seen) VALUES (?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET seen = excluded.seen WHERE seen < ?",
+            (self.notification_key(data), now, now - self.retention_seconds)
+        )
+        recorded = cursor.rowcount == 1
+
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            self.purge(now)
+
+        self._count('accepted' if recorded else 'duplicate')
+        return recorded
+
+    def purge(self, now=None):
+        """Forget notifications that can no longer pass the freshness window"""
+        if now is None:
+            now = time.time()
+        try:
+            self._connection().execute("DELETE FROM webhook_seen WHERE seen < ?", (now - self.retention_seconds,))
+        except sqlite3.Error:
+            logger.exception("Failed to purge webhook replay store")
+
+    def stats(self):
+        """Return this process's rejection counters and the number of remembered keys"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['tracked'] = self._connection().execute(
+            "SELECT COUNT(*) FROM webhook_seen WHERE seen >= ?", (time.time() - self.retention_seconds,)
+        ).fetchone()[0]
+        return stats
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_replay_guard():
+    """Get the process-wide replay guard, creating it on first use"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = ReplayGuard(
+                    WEBHOOK_REPLAY_DB_PATH,
+                    window_seconds=WEBHOOK_REPLAY_WINDOW,
+                    max_skew_seconds=WEBHOOK_MAX_CLOCK_SKEW
+                )
+    return _guard
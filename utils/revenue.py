@@ -0,0 +1,499 @@
+"""
+Incremental revenue rollups per payment method, merchant and route
+
+Every successful payment and every refund adds to hourly and daily buckets
+keyed by (payment_method, merchant_id, route), stored in SQLite so all
+workers share them. Each bucket holds counts and sums in satang, so a
+dashboard query reads one primary-key range per bucket instead of scanning
+payments.
+
+Webhooks do not carry the route, so checkouts register it per order and
+the webhook picks it up from there. Backfills rebuild the buckets from the
+payment event log with vectorized NumPy aggregation when NumPy is
+installed, and with a pure Python loop otherwise.
+"""
+
+import logging
+import threading
+import time
+from decimal import Decimal
+from utils.sqlite_store import SQLiteStore
+from utils.event_log import KIND_REQUEST, KIND_RESPONSE, KIND_WEBHOOK
+from utils.pricing import to_satang, import_numpy
+from config import REVENUE_ENABLED, REVENUE_DB_PATH, REVENUE_UTC_OFFSET
+
+logger = logging.getLogger(__name__)
+
+# Bucket sizes in seconds
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+
+# Dimensions rollups are keyed and can be grouped by
+DIMENSIONS = ('payment_method', 'merchant_id', 'route')
+
+# Summed measures of each bucket
+MEASURES = ('payments', 'amount', 'refunds', 'refund_amount')
+
+
+def from_satang(satang):
+    """Convert integer satang back to a Decimal baht amount"""
+    return (Decimal(satang) / 100).quantize(Decimal('0.01'))
+
+
+class RevenueRollup(SQLiteStore):
+    """Time-bucketed revenue aggregates shared between workers"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS revenue_rollup (
+            granularity TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            payment_method TEXT NOT NULL,
+            merchant_id TEXT NOT NULL,
+            route TEXT NOT NULL,
+            payments INTEGER NOT NULL DEFAULT 0,
+            amount INTEGER NOT NULL DEFAULT 0,
+            refunds INTEGER NOT NULL DEFAULT 0,
+            refund_amount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket, payment_method, merchant_id, route)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS revenue_orders (
+            order_id TEXT PRIMARY KEY,
+            payment_method TEXT,
+            merchant_id TEXT,
+            route TEXT,
+            amount INTEGER,
+            paid_at REAL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, utc_offset=0):
+        super().__init__(path)
+        self.utc_offset = utc_offset
+
+    def bucket_start(self, timestamp, granularity):
+        """
+        Start of the bucket containing ``timestamp``
+
+        Day buckets start at local midnight according to ``utc_offset``.
+
+        Args:
+            timestamp (float): Seconds since the epoch
+            granularity (str): "hour" or "day"
+
+        Returns:
+            int: Bucket start in seconds since the epoch
+        """
+        size = GRANULARITIES[granularity]
+        return int((timestamp + self.utc_offset) // size * size - self.utc_offset)
+
+    def register_order(self, order_id, merchant_id=None, payment_method=None, route=None):
+        """
+        Remember the dimensions of an order before it is paid
+
+        Args:
+            order_id (str): Order / booking id
+            merchant_id (str, optional): Merchant id
+            payment_method (str, optional): Payment method chosen at checkout
+            route (str, optional): Ferry route, e.g. "Donsak - Samui"
+        """
+        self._connection().execute(
+            """
+            INSERT INTO revenue_orders (order_id, merchant_id, payment_method, route) VALUES (?, ?, ?, ?)
+            ON CONFLICT (order_id) DO UPDATE SET
+                merchant_id = COALESCE(excluded.merchant_id, merchant_id),
+                payment_method = COALESCE(excluded.payment_method, payment_method),
+                route = COALESCE(excluded.route, route)
+            """,
+            (order_id, merchant_id, payment_method, route)
+        )
+
+    def _add(self, conn, dims, timestamp, values):
+        for granularity in GRANULARITIES:
+            self._add_bucket(conn, granularity, (self.bucket_start(timestamp, granularity),) + dims + values)
+
+    def record_payment(self, order_id, amount, payment_method=None, merchant_id=None, timestamp=None):
+        """
+        Add a successful payment to its buckets
+
+        A payment is counted once per order, however many workers receive
+        its webhook.
+
+        Args:
+            order_id (str): Order / booking id
+            amount (float|str|Decimal): Paid amount in baht
+            payment_method (str, optional): Payment method from the webhook
+            merchant_id (str, optional): Merchant id
+            timestamp (float, optional): Payment time, defaults to now
+
+        Returns:
+            bool: False if the order was already counted
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        satang = to_satang(amount)
+
+        with self.batch() as conn:
+            row = conn.execute(
+                "SELECT payment_method, merchant_id, route, paid_at FROM revenue_orders WHERE order_id = ?",
+                (order_id,)
+            ).fetchone()
+            if row is not None and row[3] is not None:
+                return False
+
+            known_method, known_merchant, route = row[:3] if row else (None, None, None)
+            dims = (payment_method or known_method or '', merchant_id or known_merchant or '', route or '')
+            conn.execute(
+                """
+                INSERT INTO revenue_orders (order_id, payment_method, merchant_id, route, amount, paid_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (order_id) DO UPDATE SET
+                    payment_method = excluded.payment_method,
+                    merchant_id = excluded.merchant_id,
+                    amount = excluded.amount,
+                    paid_at = excluded.paid_at
+                """,
+                (order_id,) + dims + (satang, timestamp)
+            )
+            self._add(conn, dims, timestamp, (1, satang, 0, 0))
+        return True
+
+    def record_refund(self, order_id, amount=None, merchant_id=None, timestamp=None):
+        """
+        Add a refund or void to the buckets of the refund time
+
+        Args:
+            order_id (str): Order / booking id
+            amount (float|str|Decimal, optional): Refunded amount, defaults
+                to the full paid amount (void)
+            merchant_id (str, optional): Merchant id, used if the order is unknown
+            timestamp (float, optional): Refund time, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self.batch() as conn:
+            row = conn.execute(
+                "SELECT payment_method, merchant_id, route, amount FROM revenue_orders WHERE order_id = ?",
+                (order_id,)
+            ).fetchone() or (None, None, None, None)
+            satang = to_satang(amount) if amount is not None else (row[3] or 0)
+            dims = (row[0] or '', row[1] or merchant_id or '', row[2] or '')
+            self._add(conn, dims, timestamp, (0, 0, 1, satang))
+
+    def query(self, granularity, start, end, group_by=DIMENSIONS, **filters):
+        """
+        Read aggregates for the buckets in [start, end)
+
+        Args:
+            granularity (str): "hour" or "day"
+            start (float): Range start in seconds since the epoch
+            end (float): Range end in seconds since the epoch
+            group_by (tuple, optional): Dimensions to keep; others are summed
+            **filters: Exact matches on payment_method, merchant_id or route
+
+        Returns:
+            list: One dict per bucket and group, ordered by bucket
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        group_by = [dim for dim in DIMENSIONS if dim in group_by]
+        conditions = ["granularity = ?", "bucket >= ?", "bucket < ?"]
+        params = [granularity, self.bucket_start(start, granularity), end]
+        for dim in DIMENSIONS:
+            if filters.get(dim) is not None:
+                conditions.append(f"{dim} = ?")
+                params.append(filters[dim])
+
+        columns = ', '.join(['bucket'] + group_by)
+        rows = self._connection().execute(
+            f"SELECT {columns}, SUM(payments), SUM(amount), SUM(refunds), SUM(refund_amount)"
+            f" FROM revenue_rollup WHERE {' AND '.join(conditions)}"
+            f" GROUP BY {columns} ORDER BY {columns}",
+            params
+        ).fetchall()
+
+        results = []
+        for row in rows:
+            payments, amount, refunds, refund_amount = row[-4:]
+            result = {'bucket': row[0]}
+            result.update(zip(group_by, row[1:-4]))
+            result.update({
+                'payments': payments,
+                'amount': from_satang(amount),
+                'refunds': refunds,
+                'refund_amount': from_satang(refund_amount),
+                'net_amount': from_satang(amount - refund_amount),
+            })
+            results.append(result)
+        return results
+
+    def load(self, rows, granularity, replace=True):
+        """
+        Write aggregated backfill rows
+
+        Args:
+            rows (list): (bucket, payment_method, merchant_id, route, payments,
+                amount, refunds, refund_amount) tuples
+            granularity (str): Granularity of the rows
+            replace (bool, optional): Replace the covered buckets instead of
+                adding to them
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        with self.batch() as conn:
+            if replace:
+                buckets = [row[0] for row in rows]
+                conn.execute(
+                    "DELETE FROM revenue_rollup WHERE granularity = ? AND bucket >= ? AND bucket <= ?",
+                    (granularity, min(buckets), max(buckets))
+                )
+            for row in rows:
+                self._add_bucket(conn, granularity, row)
+
+    def _add_bucket(self, conn, granularity, row):
+        conn.execute(
+            """
+            INSERT INTO revenue_rollup
+                (granularity, bucket, payment_method, merchant_id, route, payments, amount, refunds, refund_amount)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (granularity, bucket, payment_method, merchant_id, route) DO UPDATE SET
+                payments = payments + excluded.payments,
+                amount = amount + excluded.amount,
+                refunds = refunds + excluded.refunds,
+                refund_amount = refund_amount + excluded.refund_amount
+            """,
+            (granularity,) + tuple(row)
+        )
+
+
+class RevenueColumns:
+    """Columnar buffer of payments and refunds for backfill aggregation
+
+    Dimension values are dictionary-encoded to small integer codes so the
+    group-by key of a row is a few integers.
+    """
+
+    def __init__(self):
+        self.timestamps = []
+        self.codes = {dim: [] for dim in DIMENSIONS}
+        self.values = {measure: [] for measure in MEASURES}
+        self.dictionaries = {dim: {} for dim in DIMENSIONS}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, dims, payments=0, amount=0, refunds=0, refund_amount=0):
+        self.timestamps.append(timestamp)
+        for dim, value in zip(DIMENSIONS, dims):
+            dictionary = self.dictionaries[dim]
+            self.codes[dim].append(dictionary.setdefault(value, len(dictionary)))
+        for measure, value in zip(MEASURES, (payments, amount, refunds, refund_amount)):
+            self.values[measure].append(value)
+
+    def aggregate(self, granularity, utc_offset=0):
+        """
+        Sum the measures per bucket and dimension combination
+
+        Args:
+            granularity (str): "hour" or "day"
+            utc_offset (int, optional): Seconds added before bucketing
+
+        Returns:
+            list: Rows for RevenueRollup.load()
+        """
+        if not self.timestamps:
+            return []
+        size = GRANULARITIES[granularity]
+        np = import_numpy()
+        if np is not None:
+            grouped = self._aggregate_numpy(np, size, utc_offset)
+        else:
+            grouped = self._aggregate_python(size, utc_offset)
+
+        values = {dim: {code: value for value, code in self.dictionaries[dim].items()} for dim in DIMENSIONS}
+        return [
+            (bucket,) + tuple(values[dim][code] for dim, code in zip(DIMENSIONS, codes)) + tuple(sums)
+            for bucket, codes, sums in grouped
+        ]
+
+    def _aggregate_numpy(self, np, size, utc_offset):
+        timestamps = np.asarray(self.timestamps, dtype=np.float64)
+        buckets = ((timestamps + utc_offset) // size).astype(np.int64)
+        first_bucket = int(buckets.min())
+
+        # Pack bucket and dimension codes into one int64 (mixed radix) so
+        # grouping is a 1-D sort instead of a row-wise unique
+        radixes = [max(len(self.dictionaries[dim]), 1) for dim in DIMENSIONS]
+        keys = buckets - first_bucket
+        for dim, radix in zip(DIMENSIONS, radixes):
+            keys = keys * radix + np.asarray(self.codes[dim], dtype=np.int64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+        # bincount sums in float64, exact for integer satang below 2**53
+        sums = np.column_stack([
+            np.rint(np.bincount(inverse, weights=np.asarray(self.values[m], dtype=np.float64),
+                                minlength=len(unique_keys))).astype(np.int64)
+            for m in MEASURES
+        ])
+
+        codes = []
+        remaining = unique_keys
+        for radix in reversed(radixes):
+            codes.append(remaining % radix)
+            remaining = remaining // radix
+        bucket_starts = (remaining + first_bucket) * size - utc_offset
+        codes.reverse()
+
+        return [
+            (bucket, tuple(key_codes), tuple(row))
+            for bucket, key_codes, row in zip(bucket_starts.tolist(), zip(*(c.tolist() for c in codes)), sums.tolist())
+        ]
+
+    def _aggregate_python(self, size, utc_offset):
+        grouped = {}
+        columns = [self.codes[dim] for dim in DIMENSIONS]
+        measures = [self.values[m] for m in MEASURES]
+        for i, timestamp in enumerate(self.timestamps):
+            bucket = int((timestamp + utc_offset) // size * size - utc_offset)
+            key = (bucket, tuple(column[i] for column in columns))
+            sums = grouped.get(key)
+            if sums is None:
+                sums = grouped[key] = [0] * len(MEASURES)
+            for j, measure in enumerate(measures):
+                sums[j] += measure[i]
+        return [(bucket, codes, tuple(sums)) for (bucket, codes), sums in sorted(grouped.items())]
+
+
+def columns_from_events(events):
+    """
+    Extract payments and refunds from payment event log events
+
+    Checkout requests supply each order's route and merchant, accepted
+    SUCCESS webhooks the payments (first one per order) and successful
+    void/refund responses the refunds.
+
+    Args:
+        events (iterable): Events in time order, e.g. EventLogReader.scan_merged()
+
+    Returns:
+        RevenueColumns: Columnar payments and refunds
+    """
+    columns = RevenueColumns()
+    orders = {}
+
+    for event in events:
+        if not event.order_id:
+            continue
+        data = event.data
+        body = data.get('body') or {}
+        order = orders.setdefault(event.order_id, {})
+
+        if event.kind == KIND_REQUEST:
+            for field in ('merchant_id', 'route'):
+                if body.get(field):
+                    order[field] = body[field]
+
+        elif event.kind == KIND_WEBHOOK:
+            if not data.get('accepted') or body.get('status') != 'SUCCESS' or order.get('paid'):
+                continue
+            try:
+                satang = to_satang(body.get('amount', 0))
+            except ValueError:
+                continue
+            order.update(paid=True, amount=satang, payment_method=body.get('payment_method') or '')
+            if body.get('merchant_id'):
+                order['merchant_id'] = body['merchant_id']
+            columns.append(
+                event.timestamp,
+                (order['payment_method'], order.get('merchant_id', ''), order.get('route', '')),
+                payments=1, amount=satang
+            )
+
+        elif event.kind == KIND_RESPONSE and data.get('path') == '/api/payment/void-refund':
+            if data.get('status_code') != 200:
+                continue
+            amount = body.get('amount')
+            try:
+                satang = to_satang(amount) if amount else order.get('amount', 0)
+            except ValueError:
+                continue
+            columns.append(
+                event.timestamp,
+                (order.get('payment_method', ''), order.get('merchant_id', ''), order.get('route', '')),
+                refunds=1, refund_amount=satang
+            )
+
+    return columns
+
+
+def backfill(rollup, events, replace=True):
+    """
+    Rebuild rollup buckets from payment event log events
+
+    Args:
+        rollup (RevenueRollup): Rollups to write
+        events (iterable): Events in time order
+        replace (bool, optional): Replace the covered buckets
+
+    Returns:
+        int: Number of payments and refunds aggregated
+    """
+    columns = columns_from_events(events)
+    for granularity in GRANULARITIES:
+        rollup.load(columns.aggregate(granularity, rollup.utc_offset), granularity, replace=replace)
+    return len(columns)
+
+
+_rollup = None
+_rollup_lock = threading.Lock()
+
+
+def get_revenue_rollup():
+    """Get the process-wide rollup store, creating it on first use"""
+    global _rollup
+    if _rollup is None:
+        with _rollup_lock:
+            if _rollup is None:
+                _rollup = RevenueRollup(REVENUE_DB_PATH, utc_offset=REVENUE_UTC_OFFSET)
+    return _rollup
+
+
+def register_order(order_id, merchant_id=None, route=None):
+    """Record the route and merchant of a checkout; never raises"""
+    if not REVENUE_ENABLED or not order_id:
+        return
+    try:
+        get_revenue_rollup().register_order(order_id, merchant_id=merchant_id, route=route)
+    except Exception:
+        logger.exception(f"Failed to register order {order_id} for revenue rollups")
+
+
+def record_payment(webhook_data):
+    """
+    Count a SUCCESS webhook in the revenue rollups; never raises
+
+    Args:
+        webhook_data (dict): Verified webhook payload
+    """
+    if not REVENUE_ENABLED:
+        return
+    order_id = webhook_data.get('order_id')
+    try:
+        get_revenue_rollup().record_payment(
+            order_id,
+            webhook_data.get('amount', 0),
+            payment_method=webhook_data.get('payment_method'),
+            merchant_id=webhook_data.get('merchant_id')
+        )
+    except Exception:
+        logger.exception(f"Failed to record payment of order {order_id} in revenue rollups")
+
+
+def record_refund(order_id, amount=None, merchant_id=None):
+    """Count a void or refund in the revenue rollups; never raises"""
+    if not REVENUE_ENABLED:
+        return
+    try:
+        get_revenue_rollup().record_refund(order_id, amount, merchant_id=merchant_id)
+    except Exception:
+        logger.exception(f"Failed to record refund of order {order_id} in revenue rollups")
@@ -4,12 +4,27 @@ Signature generation and verification utilities for mPAY ONE API
 
 import hashlib
 import hmac
-import json
 import logging
 from config import API_SECRET_KEY
+from utils.json_codec import canonical_dumps
 
 logger = logging.getLogger(__name__)
 
+# HMAC with the key already absorbed; copied for every signature
+_signer = None
+
+def prime_signer():
+    """
+    Build the keyed HMAC state once so signatures only hash the payload
+    
+    Returns:
+        hmac.HMAC: Keyed HMAC-SHA256 state, to be copied before use
+    """
+    global _signer
+    if _signer is None:
+        _signer = hmac.new(API_SECRET_KEY.encode('utf-8'), digestmod=hashlib.sha256)
+    return _signer
+
 def generate_signature(data):
     """
     Generate HMAC signature for API requests
@@ -20,20 +35,26 @@ def generate_signature(data):
     Returns:
         str: Signature string
     """
-    # Sort keys alphabetically
-    sorted_data = {k: data[k] for k in sorted(data.keys())}
-    
-    # Convert to JSON string
-    json_str = json.dumps(sorted_data, separators=(',', ':'))
+    # Serialize with sorted keys and compact separators
+    return sign_canonical(canonical_dumps(data))
+
+def sign_canonical(canonical):
+    """
+    Generate the HMAC signature of an already serialized payload
     
+    Args:
+        canonical (bytes): Canonical JSON, see utils.json_codec.canonical_dumps()
+        
+    Returns:
+        str: Signature string
+    """
     # Create HMAC-SHA256 signature
-    signature = hmac.new(
-        API_SECRET_KEY.encode('utf-8'),
-        json_str.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
+    signer = (_signer or prime_signer()).copy()
+    signer.update(canonical)
+    signature = signer.hexdigest()
     
-    logger.debug(f"Generated signature for data: {json_str}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Generated signature for data: {canonical.decode('utf-8')}")
     
     return signature
 
@@ -45,11 +66,24 @@ def verify_signature(data, received_signature):
         data (dict): Webhook payload
         received_signature (str): Signature from webhook
         
+    Returns:
+        bool: True if signature is valid, False otherwise
+    """
+    return verify_canonical(canonical_dumps(data), received_signature)
+
+def verify_canonical(canonical, received_signature):
+    """
+    Verify the HMAC signature of an already serialized payload
+    
+    Args:
+        canonical (bytes): Canonical JSON the signature was computed over
+        received_signature (str): Signature from webhook
+        
     Returns:
         bool: True if signature is valid, False otherwise
     """
     # Generate signature from received data
-    calculated_signature = generate_signature(data)
+    calculated_signature = sign_canonical(canonical)
     
     # Compare signatures
     is_valid = hmac.compare_digest(calculated_signature, received_signature)
@@ -60,3 +94,21 @@ def verify_signature(data, received_signature):
         logger.debug("Signature verification successful")
     
     return is_valid
+
+def verify_signatures(items):
+    """
+    Verify many webhook signatures, e.g. when reprocessing stored webhooks
+    
+    Args:
+        items (list): (payload dict without its signature, received signature) pairs
+        
+    Returns:
+        list: True or False for each item
+    """
+    signer = _signer or prime_signer()
+    results = []
+    for data, received_signature in items:
+        mac = signer.copy()
+        mac.update(canonical_dumps(data))
+        results.append(isinstance(received_signature, str) and hmac.compare_digest(mac.hexdigest(), received_signature))
+    return results
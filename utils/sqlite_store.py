@@ -0,0 +1,88 @@
+"""
+SQLite files shared by the gunicorn workers
+
+SQLiteStore is the base of every store that keeps state shared between
+worker processes in a SQLite file: rate limit buckets, the replay guard,
+the outbox, revenue rollups, the transaction index, prefetched artifacts
+and the webhook fan-out queues.
+
+Each thread opens its own connection, and a process forked from one that
+already had a connection opens a new one, as SQLite connections must not
+cross a fork. Connections run in autocommit mode on a WAL journal, so
+readers never wait for the writer; batch() groups statements into one
+immediate transaction.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    """Base class of the SQLite stores shared between processes
+
+    Subclasses set ``schema`` to the statements creating their tables and
+    indexes, which run when the store is opened.
+    """
+
+    # Statements run with executescript() when the store is opened
+    schema = ''
+
+    # Seconds a statement waits for another process to release the write lock
+    timeout = 10
+
+    def __init__(self, path):
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        if self.schema:
+            conn.executescript(self.schema)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not be shared with a forked child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def batch(self):
+        """
+        Run the statements of the block as one transaction
+
+        The write lock is taken up front (BEGIN IMMEDIATE), so reads inside
+        the block see no other writer until it ends. Inside another batch
+        the block becomes a savepoint of the enclosing transaction.
+
+        Yields:
+            sqlite3.Connection: This thread's connection
+        """
+        conn = self._connection()
+        if conn.in_transaction:
+            conn.execute("SAVEPOINT store_batch")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK TO store_batch")
+                conn.execute("RELEASE store_batch")
+                raise
+            conn.execute("RELEASE store_batch")
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,345 @@
+"""
+Lightweight distributed tracing
+
+Spans follow the W3C Trace Context model: each request gets a trace id,
+outbound calls carry a ``traceparent`` header, and spans are exported as
+JSON Lines to a local file (or any exporter with an ``export(spans)``
+method standing in for a collector).
+
+Sampling is decided at the tail: spans are buffered per trace until the
+local root span ends, and the whole trace is kept when it was slow, had an
+error, was marked sampled by the caller, or falls in the base sample rate.
+Webhooks are correlated with the checkout that created the order by
+reusing the trace id recorded for its order_id.
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils import json_codec
+from config import (
+    TRACING_ENABLED, TRACE_EXPORT_PATH, TRACE_EXPORT_MAX_BYTES, TRACE_EXPORT_BACKUPS,
+    TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = 'traceparent'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value):
+    """
+    Parse a W3C traceparent header
+
+    Args:
+        value (str): Header value, "00-<trace_id>-<parent_id>-<flags>"
+
+    Returns:
+        tuple: (trace_id, parent_id, sampled) or None if the header is invalid
+    """
+    if not value:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    __slots__ = (
+        'name', 'trace_id', 'span_id', 'parent_id', 'local_root', 'start', 'end',
+        'attributes', 'error', 'sampled', '_token', '_started'
+    )
+
+    def __init__(self, name, trace_id, parent_id=None, local_root=False, sampled=False, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.local_root = local_root
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+        self._token = None
+        self._started = time.perf_counter()
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self._started if self.end is None else self.end - self.start
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error):
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Span returned while tracing is disabled"""
+
+    __slots__ = ()
+    trace_id = span_id = parent_id = error = None
+    traceparent = None
+    attributes = {}
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class FileSpanExporter:
+    """Append finished spans to a JSON Lines file
+
+    Once the file reaches ``max_bytes`` it is rotated to ``<path>.1`` (older
+    files shift up to ``<path>.<backups>``, the oldest is deleted), so
+    traces use at most ``(backups + 1) * max_bytes`` of disk.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = b''.join(json_codec.dumps_bytes(span.to_dict()) + b'\n' for span in spans)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(lines)
+                size = f.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        # Workers append to the same file; one that rotates just after
+        # another only shifts a near-empty file into the backups
+        try:
+            for n in range(self.backups, 0, -1):
+                source = f"{self.path}.{n - 1}" if n > 1 else self.path
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{n}")
+            if not self.backups:
+                os.remove(self.path)
+        except OSError:
+            logger.exception("Failed to rotate trace file")
+
+
+class Tracer:
+    """Create spans, propagate context and tail-sample finished traces"""
+
+    def __init__(self, exporter=None, enabled=True, sample_rate=0.01, slow_threshold=1.0,
+                 max_pending_traces=10000, max_correlations=100000):
+        self.exporter = exporter
+        self.enabled = enabled and exporter is not None
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_pending_traces = max_pending_traces
+        self.max_correlations = max_correlations
+
+        self._pending = OrderedDict()
+        self._correlations = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'kept': 0, 'dropped': 0, 'evicted': 0}
+
+    def current_span(self):
+        """Return the active span or a no-op span"""
+        return _current_span.get() or NOOP_SPAN
+
+    def start_span(self, name, attributes=None, traceparent=None, trace_id=None):
+        """
+        Start a span and make it the active span
+
+        The parent is the active span, else the remote parent from
+        ``traceparent``; with neither, a new trace is started (reusing
+        ``trace_id`` when given, e.g. for a correlated webhook).
+
+        Args:
+            name (str): Operation name
+            attributes (dict, optional): Initial attributes
+            traceparent (str, optional): Incoming W3C traceparent header
+            trace_id (str, optional): Trace id to join when starting a root span
+
+        Returns:
+            Span: The new span, to be passed to end_span()
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+
+        parent = _current_span.get()
+        if parent is not None:
+            span = Span(name, parent.trace_id, parent.span_id, sampled=parent.sampled, attributes=attributes)
+        else:
+            remote = parse_traceparent(traceparent)
+            if remote is not None:
+                span = Span(name, remote[0], remote[1], local_root=True, sampled=remote[2], attributes=attributes)
+            else:
+                span = Span(name, trace_id or _new_id(128), local_root=True, attributes=attributes)
+
+        span._token = _current_span.set(span)
+        return span
+
+    def end_span(self, span, error=None):
+        """
+        Finish a span and restore the previous active span
+
+        Args:
+            span (Span): Span returned by start_span()
+            error (Exception, optional): Error to record on the span
+        """
+        if span is NOOP_SPAN:
+            return
+        if error is not None:
+            span.record_error(error)
+        span.end = span.start + span.duration
+
+        if span._token is not None:
+            try:
+                _current_span.reset(span._token)
+            except ValueError:
+                # Ended from a different context than it was started in
+                _current_span.set(None)
+            span._token = None
+
+        with self._lock:
+            spans = self._pending.get(span.trace_id)
+            if spans is None:
+                spans = self._pending[span.trace_id] = []
+                if len(self._pending) > self.max_pending_traces:
+                    self._pending.popitem(last=False)
+                    self.counters['evicted'] += 1
+            spans.append(span)
+
+            if not span.local_root:
+                return
+            del self._pending[span.trace_id]
+            keep = self._should_keep(span, spans)
+            self.counters['kept' if keep else 'dropped'] += 1
+
+        if keep:
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                logger.exception("Failed to export trace spans")
+
+    def _should_keep(self, root, spans):
+        if root.sampled or root.duration >= self.slow_threshold:
+            return True
+        if any(s.error is not None for s in spans):
+            return True
+        return random.random() < self.sample_rate
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Context manager wrapping a block in a span
+
+        Exceptions are recorded on the span and re-raised.
+        """
+        span = self.start_span(name, attributes)
+        try:
+            yield span
+        except Exception as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+    def traced(self, name):
+        """Decorator running a function inside a span"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inject(self, headers):
+        """
+        Add the active span's traceparent to outbound headers
+
+        Args:
+            headers (dict): Outbound request headers, modified in place
+
+        Returns:
+            dict: The same headers
+        """
+        span = _current_span.get()
+        if span is not None:
+            headers[TRACEPARENT_HEADER] = span.traceparent
+        return headers
+
+    def correlate(self, key, trace_id):
+        """Remember the trace that handled an order or transaction"""
+        if not self.enabled or not key or not trace_id:
+            return
+        with self._lock:
+            self._correlations[key] = trace_id
+            self._correlations.move_to_end(key)
+            if len(self._correlations) > self.max_correlations:
+                self._correlations.popitem(last=False)
+
+    def correlated_trace(self, *keys):
+        """Return the trace id recorded for the first known key"""
+        with self._lock:
+            for key in keys:
+                if key and key in self._correlations:
+                    return self._correlations[key]
+        return None
+
+
+# Process-wide tracer
+tracer = Tracer(
+    FileSpanExporter(TRACE_EXPORT_PATH, max_bytes=TRACE_EXPORT_MAX_BYTES, backups=TRACE_EXPORT_BACKUPS),
+    enabled=TRACING_ENABLED,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_threshold=TRACE_SLOW_THRESHOLD
+)
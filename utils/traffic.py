@@ -0,0 +1,252 @@
+"""
+Capture of live payment traffic for replay benchmarks
+
+TrafficRecorder is WSGI middleware that records sanitized request and
+response pairs for /process-payment and the payment and webhook APIs.
+Card data and signatures are dropped and customer details are replaced by
+placeholders of the same length, so recordings keep the real mix of
+methods, banks, amounts and payload sizes without holding personal data.
+
+Each worker process appends to its own gzip-compressed JSONL file, one
+gzip member per batch of records. benchmarks/bench_replay.py replays the
+merged recordings against one or two builds of the app.
+"""
+
+import atexit
+import glob
+import gzip
+import io
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from urllib.parse import parse_qsl
+from utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+# Recorded body encodings
+BODY_JSON = 'json'
+BODY_FORM = 'form'
+
+# Fields dropped from recorded bodies: card data, signatures the replayer recomputes
+# and tokens for canceling prefetched artifacts
+DROPPED_FIELDS = frozenset({'card_number', 'cvv', 'card_token', 'signature', 'prefetch_token'})
+
+# Fields replaced by a placeholder of the same length
+MASKED_FIELDS = frozenset({
+    'customer_name', 'cardholder_name', 'customer_email', 'customer_phone', 'customer_address',
+})
+
+FILE_PATTERN = 'capture-*.jsonl.gz'
+
+# Streaming uploads, passed through so they are not buffered in memory
+UNCAPTURED_PATHS = frozenset({'/api/request-to-pay/bulk'})
+
+_recorders = weakref.WeakSet()
+
+
+def is_captured_path(path):
+    """Whether requests to a path are recorded"""
+    if path == '/process-payment':
+        return True
+    if path in UNCAPTURED_PATHS:
+        return False
+    return path.startswith('/api/') and not path.startswith('/api/admin/')
+
+
+def mask(value):
+    """Replace a personal value by a placeholder of the same length and shape"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = str(value)
+    if not isinstance(value, str):
+        return None
+    if '@' in value:
+        local, _, domain = value.partition('@')
+        return f"{'x' * len(local)}@{'x' * len(domain)}"
+    return ''.join('0' if c.isdigit() else 'x' if c.isalnum() else c for c in value)
+
+
+def sanitize(data):
+    """Return a copy of a request body without card data, signatures or personal details"""
+    if isinstance(data, dict):
+        return {
+            key: mask(value) if key in MASKED_FIELDS else sanitize(value)
+            for key, value in data.items() if key not in DROPPED_FIELDS
+        }
+    if isinstance(data, list):
+        return [sanitize(item) for item in data]
+    return data
+
+
+def decode_body(content_type, body):
+    """
+    Parse a request body for recording
+
+    Returns:
+        tuple: (encoding, parsed body), or (None, None) for other content types
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    try:
+        if content_type == 'application/json':
+            return BODY_JSON, json_codec.loads(body) if body else None
+        if content_type == 'application/x-www-form-urlencoded':
+            return BODY_FORM, dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None, None
+
+
+class _RecordingIterable:
+    """Response iterable that counts the bytes sent and records the pair on close"""
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._on_close(self.size)
+
+
+class TrafficRecorder:
+    """WSGI middleware recording sanitized payment traffic"""
+
+    def __init__(self, wsgi_app, directory, sample_rate=1.0, batch_size=256, max_body=1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        # Larger bodies are passed through unrecorded rather than buffered
+        self.max_body = max_body
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._pid = None
+        _recorders.add(self)
+
+    def __call__(self, environ, start_response):
+        if not is_captured_path(environ.get('PATH_INFO', '')):
+            return self.wsgi_app(environ, start_response)
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self.wsgi_app(environ, start_response)
+
+        # Buffer the body so both the app and the recording can read it; a
+        # chunked body has no length to buffer up to and is left to the app
+        if environ.get('HTTP_TRANSFER_ENCODING'):
+            return self.wsgi_app(environ, start_response)
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return self.wsgi_app(environ, start_response)
+        if length > self.max_body:
+            return self.wsgi_app(environ, start_response)
+        body = environ['wsgi.input'].read(length) if length > 0 else b''
+        environ['wsgi.input'] = io.BytesIO(body)
+
+        timestamp = time.time()
+        started = time.perf_counter()
+        status = [0]
+
+        def recording_start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        def record(response_size):
+            try:
+                self.record(environ, body, timestamp, time.perf_counter() - started, status[0], response_size)
+            except Exception:
+                logger.exception("Failed to record request")
+
+        return _RecordingIterable(self.wsgi_app(environ, recording_start_response), record)
+
+    def record(self, environ, body, timestamp, duration, status, response_size):
+        """Append one sanitized request and response pair"""
+        encoding, data = decode_body(environ.get('CONTENT_TYPE'), body)
+        entry = {
+            'ts': round(timestamp, 3),
+            'method': environ.get('REQUEST_METHOD', 'GET'),
+            'path': environ.get('PATH_INFO', ''),
+            'query': environ.get('QUERY_STRING', ''),
+            'encoding': encoding,
+            'body': sanitize(data),
+            'body_size': len(body),
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'response_size': response_size,
+        }
+        line = json_codec.dumps_bytes(entry) + b'\n'
+        with self._lock:
+            # A worker forked from a preloaded master starts its own file
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._buffer = []
+            self._buffer.append(line)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"capture-{self._pid}.jsonl.gz")
+        # Appended gzip members read back as one stream
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(b''.join(self._buffer)))
+        self._buffer = []
+
+    def flush(self):
+        """Write buffered records"""
+        with self._lock:
+            if self._pid == os.getpid():
+                self._flush()
+
+
+def flush_recorders(timeout=None):
+    """Write the records buffered by every recorder of this process; never raises"""
+    for recorder in list(_recorders):
+        try:
+            recorder.flush()
+        except Exception:
+            logger.exception(f"Failed to write traffic capture to {recorder.directory}")
+
+
+atexit.register(flush_recorders)
+
+
+def load_recordings(paths):
+    """
+    Read recorded traffic, merged across files in timestamp order
+
+    Args:
+        paths (list): Capture files, or directories holding them
+
+    Returns:
+        list: Recorded entries, oldest first
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, FILE_PATTERN))))
+        else:
+            files.append(path)
+
+    entries = []
+    for path in files:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json_codec.loads(line))
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
@@ -0,0 +1,323 @@
+"""
+Local transaction index for support searches
+
+Every order created through the payment API is indexed in a SQLite table
+shared by all workers, and updated by its webhooks. Support staff search it
+by order id prefix, customer email or phone, status, merchant and date
+range.
+
+Results are ordered newest first and paginated with a keyset cursor on
+(created_at, order_id), so every page is an index range scan however deep
+it is, and exports stream page by page instead of loading all rows.
+"""
+
+import base64
+import logging
+import re
+import threading
+import time
+from utils import json_codec
+from utils.sqlite_store import SQLiteStore
+from utils.pricing import to_satang, amount_value
+from config import TRANSACTIONS_ENABLED, TRANSACTIONS_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Payment method recorded for orders created through each endpoint
+PAYMENT_METHODS_BY_PATH = {
+    '/api/credit-card/payment': 'CREDIT_CARD',
+    '/api/credit-card/seamless/register': 'CREDIT_CARD',
+    '/api/qr/generate': 'QR',
+    '/api/rabbit-line-pay/payment': 'RABBIT_LINE_PAY',
+    '/api/installment/payment': 'INSTALLMENT',
+    '/api/banking/payment': 'INTERNET_BANKING',
+}
+
+# Columns returned by searches, in order
+COLUMNS = (
+    'order_id', 'merchant_id', 'transaction_id', 'payment_id', 'amount', 'currency',
+    'payment_method', 'customer_name', 'customer_email', 'customer_phone', 'status',
+    'created_at', 'updated_at'
+)
+
+
+def normalize_email(email):
+    """Lowercase and strip an email for indexing and lookup"""
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def normalize_phone(phone):
+    """Reduce a phone number to its last nine digits so 08x and +668x numbers match"""
+    digits = re.sub(r'\D', '', str(phone)) if phone else ''
+    return digits[-9:] or None
+
+
+def encode_cursor(row):
+    """Encode the keyset position after ``row`` as an opaque cursor"""
+    position = json_codec.dumps_bytes([row['created_at'], row['order_id']])
+    return base64.urlsafe_b64encode(position).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor()
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, order_id = json_codec.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(created_at), str(order_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class TransactionStore(SQLiteStore):
+    """SQLite index of orders and their payment status"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            order_id TEXT PRIMARY KEY,
+            merchant_id TEXT,
+            transaction_id TEXT,
+            payment_id TEXT,
+            amount INTEGER,
+            currency TEXT,
+            payment_method TEXT,
+            customer_name TEXT,
+            customer_email TEXT,
+            customer_phone TEXT,
+            phone_key TEXT,
+            status TEXT NOT NULL DEFAULT 'CREATED',
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_created ON transactions (created_at, order_id);
+        CREATE INDEX IF NOT EXISTS transactions_status ON transactions (status, created_at, order_id);
+        CREATE INDEX IF NOT EXISTS transactions_email ON transactions (customer_email, created_at, order_id);
+        CREATE INDEX IF NOT EXISTS transactions_phone ON transactions (phone_key, created_at, order_id);
+        CREATE INDEX IF NOT EXISTS transactions_merchant ON transactions (merchant_id, created_at, order_id);
+    """
+
+    def record_order(self, payload, payment_method=None, now=None):
+        """
+        Index a newly created order
+
+        Fields already known for the order are kept when the payload does
+        not carry them.
+
+        Args:
+            payload (dict): Payment request payload
+            payment_method (str, optional): Payment method of the endpoint
+            now (float, optional): Creation time
+        """
+        if now is None:
+            now = time.time()
+        try:
+            amount = to_satang(payload['amount']) if payload.get('amount') is not None else None
+        except ValueError:
+            amount = None
+
+        self._connection().execute(
+            """
+            INSERT INTO transactions (
+                order_id, merchant_id, transaction_id, amount, currency, payment_method,
+                customer_name, customer_email, customer_phone, phone_key, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (order_id) DO UPDATE SET
+                merchant_id = COALESCE(excluded.merchant_id, merchant_id),
+                transaction_id = COALESCE(excluded.transaction_id, transaction_id),
+                amount = COALESCE(excluded.amount, amount),
+                currency = COALESCE(excluded.currency, currency),
+                payment_method = COALESCE(excluded.payment_method, payment_method),
+                customer_name = COALESCE(excluded.customer_name, customer_name),
+                customer_email = COALESCE(excluded.customer_email, customer_email),
+                customer_phone = COALESCE(excluded.customer_phone, customer_phone),
+                phone_key = COALESCE(excluded.phone_key, phone_key),
+                updated_at = excluded.updated_at
+            """,
+            (
+                payload['order_id'], payload.get('merchant_id'), payload.get('transaction_id'), amount,
+                payload.get('currency'), payment_method, payload.get('customer_name') or None,
+                normalize_email(payload.get('customer_email')), payload.get('customer_phone') or None,
+                normalize_phone(payload.get('customer_phone')), now, now
+            )
+        )
+
+    def record_webhook(self, webhook_data, now=None):
+        """
+        Apply a verified webhook to its order
+
+        Args:
+            webhook_data (dict): Webhook payload
+            now (float, optional): Time of the update
+        """
+        if now is None:
+            now = time.time()
+        try:
+            amount = to_satang(webhook_data['amount']) if webhook_data.get('amount') is not None else None
+        except ValueError:
+            amount = None
+
+        self._connection().execute(
+            """
+            INSERT INTO transactions (
+                order_id, merchant_id, payment_id, amount, currency, payment_method, status, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (order_id) DO UPDATE SET
+                merchant_id = COALESCE(merchant_id, excluded.merchant_id),
+                payment_id = COALESCE(excluded.payment_id, payment_id),
+                amount = COALESCE(amount, excluded.amount),
+                currency = COALESCE(currency, excluded.currency),
+                payment_method = COALESCE(excluded.payment_method, payment_method),
+                status = excluded.status,
+                updated_at = excluded.updated_at
+            """,
+            (
+                webhook_data['order_id'], webhook_data.get('merchant_id'), webhook_data.get('payment_id'),
+                amount, webhook_data.get('currency'), webhook_data.get('payment_method'),
+                webhook_data['status'], now, now
+            )
+        )
+
+    def statuses(self, order_ids):
+        """
+        Return the current status of each known order
+
+        Args:
+            order_ids (list): Order ids to look up
+
+        Returns:
+            dict: order_id -> status for orders in the index
+        """
+        statuses = {}
+        conn = self._connection()
+        order_ids = list(order_ids)
+        # Stay well under SQLite's bound parameter limit
+        for start in range(0, len(order_ids), 500):
+            chunk = order_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT order_id, status FROM transactions WHERE order_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            statuses.update(rows)
+        return statuses
+
+    def search(self, order_id_prefix=None, email=None, phone=None, status=None, merchant_id=None,
+               start=None, end=None, cursor=None, limit=50):
+        """
+        Find transactions, newest first
+
+        Args:
+            order_id_prefix (str, optional): Order id prefix
+            email (str, optional): Customer email, case-insensitive
+            phone (str, optional): Customer phone in any format
+            status (str, optional): Status, e.g. "SUCCESS"
+            merchant_id (str, optional): Merchant id
+            start (float, optional): Earliest created_at (inclusive)
+            end (float, optional): Latest created_at (exclusive)
+            cursor (str, optional): Cursor returned with the previous page
+            limit (int, optional): Page size
+
+        Returns:
+            tuple: (list of row dicts, next cursor or None)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        conditions = []
+        params = []
+
+        if order_id_prefix:
+            # A range on the primary key instead of LIKE, which SQLite only indexes
+            # with case_sensitive_like enabled
+            conditions.append("order_id >= ? AND order_id < ?")
+            params.extend([order_id_prefix, order_id_prefix + '\U0010ffff'])
+        for column, value in (
+            ('customer_email', normalize_email(email)),
+            ('phone_key', normalize_phone(phone)),
+            ('status', status),
+            ('merchant_id', merchant_id),
+        ):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            conditions.append("created_at >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("created_at < ?")
+            params.append(end)
+        if cursor:
+            conditions.append("(created_at, order_id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM transactions {where}"
+            f" ORDER BY created_at DESC, order_id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        results = [self._row_dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(results[-1]) if len(rows) > limit else None
+        return results, next_cursor
+
+    def iter_search(self, page_size=500, **criteria):
+        """
+        Yield every matching transaction, one page in memory at a time
+
+        Args:
+            page_size (int, optional): Rows fetched per query
+            **criteria: search() criteria, without cursor and limit
+
+        Yields:
+            dict: Transaction rows, newest first
+        """
+        cursor = None
+        while True:
+            rows, cursor = self.search(cursor=cursor, limit=page_size, **criteria)
+            yield from rows
+            if cursor is None:
+                return
+
+    @staticmethod
+    def _row_dict(row):
+        result = dict(zip(COLUMNS, row))
+        if result['amount'] is not None:
+            result['amount'] = amount_value(result['amount'])
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_transaction_store():
+    """Get the process-wide transaction store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TransactionStore(TRANSACTIONS_DB_PATH)
+    return _store
+
+
+def record_order(payload, payment_method=None):
+    """Index a created order; never raises"""
+    if not TRANSACTIONS_ENABLED or not payload.get('order_id'):
+        return
+    try:
+        get_transaction_store().record_order(payload, payment_method=payment_method)
+    except Exception:
+        logger.exception(f"Failed to index order {payload.get('order_id')}")
+
+
+def record_webhook(webhook_data):
+    """Apply a verified webhook to the transaction index; never raises"""
+    if not TRANSACTIONS_ENABLED:
+        return
+    try:
+        get_transaction_store().record_webhook(webhook_data)
+    except Exception:
+        logger.exception(f"Failed to index webhook for order {webhook_data.get('order_id')}")
@@ -0,0 +1,67 @@
+"""
+Local stand-in for mPAY ONE and Raja Ferry
+
+When UPSTREAM_MOCK_ENABLED is set, the shared HTTP session answers calls to
+both upstreams from this requests adapter instead of the network, after a
+fixed delay that stands in for the round trip. Replay benchmarks run with
+it so results depend on the build under test, not on the sandbox.
+"""
+
+import re
+import time
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from utils import json_codec
+
+# Canned replies by URL path; the first matching pattern wins
+REPLIES = (
+    (re.compile(r'/bookings/payment-status/bulk$'), {"status": "SUCCESS"}),
+    (re.compile(r'/bookings/(?P<booking_id>[^/]+)$'), {
+        "booking_id": None,
+        "customer": {"name": "Customer", "email": "customer@example.com", "phone": "0800000000"},
+        "payment": {"amount": 0, "currency": "THB"},
+        "trip": {"route": "Donsak - Samui"},
+    }),
+    (re.compile(r'/createlink$'), {"status": "SUCCESS", "payment_url": "https://pay.example/link"}),
+    (re.compile(r''), {"status": "SUCCESS", "message": "OK"}),
+)
+
+
+class MockUpstreamAdapter(BaseAdapter):
+    """requests transport answering every call with a canned JSON reply"""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = b''
+        if request.method != 'HEAD':
+            path = request.path_url.split('?', 1)[0]
+            for pattern, reply in REPLIES:
+                match = pattern.search(path)
+                if match:
+                    if 'booking_id' in reply:
+                        reply = dict(reply, booking_id=match.group('booking_id'))
+                    body = json_codec.dumps_bytes(reply)
+                    break
+
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict({
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(body)),
+        })
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,257 @@
+"""
+Sliding-window velocity checks for fraud screening
+
+Card-testing bots fire many small payment attempts from a few addresses or
+with throwaway customer details. Before a payment payload is signed and
+sent to mPAY ONE, every attempt is counted per customer email, phone,
+client IP, amount pattern and order, and rejected when any counter exceeds its
+rule's limit within the rule's window.
+
+Counters are ring buffers of per-interval counts, so a check is a handful
+of integer operations. Each rule keeps at most ``max_keys`` keys and
+evicts the least recently seen one first, which bounds memory no matter
+how many distinct values an attacker sends. Counters are per worker
+process: see benchmarks/bench_velocity.py for the bytes held per key.
+"""
+
+import logging
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from utils.rate_limit import parse_limit
+from config import VELOCITY_ENABLED, VELOCITY_RULES, VELOCITY_MAX_KEYS, VELOCITY_SMALL_AMOUNT
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowCounter:
+    """Per-key event counts over a sliding window
+
+    The window is split into ``buckets`` intervals; counts older than the
+    window fall out one interval at a time, so the count is exact to within
+    one interval.
+    """
+
+    def __init__(self, window, buckets=10, max_keys=100000):
+        self.window = window
+        self.buckets = buckets
+        self.interval = window / buckets
+        self.max_keys = max_keys
+        # key -> array of [interval number of the newest bucket, total, count per bucket...],
+        # unsigned 32-bit so a key costs 4 bytes per slot instead of a list of int objects
+        self._counters = OrderedDict()
+        self._empty = array('I', [0]) * (buckets + 2)
+        # Intervals are numbered from the first event so they fit in 32 bits
+        self._origin = None
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def _epoch(self, now):
+        """Return the number of the interval containing ``now``"""
+        epoch = int((time.time() if now is None else now) / self.interval)
+        if self._origin is None:
+            self._origin = epoch
+        # A clock stepping back before the first event counts into the first interval
+        return max(0, epoch - self._origin)
+
+    def hit(self, key, now=None):
+        """
+        Count an event and return the count within the window
+
+        Args:
+            key (str): Counter key
+            now (float, optional): Current time
+
+        Returns:
+            int: Events for ``key`` within the window, including this one
+        """
+        epoch = self._epoch(now)
+        counters = self._counters
+        entry = counters.get(key)
+
+        if entry is None:
+            entry = self._empty[:]
+            entry[0] = epoch
+            counters[key] = entry
+            if len(counters) > self.max_keys:
+                counters.popitem(last=False)
+                self.evictions += 1
+        else:
+            counters.move_to_end(key)
+            gap = epoch - entry[0]
+            if gap >= self.buckets:
+                entry[1:] = self._empty[1:]
+            elif gap > 0:
+                # Clear the buckets that fell out of the window
+                for i in range(entry[0] + 1, epoch + 1):
+                    index = 2 + i % self.buckets
+                    entry[1] -= entry[index]
+                    entry[index] = 0
+            entry[0] = max(entry[0], epoch)
+
+        entry[2 + entry[0] % self.buckets] += 1
+        entry[1] += 1
+        return entry[1]
+
+    def count(self, key, now=None):
+        """Return the count within the window without recording an event"""
+        entry = self._counters.get(key)
+        if entry is None:
+            return 0
+        epoch = self._epoch(now)
+        gap = epoch - entry[0]
+        if gap >= self.buckets:
+            return 0
+        expired = sum(entry[2 + i % self.buckets] for i in range(entry[0] + 1, epoch + 1))
+        return entry[1] - expired
+
+
+def _email_key(payload, client_ip):
+    email = payload.get('customer_email')
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def _phone_key(payload, client_ip):
+    phone = payload.get('customer_phone')
+    digits = re.sub(r'\D', '', str(phone)) if phone else ''
+    # Compare local numbers and +66 numbers alike
+    return digits[-9:] or None
+
+
+def _ip_key(payload, client_ip):
+    return client_ip or None
+
+
+def _small_amount_key(payload, client_ip):
+    # Card testers probe with tiny amounts; ferry fares are far above the threshold
+    try:
+        amount = float(payload.get('amount'))
+    except (TypeError, ValueError):
+        return None
+    if amount >= VELOCITY_SMALL_AMOUNT:
+        return None
+    return str(payload.get('merchant_id', ''))
+
+
+def _order_key(payload, client_ip):
+    # Bounds retries against one order, e.g. cycling card tokens from many addresses
+    order_id = payload.get('order_id')
+    return str(order_id) if order_id else None
+
+
+# Rule name -> function extracting the counter key from a payment payload
+KEY_FUNCTIONS = {
+    'email': _email_key,
+    'phone': _phone_key,
+    'ip': _ip_key,
+    'small_amount': _small_amount_key,
+    'order': _order_key,
+}
+
+
+def parse_rules(spec):
+    """
+    Parse velocity rules
+
+    Args:
+        spec (str): Comma separated "<rule>:<attempts>/<seconds>" entries,
+            e.g. "email:5/600,ip:20/300"
+
+    Returns:
+        list: (name, limit, window) tuples
+
+    Raises:
+        ValueError: If a rule name is unknown or a limit is invalid
+    """
+    rules = []
+    for entry in spec.split(','):
+        name, _, limit = entry.strip().partition(':')
+        if not name:
+            continue
+        if name not in KEY_FUNCTIONS:
+            raise ValueError(f"Unknown velocity rule: {name}")
+        parsed = parse_limit(limit)
+        if parsed is None:
+            continue
+        rate, capacity = parsed
+        rules.append((name, int(capacity), capacity / rate))
+    return rules
+
+
+class VelocityEngine:
+    """Apply all velocity rules to payment attempts"""
+
+    def __init__(self, rules, max_keys=100000, buckets=10):
+        self.rules = [
+            (name, KEY_FUNCTIONS[name], limit, SlidingWindowCounter(window, buckets=buckets, max_keys=max_keys))
+            for name, limit, window in rules
+        ]
+        self._lock = threading.Lock()
+        self.counters = {'checked': 0, 'blocked': 0}
+
+    def check(self, payload, client_ip=None, now=None):
+        """
+        Count a payment attempt against every rule
+
+        Every attempt is counted, including blocked ones, so a bot that
+        keeps retrying stays blocked.
+
+        Args:
+            payload (dict): Payment request payload
+            client_ip (str, optional): Client address
+            now (float, optional): Current time
+
+        Returns:
+            str: Name of the first exceeded rule, or None to allow
+        """
+        if now is None:
+            now = time.time()
+        violated = None
+        with self._lock:
+            self.counters['checked'] += 1
+            for name, key_function, limit, counter in self.rules:
+                key = key_function(payload, client_ip)
+                if key is None:
+                    continue
+                if counter.hit(key, now) > limit and violated is None:
+                    violated = name
+            if violated:
+                self.counters['blocked'] += 1
+
+        if violated:
+            logger.warning(f"Velocity rule {violated} exceeded for order {payload.get('order_id')} from {client_ip}")
+        return violated
+
+    def stats(self):
+        """Return counters and the number of tracked keys per rule"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['rules'] = {
+                name: {'limit': limit, 'window': counter.window, 'keys': len(counter), 'evictions': counter.evictions}
+                for name, _, limit, counter in self.rules
+            }
+            return stats
+
+
+# Process-wide engine used by the payment resources
+velocity_engine = VelocityEngine(parse_rules(VELOCITY_RULES), max_keys=VELOCITY_MAX_KEYS)
+
+
+def screen_payment(payload, client_ip):
+    """
+    Screen a payment attempt before it is signed
+
+    Args:
+        payload (dict | models.PaymentOrder): Payment request payload
+        client_ip (str): Client address
+
+    Returns:
+        str: Name of the exceeded rule, or None to allow
+    """
+    if not VELOCITY_ENABLED:
+        return None
+    return velocity_engine.check(payload, client_ip)
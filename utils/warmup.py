@@ -0,0 +1,134 @@
+"""
+Warm-up of a freshly started worker
+
+The first checkout on a new worker used to pay for template compilation,
+the first pass through Flask's request machinery, HMAC key setup, DNS
+lookups and TCP/TLS handshakes to mPAY ONE and Raja Ferry. These steps
+run before the worker reports ready instead.
+
+warm_up_app() is process-independent and belongs in the server master
+before fork, so workers inherit compiled templates. warm_up_worker() opens
+sockets and must run in every worker after fork.
+"""
+
+import logging
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+from utils.signature import prime_signer, generate_signature
+from utils.http_client import get_session
+from config import (
+    MPAY_ONE_BASE_URL, RAJA_FERRY_API_URL, WARMUP_TIMEOUT, WARMUP_CONNECTIONS, UPSTREAM_MOCK_ENABLED
+)
+
+logger = logging.getLogger(__name__)
+
+# Upstreams the worker keeps pooled connections to
+UPSTREAMS = (MPAY_ONE_BASE_URL, RAJA_FERRY_API_URL)
+
+
+def warm_up_app(app):
+    """
+    Compile templates and run one request through the app
+
+    Args:
+        app (flask.Flask): Application
+
+    Returns:
+        float: Seconds spent
+    """
+    started = time.perf_counter()
+    for name in os.listdir(app.jinja_loader.searchpath[0]):
+        if name.endswith('.html'):
+            app.jinja_env.get_template(name)
+
+    # Builds the URL map, JSON provider and request hooks
+    with app.test_client() as client:
+        client.get('/healthz')
+
+    elapsed = time.perf_counter() - started
+    logger.debug(f"App warm-up took {elapsed * 1000:.1f}ms")
+    return elapsed
+
+
+def _open_connection(url, timeout):
+    # Any response, even an error status, leaves a kept-alive connection in the pool
+    response = get_session().head(url, timeout=timeout, allow_redirects=False)
+    response.close()
+    return response.status_code
+
+
+def warm_up_connections(urls=UPSTREAMS, connections=2, timeout=5.0):
+    """
+    Resolve upstream hosts and open pooled connections to them
+
+    Failures are logged and ignored; the first real call then connects as
+    it would without warm-up.
+
+    Args:
+        urls (tuple, optional): Upstream base URLs
+        connections (int, optional): Connections to open per upstream
+        timeout (float, optional): Seconds to spend at most
+
+    Returns:
+        int: Number of connections opened
+    """
+    deadline = time.monotonic() + timeout
+    targets = []
+    for url in urls:
+        parts = urlsplit(url)
+        if not parts.hostname:
+            continue
+        try:
+            socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                               type=socket.SOCK_STREAM)
+        except OSError as e:
+            logger.warning(f"Warm-up could not resolve {parts.hostname}: {e}")
+            continue
+        targets.extend([url] * connections)
+
+    if not targets:
+        return 0
+
+    # Concurrent requests so each one takes its own pooled connection
+    opened = 0
+    executor = ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='warmup')
+    futures = {executor.submit(_open_connection, url, max(0.1, deadline - time.monotonic())): url for url in targets}
+    done, _ = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    executor.shutdown(wait=False)
+    for future in done:
+        try:
+            future.result()
+            opened += 1
+        except Exception as e:
+            logger.warning(f"Warm-up connection to {futures[future]} failed: {e}")
+    return opened
+
+
+def warm_up_worker():
+    """
+    Prepare this worker's signing state and upstream connections
+
+    Returns:
+        dict: Seconds spent per step and connections opened
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    prime_signer()
+    generate_signature({'merchant_id': '', 'order_id': '', 'amount': 0.0})
+    timings['signing'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # The local upstream mock has no connections to open
+    connections = 0 if UPSTREAM_MOCK_ENABLED else WARMUP_CONNECTIONS
+    timings['connections'] = warm_up_connections(connections=connections, timeout=WARMUP_TIMEOUT)
+    timings['upstreams'] = time.perf_counter() - started
+
+    logger.info(
+        f"Worker {os.getpid()} warm-up: signing {timings['signing'] * 1000:.1f}ms, "
+        f"{timings['connections']} upstream connections in {timings['upstreams'] * 1000:.1f}ms"
+    )
+    return timings
@@ -0,0 +1,405 @@
+"""
+Reprocessing of stored webhooks
+
+Streams webhook payloads from a JSONL file or from the payment event log
+and re-runs the webhook status handlers for them in a pool of worker
+processes. Events are partitioned by order id, so all webhooks of an order
+are applied by the same worker in their original order. Each worker
+verifies the signatures of a batch at once and applies the batch with one
+transaction per store.
+
+Progress is checkpointed as the number of source events (and, for files,
+the byte offset) before which every event has been applied, so an
+interrupted run resumes there. Events after the checkpoint may be applied
+again on resume; apart from a repeated Raja Ferry update the handlers are
+idempotent.
+
+In dry-run mode nothing is written: workers simulate the handlers and
+report every order whose status the run would change.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+import zlib
+from collections import Counter, deque
+from itertools import count, islice
+from utils import json_codec
+from utils.signature import verify_signatures
+from utils.event_log import EventLogReader, KIND_WEBHOOK
+from utils.outbox import get_outbox
+from utils.transactions import get_transaction_store
+from utils.webhooks import apply_webhook, webhook_batch, missing_fields, order_status
+from config import OUTBOX_ENABLED, TRANSACTIONS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+SOURCE_JSONL = 'jsonl'
+SOURCE_EVENTS = 'events'
+
+# Batches queued per worker before the reader waits
+QUEUE_DEPTH = 4
+
+
+class BackfillError(Exception):
+    """Raised when a worker fails to apply a batch"""
+
+
+class JsonlSource:
+    """Webhook payloads from a JSONL file, one signed payload per line
+
+    ``offset`` is the byte position after the last line read, where a
+    resumed run starts; stdin cannot seek, so a resume from it skips
+    ``skip`` events instead.
+    """
+
+    kind = SOURCE_JSONL
+
+    def __init__(self, path, offset=0, skip=0):
+        self.name = path
+        self.offset = offset
+        self.skip = skip
+
+    def __iter__(self):
+        """Yield (order_id, raw line, byte offset of the line)"""
+        stdin = self.name == '-'
+        stream = sys.stdin.buffer if stdin else open(self.name, 'rb')
+        try:
+            if self.offset and not stdin:
+                stream.seek(self.offset)
+            skip = self.skip
+            for line in stream:
+                start = self.offset
+                self.offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                try:
+                    order_id = json_codec.loads(line).get('order_id')
+                except (ValueError, AttributeError):
+                    order_id = None
+                yield order_id, line, start
+        finally:
+            if not stdin:
+                stream.close()
+
+
+class EventLogSource:
+    """Webhook records from the payment event log, in timestamp order"""
+
+    kind = SOURCE_EVENTS
+    offset = None
+
+    def __init__(self, root, skip=0):
+        self.name = root
+        self.skip = skip
+
+    def __iter__(self):
+        """Yield (order_id, raw record, None)"""
+        events = EventLogReader(self.name).scan_merged({KIND_WEBHOOK})
+        for event in islice(events, self.skip, None):
+            yield event.order_id, event.raw, None
+
+
+def load_checkpoint(path):
+    """Return the saved checkpoint, or None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            return json_codec.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    """Write a checkpoint atomically"""
+    temp = f"{path}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(json_codec.dumps_bytes(state))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+class BatchProcessor:
+    """Verify and apply batches of stored webhooks inside one worker"""
+
+    def __init__(self, source_kind, dry_run=False):
+        self.source_kind = source_kind
+        self.dry_run = dry_run
+        # Dry run: order_id -> (webhook status, booking status) before and after the run
+        self.before = {}
+        self.after = {}
+
+    def decode(self, raw, counts):
+        """Return (payload, signature), or None if the event is skipped"""
+        try:
+            data = json_codec.loads(raw)
+        except ValueError:
+            counts['malformed'] += 1
+            return None
+
+        if self.source_kind == SOURCE_EVENTS and isinstance(data, dict):
+            # Webhooks rejected on receipt (bad signature, replays) are never applied
+            if not data.get('accepted'):
+                counts['rejected'] += 1
+                return None
+            data = data.get('body')
+
+        if not isinstance(data, dict):
+            counts['malformed'] += 1
+            return None
+        return data, data.pop('signature', None)
+
+    def process(self, items):
+        """
+        Verify and apply one batch
+
+        Args:
+            items (list): Raw events of one partition, in source order
+
+        Returns:
+            Counter: Outcome counts
+        """
+        counts = Counter()
+        decoded = [event for event in (self.decode(raw, counts) for raw in items) if event is not None]
+
+        # Event log records written before signatures were kept were verified on receipt
+        signed = [(data, signature) for data, signature in decoded if signature is not None]
+        verified = iter(verify_signatures(signed))
+        valid = []
+        for data, signature in decoded:
+            if signature is None and self.source_kind == SOURCE_JSONL:
+                counts['unsigned'] += 1
+            elif signature is not None and not next(verified):
+                counts['invalid_signature'] += 1
+            elif missing_fields(data):
+                counts['missing_fields'] += 1
+            else:
+                valid.append(data)
+
+        if self.dry_run:
+            self.simulate(valid)
+        else:
+            with webhook_batch():
+                for data in valid:
+                    apply_webhook(data, deliver=False)
+        counts['applied'] += len(valid)
+        return counts
+
+    def simulate(self, webhooks):
+        """Track the statuses the webhooks would leave, reading current ones in bulk"""
+        unseen = list({data['order_id'] for data in webhooks if data['order_id'] not in self.after})
+        if unseen:
+            statuses = get_transaction_store().statuses(unseen) if TRANSACTIONS_ENABLED else {}
+            booking_statuses = get_outbox().latest_statuses(unseen) if OUTBOX_ENABLED else {}
+            for order_id in unseen:
+                self.before[order_id] = self.after[order_id] = (
+                    statuses.get(order_id), booking_statuses.get(order_id)
+                )
+
+        for data in webhooks:
+            order_id = data['order_id']
+            _, booking_status = self.after[order_id]
+            self.after[order_id] = (data['status'], order_status(data['status']) or booking_status)
+
+    def diff(self):
+        """Return the orders whose status the run would change"""
+        changes = []
+        for order_id, after in self.after.items():
+            before = self.before[order_id]
+            if before != after:
+                changes.append({
+                    'order_id': order_id,
+                    'status': [before[0], after[0]],
+                    'booking_status': [before[1], after[1]],
+                })
+        return changes
+
+
+def _run_worker(partition, source_kind, dry_run, log_level, batches, results):
+    # Ctrl-C reaches the whole process group; the parent decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, stream=sys.stderr)
+    processor = BatchProcessor(source_kind, dry_run)
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        batch_id, items = batch
+        try:
+            counts = processor.process(items)
+        except Exception as e:
+            logger.exception(f"Worker {partition} failed to apply batch {batch_id}")
+            results.put(('error', partition, batch_id, str(e)))
+            return
+        results.put(('done', partition, batch_id, counts))
+    results.put(('finished', partition, None, processor.diff() if dry_run else None))
+
+
+class WebhookBackfill:
+    """Fan stored webhooks out to worker processes, partitioned by order"""
+
+    def __init__(self, workers=None, batch_size=500, dry_run=False, checkpoint_path=None,
+                 checkpoint_interval=5.0, log_level='WARNING'):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.log_level = log_level
+
+        self.counts = Counter()
+        self.changes = []
+
+    def partition(self, order_id):
+        # Stable across runs, unlike hash()
+        return zlib.crc32((order_id or '').encode('utf-8')) % self.workers
+
+    def run(self, source, start=0):
+        """
+        Process every event of a source
+
+        Args:
+            source (JsonlSource|EventLogSource): Events to process
+            start (int, optional): Number of source events already processed,
+                i.e. the index of the first event the source yields
+
+        Returns:
+            Counter: Outcome counts over all events
+
+        Raises:
+            BackfillError: If a worker failed; the checkpoint stays before the failed batch
+            KeyboardInterrupt: If interrupted, after saving the checkpoint
+        """
+        context = multiprocessing.get_context()
+        self._results = context.Queue()
+        self._queues = [context.Queue(maxsize=QUEUE_DEPTH) for _ in range(self.workers)]
+        processes = [
+            context.Process(
+                target=_run_worker,
+                args=(p, source.kind, self.dry_run, self.log_level, self._queues[p], self._results),
+                name=f"webhook-backfill-{p}", daemon=True
+            )
+            for p in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        self._source = source
+        self._buffers = [[] for _ in range(self.workers)]
+        # (index, offset) of the first buffered event of each partition
+        self._heads = [None] * self.workers
+        # Dispatched batches not yet applied: (batch_id, (index, offset) of their first event)
+        self._pending = [deque() for _ in range(self.workers)]
+        self._batch_ids = count()
+        self._error = None
+        self._finished = 0
+        self._index = start
+        self._saved_at = time.monotonic()
+
+        try:
+            for order_id, raw, offset in source:
+                p = self.partition(order_id)
+                if not self._buffers[p]:
+                    self._heads[p] = (self._index, offset)
+                self._buffers[p].append(raw)
+                self._index += 1
+                if len(self._buffers[p]) >= self.batch_size:
+                    self._dispatch(p)
+
+            for p in range(self.workers):
+                if self._buffers[p]:
+                    self._dispatch(p)
+                self._put(p, None)
+            while self._finished < self.workers and self._error is None:
+                self._collect(timeout=1.0)
+                if self._finished < self.workers and not any(process.is_alive() for process in processes) \
+                        and self._results.empty():
+                    self._error = "worker exited unexpectedly"
+            if self._error is not None:
+                raise BackfillError(self._error)
+            self._checkpoint(force=True)
+        except BaseException:
+            # Failed or interrupted: stop the workers and keep the progress made
+            for process in processes:
+                process.terminate()
+            # Batches nobody will read must not hold up interpreter exit
+            for batches in self._queues:
+                batches.cancel_join_thread()
+            self._checkpoint(force=True)
+            raise
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+        return self.counts
+
+    def _dispatch(self, p):
+        batch_id = next(self._batch_ids)
+        self._pending[p].append((batch_id, self._heads[p]))
+        self._put(p, (batch_id, self._buffers[p]))
+        self._buffers[p] = []
+        self._heads[p] = None
+        self._collect()
+
+    def _put(self, p, item):
+        # Wait for room, but notice a failed worker instead of blocking forever
+        while True:
+            try:
+                self._queues[p].put(item, timeout=0.5)
+                return
+            except queue.Full:
+                self._collect()
+                if self._error is not None:
+                    raise BackfillError(self._error)
+
+    def _collect(self, timeout=None):
+        while True:
+            try:
+                if timeout is None:
+                    message = self._results.get_nowait()
+                else:
+                    message = self._results.get(timeout=timeout)
+                    timeout = None
+            except queue.Empty:
+                break
+            kind, p, batch_id, value = message
+            if kind == 'done':
+                self._pending[p].popleft()
+                self.counts.update(value)
+            elif kind == 'finished':
+                self._finished += 1
+                if value:
+                    self.changes.extend(value)
+            else:
+                self._error = f"worker {p}, batch {batch_id}: {value}"
+        self._checkpoint()
+
+    def _checkpoint(self, force=False):
+        if self.checkpoint_path is None or self.dry_run:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.checkpoint_interval:
+            return
+        self._saved_at = now
+
+        # Every event before the oldest unapplied one is done
+        unapplied = [pending[0][1] for pending in self._pending if pending]
+        unapplied.extend(head for head in self._heads if head is not None)
+        if unapplied:
+            index, offset = min(unapplied, key=lambda position: position[0])
+        else:
+            index, offset = self._index, self._source.offset
+        save_checkpoint(self.checkpoint_path, {
+            'source': self._source.name,
+            'events': index,
+            'offset': offset,
+            'counts': dict(self.counts),
+            'updated_at': time.time(),
+        })
@@ -0,0 +1,101 @@
+"""
+Processing of verified mPAY ONE webhooks
+
+The status handlers run by the webhook endpoint live here so the backfill
+tool (cli/webhook_backfill.py) can re-run exactly the same handling for
+stored notifications, outside of an HTTP request.
+"""
+
+import logging
+from contextlib import ExitStack, contextmanager
+from models import WEBHOOK_REQUIRED_FIELDS
+from utils.outbox import update_order_status, queue_order_status, get_outbox
+from utils.expiry import settle_order
+from utils.revenue import record_payment, get_revenue_rollup
+from utils.transactions import record_webhook, get_transaction_store
+from utils.fanout import publish_event, get_registry
+from config import OUTBOX_ENABLED, REVENUE_ENABLED, TRANSACTIONS_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Fields a webhook must carry to be processed
+REQUIRED_FIELDS = WEBHOOK_REQUIRED_FIELDS
+
+# Booking status sent to Raja Ferry, and the log message, per webhook status
+STATUS_HANDLERS = {
+    'SUCCESS': ('paid', "Payment successful"),
+    'PENDING': ('pending', "Payment pending"),
+    'FAILED': ('failed', "Payment failed"),
+    'AUTHORIZED': ('authorized', "Payment authorized"),
+    'CANCELED': ('canceled', "Payment canceled"),
+}
+
+
+def missing_fields(webhook_data):
+    """Return the required fields absent from a webhook"""
+    return [field for field in REQUIRED_FIELDS if not webhook_data.get(field)]
+
+
+def order_status(status):
+    """Return the Raja Ferry booking status for a webhook status, or None if unknown"""
+    handler = STATUS_HANDLERS.get(status)
+    return handler[0] if handler else None
+
+
+def apply_webhook(webhook_data, deliver=True):
+    """
+    Run the status handlers for a verified webhook
+
+    Args:
+        webhook_data (dict): Webhook payload without its signature
+        deliver (bool, optional): Deliver the booking update from this
+            process; batch jobs only queue it for the server's dispatchers
+
+    Returns:
+        str: Booking status queued for Raja Ferry, or None for an unknown status
+    """
+    status = webhook_data['status']
+    order_id = webhook_data['order_id']
+
+    # A terminal status stops the pending order from expiring
+    settle_order(order_id, status)
+    record_webhook(webhook_data)
+    # Subscribers get every verified webhook, delivered by their own dispatchers
+    publish_event(webhook_data, deliver)
+
+    handler = STATUS_HANDLERS.get(status)
+    if handler is None:
+        logger.warning(f"Unknown payment status: {status} for order {order_id}")
+        return None
+
+    booking_status, message = handler
+    logger.info(f"{message} for order {order_id}")
+    if deliver:
+        update_order_status(order_id, booking_status, webhook_data)
+    else:
+        queue_order_status(order_id, booking_status, webhook_data)
+    if status == 'SUCCESS':
+        record_payment(webhook_data)
+    return booking_status
+
+
+@contextmanager
+def webhook_batch():
+    """
+    Commit the effects of the webhooks applied inside the block together
+
+    Each store gets one transaction for the whole block instead of one per
+    write, which is what lets a backfill process thousands of webhooks a
+    second against the shared SQLite files.
+    """
+    with ExitStack() as stack:
+        if TRANSACTIONS_ENABLED:
+            stack.enter_context(get_transaction_store().batch())
+        if OUTBOX_ENABLED:
+            stack.enter_context(get_outbox().batch())
+        if REVENUE_ENABLED:
+            stack.enter_context(get_revenue_rollup().batch())
+        registry = get_registry()
+        if registry is not None:
+            stack.enter_context(registry.store.batch())
+        yield